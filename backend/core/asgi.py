@@ -10,7 +10,15 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+from django.core.handlers.asgi import ASGIRequest
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
+
+class Request(ASGIRequest):
+    # Resolved against the URLconf with the async views
+    urlconf = "core.asgi_urls"
+
+
 application = get_asgi_application()
+application.request_class = Request
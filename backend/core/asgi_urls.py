@@ -0,0 +1,12 @@
+from django.urls import path
+from songs.async_views import song_collection
+
+from .urls import urlpatterns as wsgi_urlpatterns
+
+# URLconf of requests served under ASGI, see core.asgi. The async views only
+# pay off on an event loop: under WSGI each request would hop onto one and
+# back to the sync viewset, so core.urls routes songs/ to SongViewSet.
+urlpatterns = [
+    path("api/v1/songs/", song_collection, name="song-collection"),
+    *wsgi_urlpatterns,
+]
@@ -0,0 +1,54 @@
+import zlib
+
+from django_redis.compressors.base import BaseCompressor
+from django_redis.exceptions import CompressorError
+
+
+class ThresholdCompressor(BaseCompressor):
+    """
+    django-redis compressor with a configurable algorithm and size threshold.
+    Values shorter than COMPRESS_MIN_LENGTH are stored raw, since compressing
+    them costs CPU and usually makes them bigger.
+
+    OPTIONS:
+        COMPRESSION_ALGORITHM: "zstd", "lz4" or "zlib"
+        COMPRESS_MIN_LENGTH: Size in bytes below which values are stored raw
+        COMPRESSION_LEVEL: Optional level passed to the algorithm
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.algorithm = options.get("COMPRESSION_ALGORITHM", "zstd")
+        self.min_length = int(options.get("COMPRESS_MIN_LENGTH", 256))
+        self.level = options.get("COMPRESSION_LEVEL")
+
+        if self.algorithm == "zstd":
+            import pyzstd
+
+            self._compress = lambda value: pyzstd.compress(value, self.level or 3)
+            self._decompress = pyzstd.decompress
+        elif self.algorithm == "lz4":
+            import lz4.frame
+
+            self._compress = lambda value: lz4.frame.compress(
+                value, compression_level=self.level or 0
+            )
+            self._decompress = lz4.frame.decompress
+        elif self.algorithm == "zlib":
+            self._compress = lambda value: zlib.compress(value, self.level or 6)
+            self._decompress = zlib.decompress
+        else:
+            raise ValueError(f"Unknown compression algorithm: {self.algorithm}")
+
+    def compress(self, value: bytes) -> bytes:
+        if len(value) < self.min_length:
+            return value
+        return self._compress(value)
+
+    def decompress(self, value: bytes) -> bytes:
+        try:
+            return self._decompress(value)
+        except Exception as e:
+            # Raw values below the threshold end up here, django-redis then
+            # hands them to the serializer untouched.
+            raise CompressorError(e)
@@ -0,0 +1,199 @@
+import base64
+import binascii
+import json
+from typing import Optional
+
+from django.conf import settings
+from django.db import NotSupportedError, connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .search import RANK_ANNOTATION
+
+# Cursor keys of the ordering columns
+_cursor_keys = {"created": "c", "id": "i", RANK_ANNOTATION: "s"}
+
+
+def estimate_count(queryset) -> Optional[int]:
+    """
+    Row count the Postgres planner estimates for a queryset, from table
+    statistics instead of a scan; None on other databases
+    """
+    if connections[queryset.db].vendor != "postgresql":
+        return None
+    try:
+        plan = json.loads(queryset.order_by().explain(format="json"))
+    except (NotSupportedError, ValueError):
+        return None
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination ordered on (-created, id). A cursor holds the
+    position of the row it starts after, and a page is read by seeking to
+    it in the matching (created DESC, id) index, so deep pages cost the
+    same as the first and no COUNT(*) runs. Search results, annotated with
+    a rank by core.search.SearchBackend, are ordered by that rank first.
+
+    Query parameters:
+        cursor: Opaque position taken from the `next` or `previous` links
+        page_size: Rows per page, up to LIST_MAX_PAGE_SIZE
+        count: "approximate" adds a `count` estimated by the planner
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    count_query_param = "count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = ["-created", "id"]
+        if RANK_ANNOTATION in queryset.query.annotations:
+            self.ordering.insert(0, f"-{RANK_ANNOTATION}")
+        cursor = self.decode_cursor(request)
+        self.count = (
+            estimate_count(queryset)
+            if request.query_params.get(self.count_query_param) == "approximate"
+            else None
+        )
+
+        reverse = False
+        queryset = queryset.order_by(*self.ordering)
+        if cursor is not None:
+            position, reverse = cursor
+            queryset = queryset.filter(self.seek(position, reverse))
+            if reverse:
+                queryset = queryset.reverse()
+
+        # One extra row tells whether there is a page beyond this one
+        rows = list(queryset[: self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.next_row = rows[-1] if rows and (has_more or reverse) else None
+        self.previous_row = (
+            rows[0]
+            if rows and cursor is not None and (has_more or not reverse)
+            else None
+        )
+        return rows
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.REST_FRAMEWORK["PAGE_SIZE"]
+        return max(1, min(page_size, settings.LIST_MAX_PAGE_SIZE))
+
+    def seek(self, position, reverse: bool) -> Q:
+        """
+        Rows after `position` in the ordering, or before it when reverse:
+        those past it in the first column, or tied on it and past it in
+        the next, and so on
+        """
+        condition, tied = Q(), Q()
+        for field in self.ordering:
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") != reverse else "gt"
+            condition |= tied & Q(**{f"{name}__{lookup}": position[name]})
+            tied &= Q(**{name: position[name]})
+        # None of them is before it in the first column. Redundant, but
+        # Postgres seeks the index with this bound, where it only filters
+        # the rows it scans with the ORs
+        first = self.ordering[0]
+        name = first.lstrip("-")
+        lookup = "lte" if first.startswith("-") != reverse else "gte"
+        return Q(**{f"{name}__{lookup}": position[name]}) & condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            encoded_position = json.loads(
+                base64.urlsafe_b64decode(encoded.encode("ascii"))
+            )
+            position = {
+                field.lstrip("-"): encoded_position[_cursor_keys[field.lstrip("-")]]
+                for field in self.ordering
+            }
+            position["created"] = parse_datetime(position["created"])
+            if position["created"] is None:
+                raise ValueError(encoded_position["c"])
+            if RANK_ANNOTATION in position:
+                position[RANK_ANNOTATION] = int(position[RANK_ANNOTATION])
+            return position, bool(encoded_position.get("r"))
+        except (binascii.Error, KeyError, TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+
+    def encode_cursor(self, row, reverse: bool) -> str:
+        position = {"c": row.created.isoformat(), "i": str(row.pk)}
+        if f"-{RANK_ANNOTATION}" in self.ordering:
+            position["s"] = getattr(row, RANK_ANNOTATION)
+        if reverse:
+            position["r"] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(position).encode("utf-8"))
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded.decode())
+
+    def get_next_link(self) -> Optional[str]:
+        if self.next_row is None:
+            return None
+        return self.encode_cursor(self.next_row, reverse=False)
+
+    def get_previous_link(self) -> Optional[str]:
+        if self.previous_row is None:
+            return None
+        return self.encode_cursor(self.previous_row, reverse=True)
+
+    def get_paginated_response(self, data):
+        response_data = {
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        }
+        if self.count is not None:
+            response_data = {"count": self.count, **response_data}
+        return Response(response_data)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "count": {"type": "integer", "nullable": True},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "schema": {"type": "integer"},
+            },
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "schema": {"type": "string", "enum": ["approximate"]},
+            },
+        ]
@@ -14,12 +14,16 @@ ALLOWED_HOSTS = ["*"]
 
 
 INSTALLED_APPS = [
+    # Replaces runserver with an ASGI server for the streaming endpoints
+    "daphne",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    # Trigram and full-text search lookups, see core.search
+    "django.contrib.postgres",
     "rest_framework",
     "drf_spectacular",
     "django_filters",
@@ -42,7 +46,7 @@ REST_FRAMEWORK = {
     ],
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
-        "rest_framework.filters.SearchFilter",
+        "core.search.SearchBackend",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
@@ -55,9 +59,15 @@ REST_FRAMEWORK = {
         "djangorestframework_camel_case.parser.CamelCaseMultiPartParser",
         "djangorestframework_camel_case.parser.CamelCaseJSONParser",
     ),
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
+    "DEFAULT_PAGINATION_CLASS": "core.pagination.KeysetPagination",
     "PAGE_SIZE": 10,
 }
+# Largest page of list endpoints' ?page_size=
+LIST_MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", "100"))
+# Postgres text search configuration lyrics and summaries are indexed and
+# ?search= is parsed with. Changing it takes `manage.py index_search` to
+# rebuild stored vectors.
+SEARCH_CONFIG = os.getenv("SEARCH_CONFIG", "english")
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
@@ -114,6 +124,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "core.wsgi.application"
+ASGI_APPLICATION = "core.asgi.application"
 
 
 DATABASES = {
@@ -136,6 +147,23 @@ CELERY_TIMEZONE = "UTC"
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 CELERY_TASK_SOFT_TIME_LIMIT = 25 * 60  # 25 minutes
+# Each stage of the analysis chain has its own queue and workers, so a
+# backlog in one stage does not hold up the others (see docker-compose.yml)
+CELERY_TASK_ROUTES = {
+    "fetch_lyrics_task": {"queue": "lyrics"},
+    "analyze_lyrics_task": {"queue": "analysis"},
+    "persist_analysis_task": {"queue": "persist"},
+}
+# Seconds between celery beat recounts of the songs/countries/ counts
+COUNTRY_COUNTS_REFRESH_INTERVAL = int(
+    os.getenv("COUNTRY_COUNTS_REFRESH_INTERVAL", "300")
+)
+CELERY_BEAT_SCHEDULE = {
+    "refresh-country-counts": {
+        "task": "refresh_country_counts_task",
+        "schedule": COUNTRY_COUNTS_REFRESH_INTERVAL,
+    },
+}
 
 
 CACHES = {
@@ -146,7 +174,28 @@ CACHES = {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         },
         "KEY_PREFIX": "lyrintel",
-    }
+    },
+    # Lyrics, existence and analysis payloads: compact serializer plus
+    # compression above a size threshold.
+    "songs": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": os.getenv("REDIS_URL", "redis://redis:6379/1"),
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "SERIALIZER": os.getenv(
+                "SONG_CACHE_SERIALIZER",
+                "django_redis.serializers.msgpack.MSGPackSerializer",
+            ),
+            "COMPRESSOR": os.getenv(
+                "SONG_CACHE_COMPRESSOR", "core.compressors.ThresholdCompressor"
+            ),
+            "COMPRESSION_ALGORITHM": os.getenv("SONG_CACHE_COMPRESSION", "zstd"),
+            "COMPRESS_MIN_LENGTH": int(
+                os.getenv("SONG_CACHE_COMPRESS_MIN_LENGTH", "256")
+            ),
+        },
+        "KEY_PREFIX": "lyrintel",
+    },
 }
 
 
@@ -212,10 +261,113 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
 OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "250"))
 OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", "0.1"))
+# Alternative API endpoint, e.g. a proxy or a local mock; empty uses OpenAI's
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# Batch analysis packs several songs into one request
+OPENAI_BATCH_TOKEN_BUDGET = int(os.getenv("OPENAI_BATCH_TOKEN_BUDGET", "6000"))
+OPENAI_BATCH_MAX_ITEMS = int(os.getenv("OPENAI_BATCH_MAX_ITEMS", "20"))
+# Most tokens OPENAI_MODEL writes in one reply, 4096 for gpt-3.5-turbo; a batch
+# holds at most this many over OPENAI_MAX_TOKENS songs
+OPENAI_MAX_OUTPUT_TOKENS = int(os.getenv("OPENAI_MAX_OUTPUT_TOKENS", "4096"))
+OPENAI_BATCH_MAX_RETRIES = int(os.getenv("OPENAI_BATCH_MAX_RETRIES", "1"))
+# "gazetteer" extracts countries locally and asks the model only for a summary,
+# "llm" asks the model for both
+COUNTRY_EXTRACTION = os.getenv("COUNTRY_EXTRACTION", "gazetteer")
+
+# Offline re-analysis through the reanalyze_songs management command
+ANALYSIS_BATCH_BACKEND = os.getenv(
+    "ANALYSIS_BATCH_BACKEND", "songs.batch_backends.OpenAIBatchBackend"
+)
+ANALYSIS_BATCH_DIR = os.getenv("ANALYSIS_BATCH_DIR", BASE_DIR / "batch_jobs")
+ANALYSIS_BATCH_MAX_REQUESTS = int(os.getenv("ANALYSIS_BATCH_MAX_REQUESTS", "50000"))
 
 MUSIXMATCH_API_BASE_URL = os.getenv(
     "MUSIXMATCH_API_BASE_URL", "https://api.musixmatch.com/ws/1.1"
 )
+MUSIXMATCH_POOL_SIZE = int(os.getenv("MUSIXMATCH_POOL_SIZE", "10"))
+MUSIXMATCH_TIMEOUT = float(os.getenv("MUSIXMATCH_TIMEOUT", "10"))  # seconds
+MUSIXMATCH_MAX_RETRIES = int(os.getenv("MUSIXMATCH_MAX_RETRIES", "3"))
+MUSIXMATCH_RETRY_BACKOFF = float(os.getenv("MUSIXMATCH_RETRY_BACKOFF", "0.5"))
+# Connections of the async client, shared by all songs of an async worker
+MUSIXMATCH_ASYNC_POOL_SIZE = int(os.getenv("MUSIXMATCH_ASYNC_POOL_SIZE", "100"))
 
 LYRICS_CACHE_TTL = int(os.getenv("LYRICS_CACHE_TTL", "86400"))  # 24 hours
 ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", "604800"))  # 1 week
+# zstd level of stored lyrics, written once and read rarely
+LYRICS_COMPRESSION_LEVEL = int(os.getenv("LYRICS_COMPRESSION_LEVEL", "19"))
+
+SONG_BATCH_MAX_SIZE = int(os.getenv("SONG_BATCH_MAX_SIZE", "500"))
+SONG_BATCH_CHECK_CONCURRENCY = int(os.getenv("SONG_BATCH_CHECK_CONCURRENCY", "10"))
+SONG_DRAIN_BATCH_SIZE = int(os.getenv("SONG_DRAIN_BATCH_SIZE", "50"))
+# A processing song whose worker has not renewed its claim for this long is
+# taken for abandoned, e.g. by a killed worker, and may be claimed again.
+# Longer than an analysis, rate limit waits included
+SONG_CLAIM_TIMEOUT = int(os.getenv("SONG_CLAIM_TIMEOUT", "1800"))  # seconds
+# How POST songs/ checks Musixmatch: "sync" blocks a thread on the check,
+# "async" awaits it on the event loop when served under ASGI, "optimistic"
+# skips it and lets the analysis mark unknown songs as errors. loadtest_create
+# has not shown "async" to be faster than "sync" yet.
+SONG_CREATE_MODE = os.getenv("SONG_CREATE_MODE", "sync")
+
+# "celery" analyzes each song in a Celery task, "async" leaves pending songs
+# to the run_async_worker command, which runs many of them in one process
+ANALYSIS_WORKER = os.getenv("ANALYSIS_WORKER", "celery")
+ASYNC_WORKER_CONCURRENCY = int(os.getenv("ASYNC_WORKER_CONCURRENCY", "200"))
+ASYNC_WORKER_CLAIM_SIZE = int(os.getenv("ASYNC_WORKER_CLAIM_SIZE", "50"))
+ASYNC_WORKER_POLL_INTERVAL = float(
+    os.getenv("ASYNC_WORKER_POLL_INTERVAL", "5")
+)  # seconds
+
+# Upstream rate limits shared by all workers through Redis; 0 disables a limit
+MUSIXMATCH_RATE_LIMIT_RPM = int(os.getenv("MUSIXMATCH_RATE_LIMIT_RPM", "600"))
+OPENAI_RATE_LIMIT_RPM = int(os.getenv("OPENAI_RATE_LIMIT_RPM", "3500"))
+OPENAI_RATE_LIMIT_TPM = int(os.getenv("OPENAI_RATE_LIMIT_TPM", "200000"))
+# Requests in flight per upstream, adapted to 429s and rate limit headers
+UPSTREAM_CONCURRENCY_INITIAL = int(os.getenv("UPSTREAM_CONCURRENCY_INITIAL", "10"))
+UPSTREAM_CONCURRENCY_MIN = int(os.getenv("UPSTREAM_CONCURRENCY_MIN", "1"))
+UPSTREAM_CONCURRENCY_MAX = int(os.getenv("UPSTREAM_CONCURRENCY_MAX", "100"))
+# Longer waits for a rate limit requeue the song instead of holding a worker
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))  # seconds
+# Backoff after a 429 without a Retry-After header
+RATE_LIMIT_DEFAULT_BACKOFF = float(
+    os.getenv("RATE_LIMIT_DEFAULT_BACKOFF", "20")
+)  # seconds
+# Rate limited songs are requeued this many times before they are marked failed
+RATE_LIMIT_MAX_REQUEUES = int(os.getenv("RATE_LIMIT_MAX_REQUEUES", "10"))
+# A request slot of a worker that died is freed after this long
+RATE_LIMIT_SLOT_TTL = float(os.getenv("RATE_LIMIT_SLOT_TTL", "120"))  # seconds
+
+# Server-sent analysis progress
+SONG_EVENTS_TTL = int(os.getenv("SONG_EVENTS_TTL", "3600"))  # 1 hour
+SONG_EVENTS_HEARTBEAT = float(os.getenv("SONG_EVENTS_HEARTBEAT", "15"))  # seconds
+SONG_EVENTS_MAX_DURATION = int(os.getenv("SONG_EVENTS_MAX_DURATION", "300"))
+# Lifetime of the signed tickets that open an event stream, see
+# songs.streams.issue_ticket
+SONG_STREAM_TICKET_TTL = int(os.getenv("SONG_STREAM_TICKET_TTL", "10"))  # seconds
+# Per-user streams multiplexing the status changes of all their songs
+SONG_STATUS_STREAM_MAXLEN = int(os.getenv("SONG_STATUS_STREAM_MAXLEN", "1000"))
+SONG_STATUS_READ_COUNT = int(os.getenv("SONG_STATUS_READ_COUNT", "100"))
+SONG_STATUS_LONG_POLL_TIMEOUT = float(
+    os.getenv("SONG_STATUS_LONG_POLL_TIMEOUT", "25")
+)  # seconds
+# Redis status records read by the status endpoints
+SONG_STATUS_RECORD_TTL = int(os.getenv("SONG_STATUS_RECORD_TTL", "86400"))  # 1 day
+SONG_STATUS_BULK_MAX_IDS = int(os.getenv("SONG_STATUS_BULK_MAX_IDS", "100"))
+
+# Concurrent identical upstream requests are coalesced behind a Redis lock.
+# Lock TTLs should exceed the slowest expected upstream call.
+SINGLE_FLIGHT_LYRICS_LOCK_TTL = float(
+    os.getenv("SINGLE_FLIGHT_LYRICS_LOCK_TTL", "15")
+)  # seconds
+SINGLE_FLIGHT_ANALYSIS_LOCK_TTL = float(
+    os.getenv("SINGLE_FLIGHT_ANALYSIS_LOCK_TTL", "60")
+)  # seconds
+SINGLE_FLIGHT_RESULT_TTL = int(os.getenv("SINGLE_FLIGHT_RESULT_TTL", "30"))  # seconds
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "0.1"))
+
+# In-process tier in front of Redis for lyrics and analysis lookups
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", "1024"))
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", "60"))  # seconds
+
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "10"))  # seconds
@@ -13,6 +13,7 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
     TokenVerifyView,
 )
+from songs.streams import song_events, song_status_changes, song_status_events
 from songs.views import SongViewSet
 from users.views import UserViewSet
 
@@ -22,6 +23,17 @@ router.register(r"songs", SongViewSet, basename="song")
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("api/v1/songs/<uuid:song_id>/events/", song_events, name="song-events"),
+    path(
+        "api/v1/songs/status-events/",
+        song_status_events,
+        name="song-status-events",
+    ),
+    path(
+        "api/v1/songs/status-changes/",
+        song_status_changes,
+        name="song-status-changes",
+    ),
     path("api/v1/", include(router.urls)),
     path("api/v1/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/v1/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import time
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import redis.asyncio as aioredis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from openai import AsyncOpenAI
+
+from . import cache_keys, events, metrics
+from .cache import song_cache
+from .clients import get_async_musixmatch_client
+from .rate_limits import OPENAI, UpstreamCall, UpstreamRateLimited, estimate_tokens
+from .services import (
+    RELEASE_LOCK_SCRIPT,
+    UNKNOWN_SUMMARY,
+    AnalysisService,
+    LyricsService,
+    SingleFlight,
+    SummaryStream,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Cache lookups and event publishing are short blocking Redis round-trips;
+# they run on the default executor so they never stall the event loop.
+# Not for ORM calls: each executor thread would open a database connection
+# that is never closed. Those go through the default, thread sensitive
+# sync_to_async, which runs them on the one thread that owns a connection.
+run_sync = partial(sync_to_async, thread_sensitive=False)
+
+_in_flight: Dict[str, "asyncio.Task"] = {}
+
+_loop_clients: Dict[str, Any] = {}
+
+
+def _loop_client(name: str, build: Callable[[], Any]) -> Any:
+    """Client bound to the running event loop, built on first use"""
+    loop = asyncio.get_running_loop()
+    entry = _loop_clients.get(name)
+    if entry is None or entry[0] is not loop:
+        entry = (loop, build())
+        _loop_clients[name] = entry
+    return entry[1]
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    # No SDK retries, like services.client
+    return _loop_client(
+        "openai",
+        lambda: AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            max_retries=0,
+        ),
+    )
+
+
+def get_async_redis() -> aioredis.Redis:
+    # Callers wait for a free connection rather than fail when songs burst
+    return _loop_client(
+        "redis",
+        lambda: aioredis.Redis(
+            connection_pool=aioredis.BlockingConnectionPool.from_url(
+                settings.CACHES["default"]["LOCATION"], socket_timeout=None
+            )
+        ),
+    )
+
+
+async def single_flight(
+    key: str, compute: Callable[[], Awaitable[T]], lock_ttl: float
+) -> T:
+    """
+    Async counterpart of services.single_flight. Concurrent callers in this
+    process await one shared computation; across processes the same Redis
+    lock and result key are used, so async and Celery workers coalesce
+    with each other.
+    """
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_shared_single_flight(key, compute, lock_ttl))
+        _in_flight[key] = task
+        task.add_done_callback(
+            lambda done: _in_flight.pop(key) if _in_flight.get(key) is done else None
+        )
+    else:
+        metrics.incr("singleflight.coalesced")
+    # A cancelled caller must not cancel the computation the others await
+    return await asyncio.shield(task)
+
+
+async def _shared_single_flight(
+    key: str, compute: Callable[[], Awaitable[T]], lock_ttl: float
+) -> T:
+    """The loop of services.single_flight, awaiting its I/O"""
+    flight = SingleFlight(key, lock_ttl)
+    try:
+        redis = get_async_redis()
+        while True:
+            result = await run_sync(cache.get)(flight.result_key, SingleFlight.MISSING)
+            if flight.shared(result):
+                return result
+            if await redis.set(
+                flight.lock_key, flight.token, nx=True, px=flight.lock_ms
+            ):
+                flight.locked = True
+                break
+            while await redis.exists(flight.lock_key) and flight.waiting():
+                await asyncio.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+            if flight.timed_out():
+                break
+    except Exception as e:
+        flight.unavailable(e)
+    if not flight.locked:
+        return await compute()
+
+    try:
+        result = await compute()
+        await run_sync(cache.set)(
+            flight.result_key, result, settings.SINGLE_FLIGHT_RESULT_TTL
+        )
+        return result
+    finally:
+        try:
+            await redis.eval(RELEASE_LOCK_SCRIPT, 1, flight.lock_key, flight.token)
+        except Exception as e:
+            flight.release_failed(e)
+
+
+class AsyncLyricsService:
+    @staticmethod
+    async def _get_matcher_lyrics(artist: str, title: str) -> Dict[str, Any]:
+        return await single_flight(
+            cache_keys.matcher_key(artist, title),
+            lambda: get_async_musixmatch_client().get(
+                "matcher.lyrics.get", q_artist=artist, q_track=title
+            ),
+            lock_ttl=settings.SINGLE_FLIGHT_LYRICS_LOCK_TTL,
+        )
+
+    @staticmethod
+    async def check_song_exists(artist: str, title: str) -> Tuple[bool, str]:
+        """
+        Check if a song exists in Musixmatch API, like
+        LyricsService.check_song_exists, caching the lyrics it returns
+
+        Returns:
+            Tuple[bool, str]: (exists, message)
+        """
+        cache_key = cache_keys.exists_key(artist, title)
+        lyrics_cache_key = cache_keys.lyrics_key(artist, title)
+        cached_result = await run_sync(song_cache.get)(cache_key)
+        result = LyricsService.cached_existence(
+            artist,
+            title,
+            cached_result,
+            cached_result is None
+            and bool(await run_sync(song_cache.get)(lyrics_cache_key)),
+        )
+        if result is not None:
+            return result
+
+        try:
+            data = await AsyncLyricsService._get_matcher_lyrics(artist, title)
+            result, lyrics = LyricsService.existence_from_reply(artist, title, data)
+            await run_sync(song_cache.set)(cache_key, result, settings.LYRICS_CACHE_TTL)
+            if lyrics:
+                await run_sync(song_cache.set)(
+                    lyrics_cache_key, lyrics, settings.LYRICS_CACHE_TTL
+                )
+            return result
+        except Exception as e:
+            return LyricsService.existence_error(artist, title, e)
+
+    @staticmethod
+    async def fetch_lyrics(artist: str, title: str) -> Tuple[bool, str, Optional[str]]:
+        """
+        Fetch lyrics from Musixmatch API, like LyricsService.fetch_lyrics
+
+        Returns:
+            Tuple[bool, str, Optional[str]]: (success, message, lyrics)
+        """
+        cache_key = cache_keys.lyrics_key(artist, title)
+        cached_lyrics = await run_sync(song_cache.get)(cache_key)
+        if cached_lyrics:
+            return LyricsService.cached_lyrics(artist, title, cached_lyrics)
+
+        try:
+            data = await AsyncLyricsService._get_matcher_lyrics(artist, title)
+            lyrics, error_message = LyricsService.read_matcher_reply(
+                artist, title, data
+            )
+            if lyrics is None:
+                return False, error_message, None
+
+            await run_sync(song_cache.set)(cache_key, lyrics, settings.LYRICS_CACHE_TTL)
+            logger.info("Lyrics for %s - %s fetched from API and cached", artist, title)
+
+            return True, "Lyrics fetched successfully", lyrics
+
+        except UpstreamRateLimited:
+            raise
+        except Exception as e:
+            return LyricsService.fetch_error(artist, title, e)
+
+
+class AsyncAnalysisService:
+    @staticmethod
+    async def _complete(
+        lyrics: str, on_summary: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> str:
+        """Async counterpart of AnalysisService._complete"""
+        request = AnalysisService.build_request(lyrics)
+        create = get_async_openai_client().chat.completions.with_raw_response.create
+        async with UpstreamCall(OPENAI, estimate_tokens(request)) as call:
+            if on_summary is None:
+                response = await call.acall_openai(create, request)
+                return response.choices[0].message.content
+
+            start = time.perf_counter()
+            summary_stream = SummaryStream()
+            stream = await call.acall_openai(create, {**request, "stream": True})
+            async for chunk in stream:
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if not summary_stream.content:
+                    metrics.incr("openai.first_token.count")
+                    metrics.incr(
+                        "openai.first_token.ms", (time.perf_counter() - start) * 1000
+                    )
+                summary = summary_stream.feed(chunk.choices[0].delta.content)
+                if summary:
+                    await on_summary(summary)
+            return summary_stream.content
+
+    @staticmethod
+    async def analyze_lyrics(
+        lyrics: str, on_summary: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> Tuple[bool, str, Dict[str, Any]]:
+        """
+        Analyze lyrics using OpenAI API, like AnalysisService.analyze_lyrics
+
+        Args:
+            lyrics: Lyrics to analyze
+            on_summary: Awaited with each streamed piece of the summary
+
+        Returns:
+            Tuple[bool, str, Dict[str, Any]]: (success, message, analysis_data)
+        """
+        if not lyrics:
+            logger.warning("No lyrics provided for analysis")
+            return False, "No lyrics to analyze", {}
+
+        cache_key = cache_keys.analysis_key(lyrics)
+        cached_analysis = await run_sync(song_cache.get)(cache_key)
+        if cached_analysis:
+            logger.info("Analysis fetched from cache")
+            return True, "Analysis fetched from cache", cached_analysis
+
+        try:
+            content = await single_flight(
+                cache_key,
+                lambda: AsyncAnalysisService._complete(lyrics, on_summary),
+                lock_ttl=settings.SINGLE_FLIGHT_ANALYSIS_LOCK_TTL,
+            )
+            success, message, analysis_data = AnalysisService.parse_analysis(content)
+            if success:
+                AnalysisService.add_countries(lyrics, analysis_data)
+            if success and analysis_data["summary"] != UNKNOWN_SUMMARY:
+                await run_sync(song_cache.set)(
+                    cache_key, analysis_data, settings.ANALYSIS_CACHE_TTL
+                )
+                logger.info("Lyrics analysis cached")
+
+            return success, message, analysis_data
+
+        except UpstreamRateLimited:
+            raise
+        except Exception as e:
+            logger.error("Error analyzing lyrics: %s", str(e), exc_info=True)
+            return False, f"Error analyzing lyrics: {str(e)}", {}
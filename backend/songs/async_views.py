@@ -0,0 +1,87 @@
+import json
+from typing import Any, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from djangorestframework_camel_case.util import camelize, underscoreize
+
+from . import creation, metrics
+from .async_services import AsyncLyricsService
+from .serializers import SongSerializer
+from .views import SongViewSet
+
+song_list = SongViewSet.as_view({"get": "list", "post": "create"})
+
+
+@csrf_exempt
+async def song_collection(request):
+    """
+    List and create songs. With SONG_CREATE_MODE "async", JSON create
+    requests await the Musixmatch existence check on the event loop instead
+    of holding a thread for it; everything else is served by SongViewSet.
+    """
+    if (
+        request.method == "POST"
+        and settings.SONG_CREATE_MODE == "async"
+        and request.content_type == "application/json"
+    ):
+        return await song_create(request)
+    return await sync_to_async(song_list)(request)
+
+
+async def song_create(request) -> HttpResponse:
+    """Async counterpart of SongViewSet.create, with the same responses"""
+    with metrics.concurrency("songs.create"):
+        try:
+            return await create_song(request)
+        except IntegrityError:
+            # A concurrent request added the same song; this time it is found
+            return await create_song(request)
+
+
+@sync_to_async
+def check_create(request) -> Tuple[Optional[Any], Optional[HttpResponse]]:
+    """
+    Run the authentication, permission and throttle checks of a
+    SongViewSet create. Returns the user, or the response refusing the
+    request, rendered as SongViewSet would have.
+    """
+    view = SongViewSet(action_map={"post": "create"}, args=(), kwargs={})
+    view.request = view.initialize_request(request)
+    view.headers = view.default_response_headers
+    try:
+        view.initial(view.request)
+    except Exception as exc:
+        response = view.finalize_response(view.request, view.handle_exception(exc))
+        return None, response.render()
+    return view.request.user, None
+
+
+async def create_song(request) -> HttpResponse:
+    user, refused = await check_create(request)
+    if refused is not None:
+        return refused
+    try:
+        data = underscoreize(json.loads(request.body or b"{}"))
+    except json.JSONDecodeError as e:
+        return JsonResponse({"detail": f"JSON parse error - {e}"}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({"detail": "Expected a JSON object."}, status=400)
+
+    serializer = SongSerializer(data=data)
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse(camelize(serializer.errors), status=400)
+    outcome, track = await sync_to_async(creation.find_song)(serializer, user)
+    if outcome is None:
+        outcome = creation.check_failed(
+            *await AsyncLyricsService.check_song_exists(
+                serializer.validated_data["artist"], serializer.validated_data["title"]
+            )
+        )
+    if outcome is None:
+        outcome = await sync_to_async(creation.queue_song)(serializer, user, track)
+    data, status_code = outcome
+    return JsonResponse(camelize(data), status=status_code)
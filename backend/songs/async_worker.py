@@ -0,0 +1,287 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from . import events, status_records
+from .async_services import (
+    AsyncAnalysisService,
+    AsyncLyricsService,
+    get_async_redis,
+    run_sync,
+)
+from .models import Lyrics, Song, Track
+from .rate_limits import UpstreamRateLimited, requeue_delay, waiting_message
+
+logger = logging.getLogger(__name__)
+
+WAKEUP_KEY = "lyrintel:async-worker:wakeup"
+
+# Enough tokens to wake every worker of a deployment
+WAKEUP_MAX_TOKENS = 64
+
+
+def notify() -> None:
+    """
+    Wake idle async workers after songs were queued. Best effort: an idle
+    worker also looks for pending songs every ASYNC_WORKER_POLL_INTERVAL.
+    """
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        pipe.lpush(WAKEUP_KEY, 1)
+        pipe.ltrim(WAKEUP_KEY, 0, WAKEUP_MAX_TOKENS - 1)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Failed to wake async workers: %s", e)
+
+
+@sync_to_async
+def claim_songs(limit: int) -> List[Song]:
+    """
+    Mark up to `limit` pending songs, or songs abandoned processing by a
+    dead worker, as processing and return them
+    """
+    close_old_connections()
+    with transaction.atomic():
+        song_ids = list(
+            Song.objects.select_for_update(skip_locked=True)
+            .filter(Song.objects.in_statuses(("pending",), retake_stale=True))
+            .order_by("created")
+            .values_list("id", flat=True)[:limit]
+        )
+        Song.objects.filter(id__in=song_ids).transition(
+            ("pending",),
+            retake_stale=True,
+            status="processing",
+            claimed_at=timezone.now(),
+        )
+    songs = list(Song.objects.select_related("track").filter(id__in=song_ids))
+    if songs:
+        status_records.publish(*songs)
+    return songs
+
+
+class AsyncWorker:
+    """
+    Runs the lyrics fetch and analysis of many songs at once on one event
+    loop. A semaphore of `concurrency` slots bounds the songs in flight;
+    songs are claimed from the database only when slots are free, so
+    several workers, or Celery drains, can share the pending songs.
+
+    Database writes go through Django's async ORM, which runs them one at a
+    time on a single thread and connection; they are short next to the
+    upstream calls.
+
+    A song held up by an upstream rate limit keeps its slot and is retried
+    once the limit resets, so a rate limited worker stops claiming songs.
+    """
+
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        claim_size: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+    ):
+        self.concurrency = concurrency or settings.ASYNC_WORKER_CONCURRENCY
+        self.claim_size = claim_size or settings.ASYNC_WORKER_CLAIM_SIZE
+        self.poll_interval = poll_interval or settings.ASYNC_WORKER_POLL_INTERVAL
+        self.processed = 0
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._tasks = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        """Stop claiming songs; the songs in flight are finished"""
+        self._stopping.set()
+
+    async def run(self, burst: bool = False) -> int:
+        """
+        Process pending songs until stopped, or with `burst` until none are
+        left, and return the number of songs processed
+        """
+        logger.info("Async worker started with %s slots", self.concurrency)
+        while not self._stopping.is_set():
+            await self._slots.acquire()
+            slots = 1
+            # Take every other free slot too, to claim songs in bulk
+            while slots < self.claim_size and not self._slots.locked():
+                await self._slots.acquire()
+                slots += 1
+
+            songs = await claim_songs(slots)
+            for _ in range(slots - len(songs)):
+                self._slots.release()
+            for song in songs:
+                task = asyncio.create_task(self._run_song(song))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            if songs:
+                continue
+            if not burst:
+                await self._wait_for_songs()
+            elif self._tasks:
+                await asyncio.wait([*self._tasks])
+            else:
+                break
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+        logger.info("Async worker stopped after %s songs", self.processed)
+        return self.processed
+
+    async def _wait_for_songs(self) -> None:
+        try:
+            await get_async_redis().blpop([WAKEUP_KEY], timeout=self.poll_interval)
+        except Exception as e:
+            logger.warning("Failed to wait for async worker wakeup: %s", e)
+            await asyncio.sleep(self.poll_interval)
+
+    async def _run_song(self, song: Song) -> None:
+        try:
+            for requeues in range(settings.RATE_LIMIT_MAX_REQUEUES + 1):
+                try:
+                    await self.process(song)
+                    break
+                except UpstreamRateLimited as e:
+                    if requeues == settings.RATE_LIMIT_MAX_REQUEUES:
+                        logger.error("Giving up on song %s: %s", song.id, str(e))
+                        await self._fail(song, f"Failed to analyze song: {e}")
+                        break
+                    delay = requeue_delay(e.retry_after)
+                    logger.warning(
+                        "Retrying song %s in %.0fs: %s", song.id, delay, str(e)
+                    )
+                    # Renewing the claim for the wait
+                    if not await self._transition(
+                        song,
+                        ("processing",),
+                        message=waiting_message(e.upstream, delay),
+                        claimed_at=timezone.now(),
+                    ):
+                        break
+                    await asyncio.sleep(delay)
+        finally:
+            self.processed += 1
+            self._slots.release()
+
+    @staticmethod
+    async def _transition(song: Song, from_statuses, **fields) -> bool:
+        """
+        Write changed columns of a song still in one of `from_statuses` with
+        one conditional UPDATE, like the Celery tasks, then apply them to
+        `song` and publish its status
+        """
+        updated = await Song.objects.filter(id=song.id).atransition(
+            from_statuses, **fields
+        )
+        if not updated:
+            logger.warning(
+                "Song %s is no longer %s", song.id, " or ".join(from_statuses)
+            )
+            return False
+        for name, value in fields.items():
+            setattr(song, name, value)
+        if "status" in fields or "message" in fields:
+            await run_sync(status_records.publish)(song)
+        return True
+
+    @staticmethod
+    async def _fail(song: Song, message: str, **fields) -> None:
+        if await AsyncWorker._transition(
+            song, ("processing",), status="error", message=message, **fields
+        ):
+            await run_sync(events.publish_stage)(song.id, events.STAGE_ERROR)
+
+    @staticmethod
+    async def _update_track(song: Song, **fields) -> None:
+        await Track.objects.filter(id=song.track_id).astore(**fields)
+
+    @staticmethod
+    async def _complete(song: Song) -> bool:
+        if not await AsyncWorker._transition(
+            song, ("processing",), status="completed", message=""
+        ):
+            return False
+        await run_sync(events.publish_stage)(song.id, events.STAGE_COMPLETED)
+        logger.info("Successfully analyzed song %s", song.id)
+        return True
+
+    @staticmethod
+    async def process(song: Song) -> bool:
+        """
+        Async counterpart of analyze_song_task for a claimed song. A
+        successful song costs two UPDATEs on top of the claim, one storing
+        the analysis on its track and one completing it; a song whose track
+        is already analyzed only the latter.
+
+        Raises:
+            UpstreamRateLimited: When an upstream is rate limiting us
+        """
+        song_id = song.id
+        logger.info("Starting analysis for song %s", song_id)
+
+        try:
+            if song.track.is_analyzed:
+                return await AsyncWorker._complete(song)
+            await run_sync(events.publish_stage)(song_id, events.STAGE_FETCHING_LYRICS)
+            lyrics_success, lyrics_message, lyrics = (
+                await AsyncLyricsService.fetch_lyrics(song.artist, song.title)
+            )
+            if not lyrics_success:
+                logger.error(
+                    "Failed to fetch lyrics for song %s: %s", song_id, lyrics_message
+                )
+                await AsyncWorker._fail(
+                    song, f"Failed to fetch lyrics: {lyrics_message}"
+                )
+                return False
+
+            await run_sync(events.publish_stage)(song_id, events.STAGE_ANALYZING)
+
+            async def on_summary(text: str) -> None:
+                await run_sync(events.publish_delta)(song_id, text)
+
+            analysis_success, analysis_message, analysis_data = (
+                await AsyncAnalysisService.analyze_lyrics(lyrics, on_summary)
+            )
+            if not analysis_success:
+                logger.error(
+                    "Failed to analyze lyrics for song %s: %s",
+                    song_id,
+                    analysis_message,
+                )
+                await AsyncWorker._update_track(
+                    song, **await sync_to_async(Lyrics.objects.track_fields)(lyrics)
+                )
+                await AsyncWorker._fail(
+                    song, f"Failed to analyze lyrics: {analysis_message}"
+                )
+                return False
+
+            await AsyncWorker._update_track(
+                song,
+                **await sync_to_async(Lyrics.objects.track_fields)(lyrics),
+                summary=analysis_data.get("summary", ""),
+                countries=analysis_data.get("countries", []),
+                analyzed_at=timezone.now(),
+            )
+            return await AsyncWorker._complete(song)
+
+        except UpstreamRateLimited:
+            raise
+        except Exception as e:
+            message = str(e)
+            logger.exception("Error analyzing song %s: %s", song_id, message)
+            try:
+                await AsyncWorker._fail(
+                    song, f"Unexpected error during analysis: {message}"
+                )
+            except Exception as inner_e:
+                logger.exception("Failed to update song error status: %s", str(inner_e))
+            return False
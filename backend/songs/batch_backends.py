@@ -0,0 +1,140 @@
+import json
+import logging
+import shutil
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+BATCH_PENDING = "pending"
+BATCH_COMPLETED = "completed"
+BATCH_FAILED = "failed"
+
+
+class BatchBackend:
+    """
+    Runs a JSONL file of chat completion requests offline. Each request
+    line has a custom_id, and each result line echoes it together with the
+    response body in the OpenAI Batch API output format.
+    """
+
+    def submit(self, request_path: Path) -> str:
+        """Submit a request file and return the batch ID"""
+        raise NotImplementedError
+
+    def status(self, batch_id: str) -> str:
+        """Return BATCH_PENDING, BATCH_COMPLETED or BATCH_FAILED"""
+        raise NotImplementedError
+
+    def download_results(self, batch_id: str, output_path: Path) -> None:
+        """Stream the result file of a finished batch to output_path"""
+        raise NotImplementedError
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Backend on top of the OpenAI Batch API"""
+
+    def __init__(self):
+        from .services import client
+
+        self.client = client
+
+    def submit(self, request_path: Path) -> str:
+        with open(request_path, "rb") as request_file:
+            uploaded = self.client.files.create(file=request_file, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        logger.info("Submitted %s as OpenAI batch %s", request_path, batch.id)
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        batch = self.client.batches.retrieve(batch_id)
+        # Expired batches still return the results of finished requests.
+        if batch.status in ("completed", "expired"):
+            return BATCH_COMPLETED
+        if batch.status in ("failed", "cancelling", "cancelled"):
+            return BATCH_FAILED
+        return BATCH_PENDING
+
+    def download_results(self, batch_id: str, output_path: Path) -> None:
+        batch = self.client.batches.retrieve(batch_id)
+        if not batch.output_file_id:
+            output_path.write_text("")
+            return
+        with self.client.files.with_streaming_response.content(
+            batch.output_file_id
+        ) as response:
+            response.stream_to_file(output_path)
+
+
+def default_local_responder(request: Dict) -> Dict:
+    """Deterministic stand-in for the model, answering every request alike"""
+    return {
+        "summary": "Locally analyzed song.",
+        "countries": [],
+    }
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for tests and local runs. Batches complete on submit;
+    each request is answered by a responder callable instead of the model.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[Path] = None,
+        responder: Callable[[Dict], Dict] = default_local_responder,
+    ):
+        self.directory = Path(directory or settings.ANALYSIS_BATCH_DIR) / "local"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.responder = responder
+
+    def submit(self, request_path: Path) -> str:
+        batch_id = f"local_{uuid.uuid4().hex}"
+        with open(request_path) as requests_file, open(
+            self.directory / f"{batch_id}.jsonl", "w"
+        ) as output_file:
+            for line in requests_file:
+                request = json.loads(line)
+                result = {
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {
+                            "choices": [
+                                {
+                                    "message": {
+                                        "role": "assistant",
+                                        "content": json.dumps(
+                                            self.responder(request["body"])
+                                        ),
+                                    }
+                                }
+                            ]
+                        },
+                    },
+                    "error": None,
+                }
+                output_file.write(json.dumps(result) + "\n")
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        if (self.directory / f"{batch_id}.jsonl").exists():
+            return BATCH_COMPLETED
+        return BATCH_FAILED
+
+    def download_results(self, batch_id: str, output_path: Path) -> None:
+        shutil.copyfile(self.directory / f"{batch_id}.jsonl", output_path)
+
+
+def get_batch_backend(path: Optional[str] = None) -> BatchBackend:
+    """Instantiate the batch backend at the given dotted path"""
+    return import_string(path or settings.ANALYSIS_BATCH_BACKEND)()
@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django_redis import get_redis_connection
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "lyrintel:cache:invalidate"
+
+_missing = object()
+
+
+class LocalCache:
+    """Thread-safe in-process LRU cache bounded by entry count and bytes"""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, size, value = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, timeout: Optional[float] = None) -> None:
+        ttl = self.ttl if timeout is None else min(self.ttl, timeout)
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        if ttl <= 0 or size > self.max_bytes:
+            self.delete(key)
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+
+class TieredCache:
+    """
+    In-process LRU tier in front of a Django cache backend.
+
+    Writes and deletions are broadcast over Redis pub/sub so every other
+    process drops its local copy; the short local TTL bounds staleness if a
+    message is missed.
+    """
+
+    def __init__(self, alias: str = "default"):
+        self.alias = alias
+        self.local = self._build_local()
+        # Identifies our own broadcasts, whose keys are already up to date
+        self._origin = uuid.uuid4().hex
+        self._listener_pid: Optional[int] = None
+        self._listener_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    @staticmethod
+    def _build_local() -> LocalCache:
+        return LocalCache(
+            max_entries=settings.LOCAL_CACHE_MAX_ENTRIES,
+            max_bytes=settings.LOCAL_CACHE_MAX_BYTES,
+            ttl=settings.LOCAL_CACHE_TTL,
+        )
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self._ensure_listener()
+        value = self.local.get(key, _missing)
+        if value is not _missing:
+            metrics.incr("cache.local.hits")
+            return value
+        metrics.incr("cache.local.misses")
+
+        value = self.backend.get(key, _missing)
+        if value is _missing:
+            metrics.incr("cache.redis.misses")
+            return default
+        metrics.incr("cache.redis.hits")
+        self.local.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any, timeout: Any = DEFAULT_TIMEOUT) -> None:
+        self.backend.set(key, value, timeout)
+        self.local.set(key, value, None if timeout is DEFAULT_TIMEOUT else timeout)
+        self._broadcast([key])
+
+    def delete(self, key: str) -> None:
+        self.delete_many([key])
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        self.backend.delete_many(keys)
+        for key in keys:
+            self.local.delete(key)
+        self._broadcast(keys)
+
+    def _broadcast(self, keys) -> None:
+        try:
+            get_redis_connection(self.alias).publish(
+                INVALIDATION_CHANNEL, json.dumps({"origin": self._origin, "keys": keys})
+            )
+        except Exception as e:
+            logger.warning("Failed to publish cache invalidation: %s", str(e))
+
+    def _ensure_listener(self) -> None:
+        pid = os.getpid()
+        if self._listener_pid == pid:
+            return
+        with self._listener_lock:
+            if self._listener_pid != pid:
+                threading.Thread(
+                    target=self._listen, name="cache-invalidation", daemon=True
+                ).start()
+                self._listener_pid = pid
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = get_redis_connection(self.alias).pubsub(
+                    ignore_subscribe_messages=True
+                )
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Invalidations sent while we were not subscribed are lost.
+                self.local.clear()
+                for message in pubsub.listen():
+                    invalidation = json.loads(message["data"])
+                    if invalidation["origin"] == self._origin:
+                        continue
+                    for key in invalidation["keys"]:
+                        self.local.delete(key)
+            except Exception as e:
+                logger.warning("Cache invalidation listener failed: %s", str(e))
+                self.local.clear()
+                time.sleep(1)
+
+    def _after_fork(self) -> None:
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        self.local = self._build_local()
+        self._origin = uuid.uuid4().hex
+
+
+song_cache = TieredCache("songs")
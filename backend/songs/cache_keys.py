@@ -0,0 +1,58 @@
+import hashlib
+import re
+import unicodedata
+
+from django.conf import settings
+
+# Bump when the layout of any cached value changes so old entries are ignored.
+CACHE_KEY_VERSION = 2
+
+_whitespace_re = re.compile(r"\s+")
+
+
+def normalize_text(value: str) -> str:
+    """
+    Normalize an artist or title so that spelling variants share a key:
+    NFKC folding, casefolding, punctuation removal and whitespace collapse.
+    """
+    value = unicodedata.normalize("NFKC", value or "").casefold()
+    value = "".join(
+        char for char in value if not unicodedata.category(char).startswith("P")
+    )
+    return _whitespace_re.sub(" ", value).strip()
+
+
+def digest(*parts: str) -> str:
+    """Stable BLAKE2b digest of the given parts, identical in every process"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+def song_digest(artist: str, title: str) -> str:
+    return digest(normalize_text(artist), normalize_text(title))
+
+
+def exists_key(artist: str, title: str) -> str:
+    return f"song_exists:v{CACHE_KEY_VERSION}:{song_digest(artist, title)}"
+
+
+def lyrics_key(artist: str, title: str) -> str:
+    return f"lyrics:v{CACHE_KEY_VERSION}:{song_digest(artist, title)}"
+
+
+def matcher_key(artist: str, title: str) -> str:
+    return f"matcher_lyrics:v{CACHE_KEY_VERSION}:{song_digest(artist, title)}"
+
+
+def analysis_key(lyrics: str) -> str:
+    """
+    Key of the analysis of the given lyrics with the configured model and
+    country extraction mode, whose prompts differ
+    """
+    lyrics_digest = digest(
+        settings.OPENAI_MODEL, settings.COUNTRY_EXTRACTION, lyrics or ""
+    )
+    return f"analysis:v{CACHE_KEY_VERSION}:{lyrics_digest}"
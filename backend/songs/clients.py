@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+from .rate_limits import MUSIXMATCH, UpstreamCall, retry_after
+
+logger = logging.getLogger(__name__)
+
+# 429 is left to the shared rate limiter, which backs off every worker
+# instead of retrying in place
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+RATE_LIMITED = 429
+
+
+def _is_rate_limited(status_code: int, data: Dict[str, Any]) -> bool:
+    # Musixmatch may also report 429 in the body of an HTTP 200 response
+    if status_code == RATE_LIMITED:
+        return True
+    header = data.get("message", {}).get("header", {}) if isinstance(data, dict) else {}
+    return header.get("status_code") == RATE_LIMITED
+
+
+class MusixmatchClient:
+    """
+    Thin Musixmatch API client on top of a pooled, keep-alive requests
+    session with retry and backoff for server errors. Requests are paced by
+    the shared Musixmatch rate limiter.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        pool_size: int = 10,
+        timeout: float = 10,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=frozenset({"GET"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, method: str, **params: Any) -> Dict[str, Any]:
+        """
+        Call a Musixmatch API method and return the decoded JSON payload
+
+        Args:
+            method: The API method, e.g. "matcher.lyrics.get"
+            **params: Query parameters for the method
+
+        Raises:
+            UpstreamRateLimited: When Musixmatch is rate limiting us
+        """
+        url = f"{self.base_url}/{method}"
+        params = {"apikey": self.api_key, "format": "json", **params}
+
+        with UpstreamCall(MUSIXMATCH) as call:
+            with metrics.timer(f"musixmatch.{method}"):
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            metrics.incr("musixmatch.requests")
+            if response.status_code >= 400:
+                metrics.incr(f"musixmatch.http_{response.status_code}")
+
+            data = response.json() if response.status_code != RATE_LIMITED else {}
+            if _is_rate_limited(response.status_code, data):
+                raise call.rate_limited(retry_after(response.headers))
+            return data
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncMusixmatchClient:
+    """
+    asyncio counterpart of MusixmatchClient on top of a pooled httpx client,
+    with the same retry and backoff policy. A client belongs to the event
+    loop it was first used on.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        pool_size: int = 100,
+        timeout: float = 10,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+        )
+
+    def _retry_delay(self, response: Optional[httpx.Response], attempt: int) -> float:
+        retry_after = response is not None and response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff_factor * (2**attempt)
+
+    async def get(self, method: str, **params: Any) -> Dict[str, Any]:
+        """
+        Call a Musixmatch API method and return the decoded JSON payload
+
+        Args:
+            method: The API method, e.g. "matcher.lyrics.get"
+            **params: Query parameters for the method
+
+        Raises:
+            UpstreamRateLimited: When Musixmatch is rate limiting us
+        """
+        url = f"{self.base_url}/{method}"
+        params = {"apikey": self.api_key, "format": "json", **params}
+
+        for attempt in range(self.max_retries + 1):
+            response = None
+            async with UpstreamCall(MUSIXMATCH) as call:
+                try:
+                    with metrics.timer(f"musixmatch.{method}"):
+                        response = await self.client.get(url, params=params)
+                except httpx.TransportError:
+                    if attempt == self.max_retries:
+                        raise
+                else:
+                    metrics.incr("musixmatch.requests")
+                    if response.status_code >= 400:
+                        metrics.incr(f"musixmatch.http_{response.status_code}")
+                    if (
+                        response.status_code not in RETRY_STATUS_CODES
+                        or attempt == self.max_retries
+                    ):
+                        data = (
+                            response.json()
+                            if response.status_code != RATE_LIMITED
+                            else {}
+                        )
+                        if _is_rate_limited(response.status_code, data):
+                            raise call.rate_limited(retry_after(response.headers))
+                        return data
+            await asyncio.sleep(self._retry_delay(response, attempt))
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+_client: Optional[MusixmatchClient] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+
+def get_musixmatch_client() -> MusixmatchClient:
+    """
+    Return the per-process Musixmatch client, building it on first use.
+
+    The connection pool is never shared across a fork: gunicorn workers and
+    Celery prefork children each get their own sockets.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            _client = MusixmatchClient(
+                base_url=settings.MUSIXMATCH_API_BASE_URL,
+                api_key=settings.MUSIXMATCH_API_KEY,
+                pool_size=settings.MUSIXMATCH_POOL_SIZE,
+                timeout=settings.MUSIXMATCH_TIMEOUT,
+                max_retries=settings.MUSIXMATCH_MAX_RETRIES,
+                backoff_factor=settings.MUSIXMATCH_RETRY_BACKOFF,
+            )
+            _client_pid = pid
+            logger.info("Created Musixmatch client for process %s", pid)
+    return _client
+
+
+_async_client: Optional[AsyncMusixmatchClient] = None
+_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_async_musixmatch_client() -> AsyncMusixmatchClient:
+    """Return the async Musixmatch client of the running event loop"""
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = AsyncMusixmatchClient(
+            base_url=settings.MUSIXMATCH_API_BASE_URL,
+            api_key=settings.MUSIXMATCH_API_KEY,
+            pool_size=settings.MUSIXMATCH_ASYNC_POOL_SIZE,
+            timeout=settings.MUSIXMATCH_TIMEOUT,
+            max_retries=settings.MUSIXMATCH_MAX_RETRIES,
+            backoff_factor=settings.MUSIXMATCH_RETRY_BACKOFF,
+        )
+        _async_client_loop = loop
+        logger.info("Created async Musixmatch client for process %s", os.getpid())
+    return _async_client
+
+
+def _reset_after_fork() -> None:
+    # The inherited sockets belong to the parent; drop them without closing.
+    global _client, _client_pid, _client_lock
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,87 @@
+from typing import Any, Dict, Optional, Tuple
+
+from rest_framework import status
+
+from . import cache_keys, status_records
+from .models import Song, Track
+from .serializers import SongDetailSerializer, SongSerializer
+from .tasks import new_task_id, queue_analysis
+
+# The steps of creating a song, shared by SongViewSet.create and
+# async_views.song_create, which only differ in how they wait for the
+# Musixmatch existence check between them.
+
+# Response body and HTTP status of a create request
+Outcome = Tuple[Dict[str, Any], int]
+
+
+def find_song(
+    serializer: SongSerializer, user
+) -> Tuple[Optional[Outcome], Optional[Track]]:
+    """
+    The outcome when the user already has the song, or when its track is
+    already analyzed and the song is created from it. Otherwise None and
+    the track of that name if any: the song needs an existence check.
+    """
+    key = cache_keys.song_digest(
+        serializer.validated_data["artist"], serializer.validated_data["title"]
+    )
+    existing_song = (
+        Song.objects.select_related("track", "created_by")
+        .filter(track__key=key, created_by=user)
+        .first()
+    )
+    if existing_song is not None:
+        return (
+            {
+                "message": "Song already exists",
+                "data": SongDetailSerializer(existing_song).data,
+            },
+            status.HTTP_200_OK,
+        ), None
+
+    track = Track.objects.filter(key=key).first()
+    if track is not None and track.is_analyzed:
+        # Another user already had it analyzed: no upstream call needed
+        song = serializer.save(status="completed", created_by=user, track=track)
+        status_records.publish(song)
+        return (
+            {
+                "message": "Song created from an existing analysis",
+                "data": SongDetailSerializer(song).data,
+            },
+            status.HTTP_201_CREATED,
+        ), track
+    return None, track
+
+
+def check_failed(song_exists: bool, error_message: str) -> Optional[Outcome]:
+    """The outcome of a failed existence check, None if the song exists"""
+    if song_exists:
+        return None
+    return (
+        {"message": f"Cannot analyze song: {error_message}", "success": False},
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+def queue_song(serializer: SongSerializer, user, track: Optional[Track]) -> Outcome:
+    """Create the song pending and queue it for analysis"""
+    song = serializer.save(
+        status="pending",
+        created_by=user,
+        track=track
+        or Track.objects.for_song(
+            serializer.validated_data["artist"], serializer.validated_data["title"]
+        ),
+        task_id=new_task_id(),
+    )
+    status_records.publish(song)
+    queue_analysis(song)
+    return (
+        {
+            "message": "Song created and queued for analysis",
+            "data": SongDetailSerializer(song).data,
+        },
+        status.HTTP_201_CREATED,
+    )
@@ -0,0 +1,181 @@
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import redis.asyncio as aioredis
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+STAGE_FETCHING_LYRICS = "fetching_lyrics"
+STAGE_ANALYZING = "analyzing"
+STAGE_COMPLETED = "completed"
+STAGE_ERROR = "error"
+TERMINAL_STAGES = (STAGE_COMPLETED, STAGE_ERROR)
+
+# Bumps the sequence number, folds the event into the progress snapshot and
+# publishes it, all atomically so a subscriber that reads the snapshot after
+# subscribing can drop exactly the events the snapshot already contains.
+PUBLISH_SCRIPT = """
+local seq = redis.call('HINCRBY', KEYS[1], 'seq', 1)
+if ARGV[1] == 'delta' then
+    local summary = redis.call('HGET', KEYS[1], 'summary') or ''
+    redis.call('HSET', KEYS[1], 'summary', summary .. ARGV[2])
+else
+    redis.call('HSET', KEYS[1], 'stage', ARGV[2])
+    if ARGV[4] == '1' then
+        redis.call('HDEL', KEYS[1], 'summary')
+    end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('PUBLISH', KEYS[2],
+    cjson.encode({seq = seq, type = ARGV[1], data = ARGV[2]}))
+return seq
+"""
+
+
+def channel_name(song_id) -> str:
+    return f"lyrintel:song:{song_id}:events"
+
+
+def snapshot_key(song_id) -> str:
+    return f"lyrintel:song:{song_id}:progress"
+
+
+def status_stream_key(user_id) -> str:
+    return f"lyrintel:user:{user_id}:song-status"
+
+
+def _publish(song_id, event_type: str, data: str) -> None:
+    """Publishing is best effort: progress events must never fail a task"""
+    try:
+        get_redis_connection("default").eval(
+            PUBLISH_SCRIPT,
+            2,
+            snapshot_key(song_id),
+            channel_name(song_id),
+            event_type,
+            data,
+            settings.SONG_EVENTS_TTL,
+            # A new stage that precedes the summary restarts the stream
+            int(data in (STAGE_FETCHING_LYRICS, STAGE_ANALYZING)),
+        )
+    except Exception as e:
+        logger.warning("Failed to publish %s event for %s: %s", event_type, song_id, e)
+
+
+def publish_stage(song_id, stage: str) -> None:
+    """Announce that the analysis of a song moved to a new stage"""
+    _publish(song_id, "stage", stage)
+
+
+def publish_delta(song_id, text: str) -> None:
+    """Append streamed summary text to the progress of a song"""
+    _publish(song_id, "delta", text)
+
+
+def reset(song_id) -> None:
+    """Forget the progress of a previous run before the song is re-queued"""
+    try:
+        get_redis_connection("default").delete(snapshot_key(song_id))
+    except Exception as e:
+        logger.warning("Failed to reset events for %s: %s", song_id, e)
+
+
+def async_connection() -> aioredis.Redis:
+    # Blocking reads outlast the socket timeout newer redis-py applies by default
+    return aioredis.from_url(
+        settings.CACHES["default"]["LOCATION"], socket_timeout=None
+    )
+
+
+async def last_status_id(connection: aioredis.Redis, user_id) -> str:
+    """ID of the newest status change of a user, the cursor to read after"""
+    entries = await connection.xrevrange(status_stream_key(user_id), count=1)
+    return entries[0][0].decode() if entries else "0-0"
+
+
+async def read_status_changes(
+    connection: aioredis.Redis, user_id, cursor: str, timeout: float
+) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Wait up to `timeout` seconds for status changes after `cursor` and
+    return the new cursor with the changes, oldest first
+    """
+    response = await connection.xread(
+        {status_stream_key(user_id): cursor},
+        count=settings.SONG_STATUS_READ_COUNT,
+        block=max(1, int(timeout * 1000)),
+    )
+    changes = []
+    for _key, entries in response or []:
+        for entry_id, fields in entries:
+            cursor = entry_id.decode()
+            changes.append(
+                {
+                    "id": cursor,
+                    **{key.decode(): value.decode() for key, value in fields.items()},
+                }
+            )
+    return cursor, changes
+
+
+async def read_snapshot(
+    connection: aioredis.Redis, song_id
+) -> Optional[Dict[str, Any]]:
+    """Progress published so far, or None when nothing was published"""
+    snapshot = await connection.hgetall(snapshot_key(song_id))
+    if not snapshot:
+        return None
+    return {
+        "seq": int(snapshot.get(b"seq", 0)),
+        "stage": snapshot.get(b"stage", b"").decode(),
+        "summary": snapshot.get(b"summary", b"").decode(),
+    }
+
+
+async def subscribe(
+    song_id, heartbeat: float
+) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    """
+    Yield the progress snapshot of a song followed by each later event.
+    Yields None when no event arrived for `heartbeat` seconds so callers can
+    keep idle connections alive. Stops after a terminal stage.
+    """
+    connection = async_connection()
+    pubsub = connection.pubsub()
+    try:
+        # Subscribe before reading the snapshot so no event falls in between
+        await pubsub.subscribe(channel_name(song_id))
+        snapshot = await read_snapshot(connection, song_id)
+        last_seq = 0
+        if snapshot:
+            last_seq = snapshot["seq"]
+            yield {"type": "snapshot", **snapshot}
+            if snapshot["stage"] in TERMINAL_STAGES:
+                return
+
+        idle_since = time.monotonic()
+        while True:
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=heartbeat
+            )
+            if message is None:
+                # Also returned for skipped subscribe confirmations
+                if time.monotonic() - idle_since >= heartbeat:
+                    idle_since = time.monotonic()
+                    yield None
+                continue
+            idle_since = time.monotonic()
+            event = json.loads(message["data"])
+            if event["seq"] <= last_seq:
+                continue
+            last_seq = event["seq"]
+            yield event
+            if event["type"] == "stage" and event["data"] in TERMINAL_STAGES:
+                return
+    finally:
+        await pubsub.aclose()
+        await connection.aclose()
@@ -0,0 +1,23 @@
+import django_filters
+
+from .models import Song
+
+
+class SongFilter(django_filters.FilterSet):
+    """
+    Artist and title match case-insensitively, like duplicate detection.
+    The lookups are served by the song_owner_artist_title_ci_idx index.
+    `country` keeps the songs whose analysis mentions that country, through
+    the track_countries_idx containment index.
+    """
+
+    artist = django_filters.CharFilter(lookup_expr="iexact")
+    title = django_filters.CharFilter(lookup_expr="iexact")
+    country = django_filters.CharFilter(method="filter_country")
+
+    class Meta:
+        model = Song
+        fields = ["artist", "title", "status"]
+
+    def filter_country(self, queryset, name, value):
+        return queryset.filter(track__countries__contains=[value])
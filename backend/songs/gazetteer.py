@@ -0,0 +1,342 @@
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List
+
+# (ISO 3166-1 alpha-2 code, display name, "|"-separated aliases, demonyms and
+# capitals). Capitals that are common words or shared by several places
+# (Victoria, Kingston, Santiago, Male, ...) are deliberately left out.
+COUNTRIES = (
+    ("AF", "Afghanistan", "afghan|afghans|kabul"),
+    ("AL", "Albania", "albanian|tirana"),
+    ("DZ", "Algeria", "algerian|algiers"),
+    ("AD", "Andorra", "andorran|andorra la vella"),
+    ("AO", "Angola", "angolan|luanda"),
+    ("AG", "Antigua and Barbuda", "antigua|barbuda|antiguan|st john s"),
+    ("AR", "Argentina", "argentine|argentinian|argentinean|buenos aires"),
+    ("AM", "Armenia", "armenian|yerevan"),
+    ("AU", "Australia", "australian|aussie|canberra"),
+    ("AT", "Austria", "austrian|vienna|wien"),
+    ("AZ", "Azerbaijan", "azerbaijani|azeri|baku"),
+    ("BS", "Bahamas", "bahamian|nassau"),
+    ("BH", "Bahrain", "bahraini|manama"),
+    ("BD", "Bangladesh", "bangladeshi|dhaka"),
+    ("BB", "Barbados", "barbadian|bajan|bridgetown"),
+    ("BY", "Belarus", "belarusian|byelorussia|minsk"),
+    ("BE", "Belgium", "belgian|brussels"),
+    ("BZ", "Belize", "belizean|belmopan"),
+    ("BJ", "Benin", "beninese|porto novo"),
+    ("BT", "Bhutan", "bhutanese|thimphu"),
+    ("BO", "Bolivia", "bolivian|la paz"),
+    (
+        "BA",
+        "Bosnia and Herzegovina",
+        "bosnia|herzegovina|bosnian|bosnia herzegovina|sarajevo",
+    ),
+    ("BW", "Botswana", "motswana|batswana|gaborone"),
+    ("BR", "Brazil", "brazilian|brasil|brasilia"),
+    ("BN", "Brunei", "bruneian|brunei darussalam|bandar seri begawan"),
+    ("BG", "Bulgaria", "bulgarian|sofia bulgaria"),
+    ("BF", "Burkina Faso", "burkinabe|ouagadougou"),
+    ("BI", "Burundi", "burundian|gitega"),
+    ("CV", "Cape Verde", "cabo verde|cape verdean"),
+    ("KH", "Cambodia", "cambodian|kampuchea|phnom penh"),
+    ("CM", "Cameroon", "cameroonian|yaounde"),
+    ("CA", "Canada", "canadian|ottawa"),
+    ("CF", "Central African Republic", "central african|bangui"),
+    ("TD", "Chad", "chadian|n djamena"),
+    ("CL", "Chile", "chilean"),
+    ("CN", "China", "chinese|prc|beijing|peking"),
+    ("CO", "Colombia", "colombian|bogota"),
+    ("KM", "Comoros", "comorian|moroni"),
+    ("CG", "Congo", "republic of the congo|congo brazzaville|brazzaville"),
+    (
+        "CD",
+        "DR Congo",
+        "democratic republic of the congo|democratic republic of congo"
+        "|drc|zaire|kinshasa",
+    ),
+    ("CR", "Costa Rica", "costa rican"),
+    ("CI", "Ivory Coast", "cote d ivoire|ivorian|yamoussoukro"),
+    ("HR", "Croatia", "croatian|croat|hrvatska|zagreb"),
+    ("CU", "Cuba", "cuban|havana|habana"),
+    ("CY", "Cyprus", "cypriot|nicosia"),
+    ("CZ", "Czech Republic", "czechia|czech|prague|praha"),
+    ("DK", "Denmark", "danish|dane|danes|copenhagen"),
+    ("DJ", "Djibouti", "djiboutian"),
+    ("DM", "Dominica", "roseau"),
+    ("DO", "Dominican Republic", "dominican|santo domingo"),
+    ("EC", "Ecuador", "ecuadorian|ecuadorean|quito"),
+    ("EG", "Egypt", "egyptian|cairo"),
+    ("SV", "El Salvador", "salvadoran|salvadorean|san salvador"),
+    ("GQ", "Equatorial Guinea", "equatoguinean|malabo"),
+    ("ER", "Eritrea", "eritrean|asmara"),
+    ("EE", "Estonia", "estonian|tallinn"),
+    ("SZ", "Eswatini", "swaziland|swazi|mbabane"),
+    ("ET", "Ethiopia", "ethiopian|abyssinia|addis ababa"),
+    ("FJ", "Fiji", "fijian|suva"),
+    ("FI", "Finland", "finnish|suomi|helsinki"),
+    ("FR", "France", "french|paris"),
+    ("GA", "Gabon", "gabonese|libreville"),
+    ("GM", "Gambia", "the gambia|gambian|banjul"),
+    ("GE", "Georgia", "georgian|sakartvelo|tbilisi"),
+    ("DE", "Germany", "german|germans|deutschland|berlin"),
+    ("GH", "Ghana", "ghanaian|accra"),
+    ("GR", "Greece", "greek|greeks|hellas|athens"),
+    ("GD", "Grenada", "grenadian"),
+    ("GT", "Guatemala", "guatemalan|guatemala city"),
+    ("GN", "Guinea", "guinean|conakry"),
+    ("GW", "Guinea-Bissau", "bissau"),
+    ("GY", "Guyana", "guyanese"),
+    ("HT", "Haiti", "haitian|port au prince"),
+    ("HN", "Honduras", "honduran|tegucigalpa"),
+    ("HU", "Hungary", "hungarian|magyar|magyarorszag|budapest"),
+    ("IS", "Iceland", "icelandic|icelander|reykjavik"),
+    ("IN", "India", "indian|hindustan|bharat|new delhi"),
+    ("ID", "Indonesia", "indonesian|jakarta"),
+    ("IR", "Iran", "iranian|persia|persian|tehran"),
+    ("IQ", "Iraq", "iraqi|baghdad"),
+    ("IE", "Ireland", "irish|eire|dublin"),
+    ("IL", "Israel", "israeli"),
+    ("IT", "Italy", "italian|italians|italia|rome|roma"),
+    ("JM", "Jamaica", "jamaican"),
+    ("JP", "Japan", "japanese|nippon|nihon|tokyo"),
+    ("JO", "Jordan", "jordanian|amman"),
+    ("KZ", "Kazakhstan", "kazakh|kazakhstani|astana"),
+    ("KE", "Kenya", "kenyan|nairobi"),
+    ("KI", "Kiribati", "tarawa"),
+    ("KP", "North Korea", "north korean|dprk|pyongyang"),
+    ("KR", "South Korea", "south korean|korea|korean|seoul"),
+    ("XK", "Kosovo", "kosovar|pristina"),
+    ("KW", "Kuwait", "kuwaiti|kuwait city"),
+    ("KG", "Kyrgyzstan", "kyrgyz|kirghizia|bishkek"),
+    ("LA", "Laos", "laotian|vientiane"),
+    ("LV", "Latvia", "latvian|riga"),
+    ("LB", "Lebanon", "lebanese|beirut"),
+    ("LS", "Lesotho", "basotho|maseru"),
+    ("LR", "Liberia", "liberian|monrovia"),
+    ("LY", "Libya", "libyan|tripoli"),
+    ("LI", "Liechtenstein", "liechtensteiner|vaduz"),
+    ("LT", "Lithuania", "lithuanian|vilnius"),
+    ("LU", "Luxembourg", "luxembourgish|luxembourger"),
+    ("MG", "Madagascar", "malagasy|antananarivo"),
+    ("MW", "Malawi", "malawian|lilongwe"),
+    ("MY", "Malaysia", "malaysian|kuala lumpur"),
+    ("MV", "Maldives", "maldivian"),
+    ("ML", "Mali", "malian|bamako"),
+    ("MT", "Malta", "maltese|valletta"),
+    ("MH", "Marshall Islands", "marshallese|majuro"),
+    ("MR", "Mauritania", "mauritanian|nouakchott"),
+    ("MU", "Mauritius", "mauritian|port louis"),
+    ("MX", "Mexico", "mexican|mexicans|mejico|mexico city"),
+    ("FM", "Micronesia", "micronesian|palikir"),
+    ("MD", "Moldova", "moldovan|chisinau"),
+    ("MC", "Monaco", "monegasque|monte carlo"),
+    ("MN", "Mongolia", "mongolian|ulaanbaatar|ulan bator"),
+    ("ME", "Montenegro", "montenegrin|podgorica"),
+    ("MA", "Morocco", "moroccan|rabat"),
+    ("MZ", "Mozambique", "mozambican|maputo"),
+    ("MM", "Myanmar", "burma|burmese|naypyidaw"),
+    ("NA", "Namibia", "namibian|windhoek"),
+    ("NR", "Nauru", "nauruan"),
+    ("NP", "Nepal", "nepalese|nepali|kathmandu"),
+    ("NL", "Netherlands", "the netherlands|holland|dutch|amsterdam"),
+    ("NZ", "New Zealand", "new zealander|aotearoa"),
+    ("NI", "Nicaragua", "nicaraguan|managua"),
+    ("NE", "Niger", "nigerien|niamey"),
+    ("NG", "Nigeria", "nigerian|abuja"),
+    ("MK", "North Macedonia", "macedonia|macedonian|skopje"),
+    ("NO", "Norway", "norwegian|norge|oslo"),
+    ("OM", "Oman", "omani|muscat"),
+    ("PK", "Pakistan", "pakistani|islamabad"),
+    ("PW", "Palau", "palauan|ngerulmud"),
+    ("PS", "Palestine", "palestinian|gaza|west bank"),
+    ("PA", "Panama", "panamanian|panama city"),
+    ("PG", "Papua New Guinea", "papua new guinean|port moresby"),
+    ("PY", "Paraguay", "paraguayan|asuncion"),
+    ("PE", "Peru", "peruvian"),
+    ("PH", "Philippines", "the philippines|filipino|filipina|philippine|manila"),
+    ("PL", "Poland", "polish|polska|warsaw"),
+    ("PT", "Portugal", "portuguese|lisbon|lisboa"),
+    ("QA", "Qatar", "qatari|doha"),
+    ("RO", "Romania", "romanian|bucharest"),
+    ("RU", "Russia", "russian|russians|russian federation|moscow|moskva"),
+    ("RW", "Rwanda", "rwandan|kigali"),
+    ("KN", "Saint Kitts and Nevis", "saint kitts|st kitts|basseterre"),
+    ("LC", "Saint Lucia", "st lucia|saint lucian|castries"),
+    (
+        "VC",
+        "Saint Vincent and the Grenadines",
+        "saint vincent|st vincent|the grenadines|kingstown",
+    ),
+    ("WS", "Samoa", "samoan|apia"),
+    ("SM", "San Marino", "sammarinese"),
+    ("ST", "Sao Tome and Principe", "sao tome"),
+    ("SA", "Saudi Arabia", "saudi|saudis|riyadh"),
+    ("SN", "Senegal", "senegalese|dakar"),
+    ("RS", "Serbia", "serbian|serb|serbs|belgrade"),
+    ("SC", "Seychelles", "seychellois"),
+    ("SL", "Sierra Leone", "sierra leonean|freetown"),
+    ("SG", "Singapore", "singaporean"),
+    ("SK", "Slovakia", "slovak|slovakian|bratislava"),
+    ("SI", "Slovenia", "slovenian|slovene|ljubljana"),
+    ("SB", "Solomon Islands", "honiara"),
+    ("SO", "Somalia", "somali|somalian|mogadishu"),
+    ("ZA", "South Africa", "south african|pretoria|cape town"),
+    ("SS", "South Sudan", "south sudanese|juba"),
+    ("ES", "Spain", "spanish|espana|madrid"),
+    ("LK", "Sri Lanka", "sri lankan|ceylon|colombo"),
+    ("SD", "Sudan", "sudanese|khartoum"),
+    ("SR", "Suriname", "surinam|surinamese|paramaribo"),
+    ("SE", "Sweden", "swedish|swede|swedes|sverige|stockholm"),
+    ("CH", "Switzerland", "swiss|schweiz|suisse|bern"),
+    ("SY", "Syria", "syrian|damascus"),
+    ("TW", "Taiwan", "taiwanese|formosa|taipei"),
+    ("TJ", "Tajikistan", "tajik|dushanbe"),
+    ("TZ", "Tanzania", "tanzanian|dodoma"),
+    ("TH", "Thailand", "thai|siam|bangkok"),
+    ("TL", "Timor-Leste", "east timor|timorese|dili"),
+    ("TG", "Togo", "togolese|lome"),
+    ("TO", "Tonga", "tongan|nuku alofa"),
+    (
+        "TT",
+        "Trinidad and Tobago",
+        "trinidad|tobago|trinidadian|trini|port of spain",
+    ),
+    ("TN", "Tunisia", "tunisian|tunis"),
+    ("TR", "Turkey", "turkish|turkiye|ankara"),
+    ("TM", "Turkmenistan", "turkmen|ashgabat"),
+    ("TV", "Tuvalu", "tuvaluan|funafuti"),
+    ("UG", "Uganda", "ugandan|kampala"),
+    ("UA", "Ukraine", "ukrainian|kyiv|kiev"),
+    ("AE", "United Arab Emirates", "uae|u a e|emirati|the emirates|abu dhabi"),
+    (
+        "GB",
+        "United Kingdom",
+        "uk|u k|great britain|britain|british|brits|england|english|scotland"
+        "|scottish|wales|welsh|northern ireland|london",
+    ),
+    (
+        "US",
+        "United States",
+        "usa|u s a|u s of a|united states of america|america|american|americans"
+        "|washington d c|washington dc",
+    ),
+    ("UY", "Uruguay", "uruguayan|montevideo"),
+    ("UZ", "Uzbekistan", "uzbek|tashkent"),
+    ("VU", "Vanuatu", "ni vanuatu|port vila"),
+    ("VA", "Vatican City", "vatican|holy see"),
+    ("VE", "Venezuela", "venezuelan|caracas"),
+    ("VN", "Vietnam", "viet nam|vietnamese|hanoi"),
+    ("YE", "Yemen", "yemeni|sanaa"),
+    ("ZM", "Zambia", "zambian|lusaka"),
+    ("ZW", "Zimbabwe", "zimbabwean|harare"),
+)
+
+# Terms that are also everyday words or names; they only count when written
+# with a capital letter in the lyrics ("Turkey" but not "turkey dinner").
+CAPITALIZED_ONLY = frozenset(
+    {
+        "chad",
+        "china",
+        "french",
+        "georgia",
+        "georgian",
+        "guinea",
+        "jordan",
+        "panama",
+        "polish",
+        "swede",
+        "swedes",
+        "turkey",
+    }
+)
+
+_word_re = re.compile(r"[^\W_]+")
+_combining_re = re.compile(r"[\u0300-\u036f]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Casefolded words of the text with accents stripped and punctuation
+    dropped, so that "Côte d'Ivoire" and "cote d ivoire" compare equal.
+    """
+    if not text.isascii():
+        text = _combining_re.sub("", unicodedata.normalize("NFKD", text))
+    return _word_re.findall(text.casefold())
+
+
+def normalize(text: str) -> str:
+    return " ".join(tokenize(text))
+
+
+class Gazetteer:
+    """
+    In-process country matcher mapping country names, demonyms, aliases and
+    capitals to ISO 3166-1 alpha-2 codes.
+
+    Lyrics are tokenized once, then walked left to right against a word-level
+    trie: every term is keyed by its first word together with the word counts
+    of the terms starting with it, longest first. Matching is one dict lookup
+    per word plus a join for multi-word candidates, and the longest term wins
+    ("guinea bissau" over "guinea").
+    """
+
+    def __init__(self, countries=COUNTRIES):
+        self.names: Dict[str, str] = {}
+        self.codes_by_term: Dict[str, str] = {}
+        for code, name, aliases in countries:
+            self.names[code] = name
+            for term in [name, *aliases.split("|")]:
+                self.codes_by_term[normalize(term)] = code
+
+        lengths: Dict[str, set] = {}
+        for term in self.codes_by_term:
+            words = term.split(" ")
+            lengths.setdefault(words[0], set()).add(len(words))
+        self._lengths = {
+            word: tuple(sorted(counts, reverse=True))
+            for word, counts in lengths.items()
+        }
+        self._capitalized = {
+            term: re.compile(rf"(?<!\w){re.escape(term.title())}(?!\w)")
+            for term in CAPITALIZED_ONLY
+        }
+
+    def find_codes(self, text: str) -> List[str]:
+        """ISO codes of the countries mentioned, in order of first mention"""
+        words = tokenize(text)
+        codes: Dict[str, None] = {}
+        capitalized: Dict[str, bool] = {}
+        index = 0
+        while index < len(words):
+            step = 1
+            for length in self._lengths.get(words[index], ()):
+                term = " ".join(words[index : index + length])
+                code = self.codes_by_term.get(term)
+                if code is None:
+                    continue
+                step = length
+                if term in self._capitalized:
+                    if term not in capitalized:
+                        capitalized[term] = bool(self._capitalized[term].search(text))
+                    if not capitalized[term]:
+                        break
+                codes.setdefault(code)
+                break
+            index += step
+        return list(codes)
+
+    def find_countries(self, text: str) -> List[str]:
+        """Display names of the countries mentioned, in order of first mention"""
+        return [self.names[code] for code in self.find_codes(text)]
+
+
+@lru_cache(maxsize=None)
+def get_gazetteer() -> Gazetteer:
+    """The per-process gazetteer, compiled on first use"""
+    return Gazetteer()
+
+
+def extract_countries(text: str) -> List[str]:
+    return get_gazetteer().find_countries(text or "")
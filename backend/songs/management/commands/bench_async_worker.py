@@ -0,0 +1,232 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+from openai import OpenAI
+
+from songs import services
+from songs.async_worker import AsyncWorker
+from songs.management.commands.bench_cache import SAMPLE_VERSE
+from songs.models import Song, Track
+from songs.tasks import analyze_song_task
+
+User = get_user_model()
+
+
+class MockUpstreamHandler(BaseHTTPRequestHandler):
+    """Musixmatch matcher.lyrics.get and OpenAI chat completions, with latency"""
+
+    protocol_version = "HTTP/1.1"
+    musixmatch_latency = 0.0
+    openai_latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body: bytes, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        title = query.get("q_track", [""])[0]
+        time.sleep(self.musixmatch_latency)
+        payload = {
+            "message": {
+                "header": {"status_code": 200},
+                "body": {"lyrics": {"lyrics_body": f"{title}\n{SAMPLE_VERSE}"}},
+            }
+        }
+        self.send_body(json.dumps(payload).encode(), "application/json")
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        content = json.dumps({"summary": f"A song of {uuid.uuid4().hex[:8]}."})
+        time.sleep(self.openai_latency)
+        completion = {
+            "id": "chatcmpl-bench",
+            "created": int(time.time()),
+            "model": request["model"],
+        }
+        if not request.get("stream"):
+            completion["object"] = "chat.completion"
+            completion["choices"] = [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ]
+            self.send_body(json.dumps(completion).encode(), "application/json")
+            return
+
+        events = []
+        for start in range(0, len(content), 8):
+            chunk = {
+                **completion,
+                "object": "chat.completion.chunk",
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": content[start : start + 8]},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+            events.append(f"data: {json.dumps(chunk)}\n\n")
+        events.append("data: [DONE]\n\n")
+        self.send_body("".join(events).encode(), "text/event-stream")
+
+
+class MockUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Hundreds of clients connect at once
+    request_queue_size = 1024
+
+
+def run_prefork_task(song_id):
+    analyze_song_task(song_id)
+    return os.getpid(), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare song throughput of a prefork pool running analyze_song_task "
+        "against the async worker, with local mock upstreams standing in for "
+        "Musixmatch and OpenAI. Needs the database and Redis; the songs are "
+        "created for the given user and deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--email", required=True, help="Owner of the songs")
+        parser.add_argument("--songs", type=int, default=500)
+        parser.add_argument(
+            "--processes", type=int, default=8, help="Size of the prefork pool"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=settings.ASYNC_WORKER_CONCURRENCY
+        )
+        parser.add_argument(
+            "--musixmatch-latency", type=float, default=0.2, help="Seconds"
+        )
+        parser.add_argument("--openai-latency", type=float, default=1.0, help="Seconds")
+        parser.add_argument("--skip-prefork", action="store_true")
+        parser.add_argument("--skip-async", action="store_true")
+
+    def handle(self, *args, **options):
+        self.user = User.objects.filter(email=options["email"]).first()
+        if self.user is None:
+            raise CommandError(f"No user with email {options['email']}")
+        if Song.objects.filter(status="pending").exists():
+            # The async worker would claim and analyze them against the mocks
+            raise CommandError("Pending songs exist, run the benchmark on a quiet DB")
+
+        MockUpstreamHandler.musixmatch_latency = options["musixmatch_latency"]
+        MockUpstreamHandler.openai_latency = options["openai_latency"]
+        server = MockUpstreamServer(("127.0.0.1", 0), MockUpstreamHandler)
+        server_process = multiprocessing.get_context("fork").Process(
+            target=server.serve_forever, daemon=True
+        )
+        server_process.start()
+        server.server_close()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        original_client = services.client
+        services.client = OpenAI(
+            api_key="bench", base_url=f"{base_url}/v1", max_retries=0
+        )
+        try:
+            with override_settings(
+                MUSIXMATCH_API_BASE_URL=f"{base_url}/ws/1.1",
+                OPENAI_API_KEY="bench",
+                OPENAI_BASE_URL=f"{base_url}/v1",
+            ):
+                self.report_header(options)
+                if not options["skip_prefork"]:
+                    self.report("prefork", *self.bench_prefork(options))
+                if not options["skip_async"]:
+                    self.report("async", *self.bench_async(options))
+        finally:
+            services.client = original_client
+            server_process.terminate()
+
+    def create_songs(self, count):
+        run = uuid.uuid4().hex[:8]
+        tracks = Track.objects.for_songs(
+            (f"bench-{run}", f"song {run} {n}") for n in range(count)
+        )
+        songs = [
+            Song(
+                artist=track.artist,
+                title=track.title,
+                track=track,
+                status="pending",
+                created_by=self.user,
+            )
+            for track in tracks.values()
+        ]
+        Song.objects.bulk_create(songs)
+        return [str(song.id) for song in songs]
+
+    def finish(self, song_ids):
+        songs = Song.objects.filter(id__in=song_ids)
+        completed = songs.filter(status="completed").count()
+        track_ids = list(songs.values_list("track_id", flat=True))
+        songs.delete()
+        Track.objects.filter(id__in=track_ids).delete()
+        return completed
+
+    def bench_prefork(self, options):
+        song_ids = self.create_songs(options["songs"])
+        # Like Celery, never share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        start = time.perf_counter()
+        with context.Pool(options["processes"]) as pool:
+            results = pool.map(run_prefork_task, song_ids, chunksize=1)
+        elapsed = time.perf_counter() - start
+        peak_rss = {}
+        for pid, rss_kb in results:
+            peak_rss[pid] = max(rss_kb, peak_rss.get(pid, 0))
+        rss_kb = sum(peak_rss.values())
+        return elapsed, self.finish(song_ids), len(song_ids), rss_kb
+
+    def bench_async(self, options):
+        song_ids = self.create_songs(options["songs"])
+        worker = AsyncWorker(concurrency=options["concurrency"])
+        start = time.perf_counter()
+        asyncio.run(worker.run(burst=True))
+        elapsed = time.perf_counter() - start
+        rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return elapsed, self.finish(song_ids), len(song_ids), rss_kb
+
+    def report_header(self, options):
+        self.stdout.write(
+            f"{options['songs']} songs, Musixmatch {options['musixmatch_latency']}s, "
+            f"OpenAI {options['openai_latency']}s, "
+            f"{options['processes']} processes vs {options['concurrency']} slots"
+        )
+        self.stdout.write(
+            f"{'worker':<8} {'seconds':>8} {'songs/s':>8} {'completed':>10} "
+            f"{'rss MB':>8}"
+        )
+
+    def report(self, label, elapsed, completed, total, rss_kb):
+        self.stdout.write(
+            f"{label:<8} {elapsed:>8.2f} {total / elapsed:>8.1f} "
+            f"{f'{completed}/{total}':>10} {rss_kb / 1024:>8.1f}"
+        )
@@ -0,0 +1,106 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django_redis.cache import RedisCache
+
+from songs.models import Lyrics, Track
+
+SAMPLE_VERSE = (
+    "I've been walking down this road for so long\n"
+    "Singing the same old words of the same old song\n"
+    "From the streets of Paris to the shores of Spain\n"
+    "I keep on coming back to you again\n\n"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare Redis memory and get/set latency of the songs cache pipeline "
+        "against the default pickle serialization without compression"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=200)
+        parser.add_argument("--rounds", type=int, default=3)
+
+    def handle(self, *args, **options):
+        payloads = self.load_payloads(options["samples"])
+        songs_options = settings.CACHES["songs"]["OPTIONS"]
+        pipelines = {
+            "pickle (default)": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            },
+            "configured": songs_options,
+            "msgpack + lz4": {
+                **songs_options,
+                "SERIALIZER": "django_redis.serializers.msgpack.MSGPackSerializer",
+                "COMPRESSOR": "core.compressors.ThresholdCompressor",
+                "COMPRESSION_ALGORITHM": "lz4",
+            },
+            "json + zstd": {
+                **songs_options,
+                "SERIALIZER": "django_redis.serializers.json.JSONSerializer",
+                "COMPRESSOR": "core.compressors.ThresholdCompressor",
+                "COMPRESSION_ALGORITHM": "zstd",
+            },
+        }
+
+        self.stdout.write(
+            f"{len(payloads)} payloads, {options['rounds']} rounds\n"
+            f"{'pipeline':<20} {'memory':>12} {'set ms/op':>10} {'get ms/op':>10}"
+        )
+        for index, (name, pipeline_options) in enumerate(pipelines.items()):
+            memory, set_ms, get_ms = self.run_pipeline(
+                index, pipeline_options, payloads, options["rounds"]
+            )
+            self.stdout.write(
+                f"{name:<20} {memory:>12,} {set_ms:>10.3f} {get_ms:>10.3f}"
+            )
+
+    def load_payloads(self, samples):
+        payloads = []
+        for data, summary, countries in Track.objects.exclude(
+            lyrics__isnull=True
+        ).values_list("lyrics__data", "summary", "countries")[:samples]:
+            payloads.append(Lyrics.decompress(data))
+            payloads.append({"summary": summary or "", "countries": countries or []})
+
+        # Synthetic lyrics of growing size when the catalog is empty
+        for i in range(len(payloads), samples):
+            payloads.append(SAMPLE_VERSE * (1 + i % 12))
+        return payloads
+
+    def run_pipeline(self, index, pipeline_options, payloads, rounds):
+        cache = RedisCache(
+            settings.CACHES["songs"]["LOCATION"],
+            {"OPTIONS": pipeline_options, "KEY_PREFIX": f"lyrintel:bench:{index}"},
+        )
+        keys = [f"payload_{i}" for i in range(len(payloads))]
+
+        set_seconds = get_seconds = 0.0
+        try:
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for key, payload in zip(keys, payloads):
+                    cache.set(key, payload, 300)
+                set_seconds += time.perf_counter() - start
+
+                start = time.perf_counter()
+                for key in keys:
+                    cache.get(key)
+                get_seconds += time.perf_counter() - start
+
+            redis = cache.client.get_client()
+            memory = sum(
+                redis.memory_usage(cache.client.make_key(key)) or 0 for key in keys
+            )
+        finally:
+            cache.delete_many(keys)
+
+        operations = rounds * len(keys)
+        return (
+            memory,
+            set_seconds * 1000 / operations,
+            get_seconds * 1000 / operations,
+        )
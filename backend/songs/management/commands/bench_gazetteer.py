@@ -0,0 +1,67 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from songs.gazetteer import Gazetteer
+from songs.management.commands.bench_cache import SAMPLE_VERSE
+from songs.models import Lyrics, Track
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure local country extraction latency over stored lyrics and, "
+        "with --compare, its agreement with the countries already stored"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--samples", type=int, default=1000)
+        parser.add_argument("--rounds", type=int, default=5)
+        parser.add_argument(
+            "--compare",
+            action="store_true",
+            help="Report how often the gazetteer agrees with stored countries",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        gazetteer = Gazetteer()
+        build_ms = (time.perf_counter() - start) * 1000
+
+        songs = [
+            (Lyrics.decompress(data), countries)
+            for data, countries in Track.objects.exclude(
+                lyrics__isnull=True
+            ).values_list("lyrics__data", "countries")[: options["samples"]]
+        ]
+        if not songs:
+            # Synthetic lyrics of growing size when the catalog is empty
+            songs = [
+                (SAMPLE_VERSE * (1 + i % 12), ["France", "Spain"])
+                for i in range(options["samples"])
+            ]
+
+        timings = []
+        for _ in range(options["rounds"]):
+            for lyrics, _countries in songs:
+                start = time.perf_counter()
+                gazetteer.find_codes(lyrics)
+                timings.append((time.perf_counter() - start) * 1_000_000)
+
+        timings.sort()
+        self.stdout.write(
+            f"Built {len(gazetteer.codes_by_term)} terms in {build_ms:.1f} ms\n"
+            f"{len(songs)} songs x {options['rounds']} rounds, microseconds per song: "
+            f"mean {statistics.fmean(timings):.1f}, "
+            f"p50 {timings[len(timings) // 2]:.1f}, "
+            f"p99 {timings[int(len(timings) * 0.99)]:.1f}"
+        )
+
+        if options["compare"]:
+            exact = 0
+            for lyrics, countries in songs:
+                found = set(gazetteer.find_countries(lyrics))
+                exact += found == set(countries or [])
+            self.stdout.write(
+                f"Exact agreement with stored countries: {exact}/{len(songs)}"
+            )
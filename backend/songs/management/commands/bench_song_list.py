@@ -0,0 +1,127 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from songs.models import Song, Track
+from songs.views import SongViewSet
+
+User = get_user_model()
+
+song_list = SongViewSet.as_view({"get": "list"})
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure songs/ list latency and queries per request as the page "
+        "size grows, then while following cursors to the last page, as an "
+        "admin seeing songs of many owners. The songs and users are created "
+        "for the run and deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--songs", type=int, default=500)
+        parser.add_argument("--owners", type=int, default=50)
+        parser.add_argument("--rounds", type=int, default=20)
+        parser.add_argument(
+            "--page-sizes", default="10,25,50,100", help="Comma separated"
+        )
+        parser.add_argument(
+            "--fields",
+            default="id,artist,title,status",
+            help="Sparse fieldset measured next to the full one",
+        )
+
+    def handle(self, *args, **options):
+        run = uuid.uuid4().hex[:8]
+        admin, owners, track_ids = self.create_catalog(run, options)
+        try:
+            self.stdout.write(
+                f"{options['songs']} songs of {options['owners']} owners, "
+                f"{options['rounds']} rounds"
+            )
+            self.stdout.write(
+                f"{'page':>5} {'fields':<8} {'queries':>8} {'p50 ms':>8} "
+                f"{'p95 ms':>8}"
+            )
+            for page_size in options["page_sizes"].split(","):
+                for label, fields in (("all", None), ("sparse", options["fields"])):
+                    queries, timings = self.measure(
+                        admin, int(page_size), fields, options["rounds"]
+                    )
+                    self.stdout.write(
+                        f"{page_size:>5} {label:<8} {queries:>8} "
+                        f"{statistics.median(timings):>8.2f} "
+                        f"{statistics.quantiles(timings, n=20)[-1]:>8.2f}"
+                    )
+
+            timings = self.walk(admin)
+            tenth = max(1, len(timings) // 10)
+            self.stdout.write(
+                f"{len(timings)} pages followed, ms per page: first tenth "
+                f"{statistics.median(timings[:tenth]):.2f}, last tenth "
+                f"{statistics.median(timings[-tenth:]):.2f}"
+            )
+        finally:
+            Song.objects.filter(created_by__in=owners).delete()
+            Track.objects.filter(id__in=track_ids).delete()
+            User.objects.filter(
+                id__in=[admin.id, *(user.id for user in owners)]
+            ).delete()
+
+    def create_catalog(self, run, options):
+        admin = User.objects.create_user(
+            email=f"bench-{run}-admin@example.com", is_staff=True
+        )
+        owners = User.objects.bulk_create(
+            User(email=f"bench-{run}-{n}@example.com", first_name="Bench")
+            for n in range(options["owners"])
+        )
+        tracks = list(
+            Track.objects.for_songs(
+                (f"bench-{run}", f"song {n}") for n in range(options["songs"])
+            ).values()
+        )
+        Song.objects.bulk_create(
+            Song(
+                artist=track.artist,
+                title=track.title,
+                track=track,
+                status="completed",
+                created_by=owners[n % len(owners)],
+            )
+            for n, track in enumerate(tracks)
+        )
+        return admin, owners, [track.id for track in tracks]
+
+    def walk(self, user):
+        """Time every page of the list, following the `next` links"""
+        timings = []
+        url = "/api/v1/songs/"
+        while url:
+            request = APIRequestFactory().get(url)
+            force_authenticate(request, user=user)
+            start = time.perf_counter()
+            response = song_list(request).render()
+            timings.append((time.perf_counter() - start) * 1000)
+            url = response.data["next"]
+        return timings
+
+    def measure(self, user, page_size, fields, rounds):
+        params = {"page_size": page_size}
+        if fields:
+            params["fields"] = fields
+        timings = []
+        for _ in range(rounds):
+            request = APIRequestFactory().get("/api/v1/songs/", params)
+            force_authenticate(request, user=user)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                song_list(request).render()
+                timings.append((time.perf_counter() - start) * 1000)
+        return len(queries), timings
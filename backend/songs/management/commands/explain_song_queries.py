@@ -0,0 +1,63 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from songs import cache_keys
+from songs.models import Song, Track
+
+User = get_user_model()
+
+# Whole-table reads in Postgres and SQLite EXPLAIN output
+_table_scan_re = re.compile(r"Seq Scan|\bSCAN \w+$", re.MULTILINE)
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the query plans of the hot song lookups for a user and flag "
+        "those that scan instead of using an index. Run it against a "
+        "production-sized database: planners scan tiny tables regardless."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--email", required=True, help="Owner of the songs")
+        parser.add_argument("--artist", default="Queen")
+        parser.add_argument("--title", default="Bohemian Rhapsody")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options["email"]).first()
+        if user is None:
+            raise CommandError(f"No user with email {options['email']}")
+        artist, title = options["artist"], options["title"]
+        key = cache_keys.song_digest(artist, title)
+
+        queries = {
+            "duplicate check": Song.objects.filter(created_by=user, track__key=key),
+            "track lookup": Track.objects.filter(key=key),
+            "artist filter": Song.objects.filter(
+                created_by=user, artist__iexact=artist, title__iexact=title
+            ),
+            "status filter": Song.objects.filter(created_by=user, status="error"),
+            "pending claim": Song.objects.filter(status="pending").order_by("created")[
+                :10
+            ],
+            "list page": Song.objects.filter(created_by=user).order_by(
+                "-created", "id"
+            )[:10],
+        }
+        if connection.vendor == "postgresql":
+            queries["fuzzy search"] = Song.objects.filter(
+                title__trigram_word_similar=title
+            )
+            queries["country filter"] = Track.objects.filter(
+                countries__contains=["Mongolia"]
+            )
+        for name, queryset in queries.items():
+            plan = queryset.explain()
+            if _table_scan_re.search(plan):
+                label = self.style.WARNING("table scan")
+            else:
+                label = "index"
+            self.stdout.write(f"{name}: {label}")
+            self.stdout.write(f"  {plan.replace(chr(10), chr(10) + '  ')}")
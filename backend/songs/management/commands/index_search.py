@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from songs.models import Lyrics, Track
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the full-text search vectors of every stored lyrics text and "
+        "track, e.g. after changing SEARCH_CONFIG. Postgres only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Full-text search vectors need Postgres")
+        chunk_size = options["chunk_size"]
+
+        indexed = 0
+        for lyrics in Lyrics.objects.only("digest", "data").iterator(chunk_size):
+            Lyrics.objects.filter(digest=lyrics.digest).update(
+                search_vector=Lyrics.vector(lyrics.text)
+            )
+            indexed += 1
+        self.stdout.write(f"Indexed {indexed} lyrics")
+
+        track_ids = list(Track.objects.order_by("id").values_list("id", flat=True))
+        for start in range(0, len(track_ids), chunk_size):
+            Track.objects.filter(id__in=track_ids[start : start + chunk_size]).store()
+        self.stdout.write(f"Indexed {len(track_ids)} tracks")
@@ -0,0 +1,127 @@
+import multiprocessing
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from songs import metrics
+from songs.management.commands.bench_async_worker import (
+    MockUpstreamHandler,
+    MockUpstreamServer,
+)
+from songs.models import Song, Track
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test POST songs/ of a running server against a slow mock "
+        "Musixmatch. Start the server with MUSIXMATCH_API_BASE_URL pointing at "
+        "the mock (printed on start) and one worker process; run once per "
+        "SONG_CREATE_MODE to compare. Created songs are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://localhost:8000")
+        parser.add_argument("--email", required=True, help="User to create as")
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument("--mock-port", type=int, default=8765)
+        parser.add_argument(
+            "--musixmatch-latency", type=float, default=1.0, help="Seconds"
+        )
+        parser.add_argument(
+            "--wait",
+            type=float,
+            default=0,
+            help="Seconds to wait after starting the mock, to start the server",
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options["email"]).first()
+        if user is None:
+            raise CommandError(f"No user with email {options['email']}")
+
+        MockUpstreamHandler.musixmatch_latency = options["musixmatch_latency"]
+        server = MockUpstreamServer(
+            ("127.0.0.1", options["mock_port"]), MockUpstreamHandler
+        )
+        server_process = multiprocessing.get_context("fork").Process(
+            target=server.serve_forever, daemon=True
+        )
+        server_process.start()
+        server.server_close()
+        self.stdout.write(
+            f"Mock Musixmatch at http://127.0.0.1:{options['mock_port']}/ws/1.1"
+        )
+        time.sleep(options["wait"])
+
+        self.token = str(AccessToken.for_user(user))
+        self.local = threading.local()
+        run = uuid.uuid4().hex[:8]
+        artist = f"loadtest-{run}"
+        url = f"{options['base_url'].rstrip('/')}/api/v1/songs/"
+
+        def create(n):
+            start = time.perf_counter()
+            response = self.session().post(
+                url, json={"artist": artist, "title": f"song {run} {n}"}
+            )
+            return (time.perf_counter() - start) * 1000, response.status_code
+
+        counters = metrics.snapshot()
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+                results = list(executor.map(create, range(options["requests"])))
+            elapsed = time.perf_counter() - start
+        finally:
+            server_process.terminate()
+            Song.objects.filter(artist=artist).delete()
+            Track.objects.filter(artist=artist).delete()
+
+        # Measured by the server as requests arrive, see metrics.concurrency.
+        # Counters still buffered by the server are left out.
+        server_counters = metrics.snapshot()
+        sampled, in_flight_sum = (
+            server_counters.get(name, 0) - counters.get(name, 0)
+            for name in ("songs.create.requests", "songs.create.in_flight")
+        )
+
+        timings = sorted(elapsed_ms for elapsed_ms, _ in results)
+        statuses = {}
+        for _, status_code in results:
+            statuses[status_code] = statuses.get(status_code, 0) + 1
+        throughput = len(timings) / elapsed
+        # Little's law: requests in flight = arrival rate x time in system
+        in_flight = throughput * statistics.fmean(timings) / 1000
+
+        self.stdout.write(
+            f"{len(timings)} requests, client concurrency {options['concurrency']}, "
+            f"Musixmatch {options['musixmatch_latency']}s"
+        )
+        self.stdout.write(
+            f"{throughput:.1f} req/s, served concurrently {in_flight:.1f}, "
+            f"p50 {statistics.median(timings):.0f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95)]:.0f} ms, "
+            f"p99 {timings[int(len(timings) * 0.99)]:.0f} ms, "
+            f"statuses {statuses}"
+        )
+        if sampled:
+            self.stdout.write(
+                f"Server side: {1 + in_flight_sum / sampled:.1f} requests in "
+                f"flight on average, over {sampled:.0f} flushed requests"
+            )
+
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            self.local.session.headers["Authorization"] = f"Bearer {self.token}"
+        return self.local.session
@@ -0,0 +1,110 @@
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django_redis import get_redis_connection
+from rest_framework_simplejwt.tokens import AccessToken
+
+from songs import status_records
+from songs.models import Song
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the song status endpoints of a running server. Each run "
+        "is measured twice: with status records evicted before every "
+        "request, which forces the database path, and with records in Redis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://localhost:8000")
+        parser.add_argument("--email", required=True, help="User to poll as")
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument(
+            "--bulk",
+            type=int,
+            default=0,
+            help="Poll songs/status/?ids= with this many IDs per request",
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email=options["email"]).first()
+        if user is None:
+            raise CommandError(f"No user with email {options['email']}")
+        song_ids = [
+            str(song_id)
+            for song_id in Song.objects.filter(created_by=user).values_list(
+                "id", flat=True
+            )[:1000]
+        ]
+        if not song_ids:
+            raise CommandError("The user has no songs to poll")
+
+        self.base_url = options["base_url"].rstrip("/")
+        self.token = str(AccessToken.for_user(user))
+        self.local = threading.local()
+
+        self.stdout.write(
+            f"{options['requests']} requests, concurrency {options['concurrency']}, "
+            f"{len(song_ids)} songs"
+        )
+        self.stdout.write(
+            f"{'path':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'max ms':>8} {'errors':>7}"
+        )
+        for label, evict in (("database", True), ("redis", False)):
+            timings, errors, elapsed = self.run(song_ids, evict, options)
+            timings.sort()
+            self.stdout.write(
+                f"{label:<10} {len(timings) / elapsed:>8.1f} "
+                f"{statistics.median(timings):>8.2f} "
+                f"{timings[int(len(timings) * 0.95)]:>8.2f} "
+                f"{timings[int(len(timings) * 0.99)]:>8.2f} "
+                f"{timings[-1]:>8.2f} {errors:>7}"
+            )
+
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            self.local.session.headers["Authorization"] = f"Bearer {self.token}"
+        return self.local.session
+
+    def run(self, song_ids, evict, options):
+        redis = get_redis_connection("default")
+
+        def poll(_):
+            if options["bulk"]:
+                batch = random.sample(song_ids, min(options["bulk"], len(song_ids)))
+                url = f"{self.base_url}/api/v1/songs/status/?ids={','.join(batch)}"
+            else:
+                batch = [random.choice(song_ids)]
+                url = f"{self.base_url}/api/v1/songs/{batch[0]}/status/"
+            if evict:
+                redis.delete(*(status_records.record_key(i) for i in batch))
+
+            start = time.perf_counter()
+            response = self.session().get(url)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            return elapsed_ms, response.status_code >= 500
+
+        if not evict:
+            # Warm the records so the measured requests all hit Redis
+            for song_id in song_ids:
+                self.session().get(f"{self.base_url}/api/v1/songs/{song_id}/status/")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            results = list(executor.map(poll, range(options["requests"])))
+        elapsed = time.perf_counter() - start
+
+        timings = [elapsed_ms for elapsed_ms, _ in results]
+        errors = sum(failed for _, failed in results)
+        return timings, errors, elapsed
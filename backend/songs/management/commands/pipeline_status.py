@@ -0,0 +1,43 @@
+from celery import current_app
+from django.core.management.base import BaseCommand
+
+from songs import metrics
+from songs.tasks import STAGE_ANALYSIS, STAGE_LYRICS, STAGE_PERSIST
+
+STAGES = (STAGE_LYRICS, STAGE_ANALYSIS, STAGE_PERSIST)
+
+
+class Command(BaseCommand):
+    help = (
+        "Show the depth of each analysis chain queue and the mean time songs "
+        "spent waiting in it and being processed by its workers"
+    )
+
+    def handle(self, *args, **options):
+        counters = metrics.snapshot()
+        self.stdout.write(
+            f"{'stage':<10} {'queued':>8} {'tasks':>10} {'wait ms':>10} {'run ms':>10}"
+        )
+        with current_app.connection_for_read() as connection:
+            for stage in STAGES:
+                tasks = counters.get(f"pipeline.{stage}.count", 0)
+                waited = counters.get(f"pipeline.{stage}.wait.count", 0)
+                wait_ms = (
+                    counters.get(f"pipeline.{stage}.wait.ms", 0) / waited
+                    if waited
+                    else 0
+                )
+                run_ms = counters.get(f"pipeline.{stage}.ms", 0) / tasks if tasks else 0
+                self.stdout.write(
+                    f"{stage:<10} {self.depth(connection, stage):>8} {tasks:>10.0f} "
+                    f"{wait_ms:>10.1f} {run_ms:>10.1f}"
+                )
+
+    def depth(self, connection, queue: str) -> int:
+        try:
+            return connection.default_channel.queue_declare(
+                queue=queue, passive=True
+            ).message_count
+        except connection.channel_errors:
+            # Brokers like Redis drop a queue once it is empty
+            return 0
@@ -0,0 +1,259 @@
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from songs import status_records
+from songs.batch_backends import BATCH_COMPLETED, BATCH_FAILED, get_batch_backend
+from songs.gazetteer import extract_countries
+from songs.models import Lyrics, Song, Track
+from songs.services import AnalysisService
+
+UPDATE_FIELDS = ["summary", "countries", "analyzed_at", "modified"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-analyze every track with lyrics offline: stream requests to JSONL "
+        "files, run them through a batch backend and apply the results. "
+        "Progress is checkpointed, rerun with --job to resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--job", help="ID of a job to resume")
+        parser.add_argument("--backend", help="Dotted path of the batch backend")
+        parser.add_argument(
+            "--requests-per-file",
+            type=int,
+            default=settings.ANALYSIS_BATCH_MAX_REQUESTS,
+        )
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--poll-interval", type=float, default=60)
+        parser.add_argument(
+            "--no-wait",
+            action="store_true",
+            help="Exit after submitting instead of waiting for results",
+        )
+
+    def handle(self, *args, **options):
+        job_id = options["job"] or timezone.now().strftime("%Y%m%d%H%M%S")
+        self.job_dir = Path(settings.ANALYSIS_BATCH_DIR) / job_id
+        self.checkpoint_path = self.job_dir / "checkpoint.json"
+
+        if self.checkpoint_path.exists():
+            self.checkpoint = json.loads(self.checkpoint_path.read_text())
+            self.stdout.write(f"Resuming job {job_id}")
+        elif options["job"]:
+            raise CommandError(f"No checkpoint found for job {job_id}")
+        else:
+            self.job_dir.mkdir(parents=True)
+            self.checkpoint = {
+                "job_id": job_id,
+                "backend": options["backend"] or settings.ANALYSIS_BATCH_BACKEND,
+                "written_through": None,
+                "writing_done": False,
+                "parts": [],
+            }
+            self.save_checkpoint()
+            self.stdout.write(f"Started job {job_id}")
+
+        self.backend = get_batch_backend(self.checkpoint["backend"])
+
+        if not self.checkpoint["writing_done"]:
+            self.write_requests(options["requests_per_file"], options["chunk_size"])
+
+        for part in self.checkpoint["parts"]:
+            if part["state"] == "ready":
+                part["batch_id"] = self.backend.submit(self.job_dir / part["path"])
+                part["state"] = "submitted"
+                self.save_checkpoint()
+                self.stdout.write(f"Submitted {part['path']} as {part['batch_id']}")
+
+        while True:
+            waiting = False
+            for part in self.checkpoint["parts"]:
+                if part["state"] != "submitted":
+                    continue
+                batch_status = self.backend.status(part["batch_id"])
+                if batch_status == BATCH_COMPLETED:
+                    self.apply_results(part, options["chunk_size"])
+                elif batch_status == BATCH_FAILED:
+                    part["state"] = "failed"
+                    self.save_checkpoint()
+                    self.stderr.write(f"Batch {part['batch_id']} failed")
+                else:
+                    waiting = True
+
+            if not waiting:
+                break
+            if options["no_wait"]:
+                self.stdout.write(f"Batches still running, resume with --job {job_id}")
+                return
+            time.sleep(options["poll_interval"])
+
+        applied = sum(part["applied_lines"] for part in self.checkpoint["parts"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Job {job_id} finished, {applied} results applied")
+        )
+
+    def save_checkpoint(self):
+        # Write then rename so an interrupted run never leaves a torn file.
+        tmp_path = self.checkpoint_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.checkpoint, indent=2))
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def write_requests(self, requests_per_file, chunk_size):
+        """Stream tracks into request files, checkpointing after each chunk"""
+        queryset = (
+            Track.objects.exclude(lyrics__isnull=True)
+            .order_by("id")
+            .values_list("id", "lyrics__data")
+        )
+        if self.checkpoint["written_through"]:
+            queryset = queryset.filter(id__gt=self.checkpoint["written_through"])
+
+        part = self.open_part()
+        request_file = open(self.job_dir / part["path"], "r+")
+        # Drop lines written after the last checkpoint by an interrupted run
+        request_file.truncate(part["bytes"])
+        request_file.seek(part["bytes"])
+
+        try:
+            for index, (track_id, data) in enumerate(
+                queryset.iterator(chunk_size=chunk_size), 1
+            ):
+                if part["requests"] >= requests_per_file:
+                    request_file.close()
+                    part["state"] = "ready"
+                    part = self.open_part()
+                    request_file = open(self.job_dir / part["path"], "r+")
+
+                request = {
+                    "custom_id": str(track_id),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": AnalysisService.build_request(Lyrics.decompress(data)),
+                }
+                request_file.write(json.dumps(request) + "\n")
+                part["requests"] += 1
+                self.checkpoint["written_through"] = str(track_id)
+
+                if index % chunk_size == 0:
+                    request_file.flush()
+                    part["bytes"] = request_file.tell()
+                    self.save_checkpoint()
+        finally:
+            request_file.flush()
+            part["bytes"] = request_file.tell()
+            request_file.close()
+            self.save_checkpoint()
+
+        if part["requests"]:
+            part["state"] = "ready"
+        else:
+            self.checkpoint["parts"].remove(part)
+        self.checkpoint["writing_done"] = True
+        self.save_checkpoint()
+        self.stdout.write(f"Wrote {len(self.checkpoint['parts'])} request files")
+
+    def open_part(self):
+        parts = self.checkpoint["parts"]
+        if parts and parts[-1]["state"] == "writing":
+            return parts[-1]
+
+        part = {
+            "path": f"requests_{len(parts) + 1:04d}.jsonl",
+            "requests": 0,
+            "bytes": 0,
+            "state": "writing",
+            "batch_id": None,
+            "applied_lines": 0,
+        }
+        (self.job_dir / part["path"]).touch()
+        parts.append(part)
+        self.save_checkpoint()
+        return part
+
+    def apply_results(self, part, chunk_size):
+        """Stream a result file into the database in bulk_update chunks"""
+        output_path = self.job_dir / part["path"].replace("requests_", "results_")
+        if not output_path.exists():
+            tmp_path = output_path.with_name(f"{uuid.uuid4().hex}.tmp")
+            self.backend.download_results(part["batch_id"], tmp_path)
+            os.replace(tmp_path, output_path)
+
+        tracks = []
+        failed = 0
+        line_number = 0
+        with open(output_path) as results_file:
+            for line_number, line in enumerate(results_file, 1):
+                if line_number <= part["applied_lines"]:
+                    continue
+
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    failed += 1
+                else:
+                    content = response["body"]["choices"][0]["message"]["content"]
+                    success, _, analysis_data = AnalysisService.parse_analysis(content)
+                    if success:
+                        tracks.append(
+                            Track(
+                                id=result["custom_id"],
+                                summary=analysis_data["summary"],
+                                countries=analysis_data["countries"],
+                                analyzed_at=timezone.now(),
+                                modified=timezone.now(),
+                            )
+                        )
+                    else:
+                        failed += 1
+
+                if len(tracks) >= chunk_size:
+                    self.save_tracks(tracks)
+                    tracks = []
+                    part["applied_lines"] = line_number
+                    self.save_checkpoint()
+
+        if tracks:
+            self.save_tracks(tracks)
+        part["applied_lines"] = line_number
+        part["state"] = "applied"
+        self.save_checkpoint()
+        self.stdout.write(
+            f"Applied {part['path']}: {line_number} results, {failed} failed"
+        )
+
+    def save_tracks(self, tracks):
+        track_ids = [track.id for track in tracks]
+        if settings.COUNTRY_EXTRACTION == "gazetteer":
+            # Result lines only hold the reply. The lyrics were sent in the
+            # request files, but results come back in any order, so read
+            # the chunk's lyrics back from the database rather than
+            # searching a request file for each track
+            lyrics_by_id = {
+                str(track_id): Lyrics.decompress(data)
+                for track_id, data in Track.objects.filter(
+                    id__in=track_ids, lyrics__isnull=False
+                ).values_list("id", "lyrics__data")
+            }
+            for track in tracks:
+                track.countries = extract_countries(lyrics_by_id.get(str(track.id)))
+        Track.objects.bulk_update(tracks, UPDATE_FIELDS)
+        Track.objects.filter(id__in=track_ids).store()
+        # Every user's finished song of a track shows its new analysis. Songs
+        # still pending or processing are left to their own analysis, which
+        # may store a newer one
+        songs = Song.objects.filter(track_id__in=track_ids)
+        songs.transition(("completed", "error"), status="completed", message="")
+        status_records.publish(
+            *songs.filter(status="completed")
+            .only("id", "status", "message", "created_by_id")
+            .iterator()
+        )
@@ -0,0 +1,45 @@
+import asyncio
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from songs.async_worker import AsyncWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Analyze pending songs on one asyncio event loop, many at once. "
+        "Used instead of the Celery worker when ANALYSIS_WORKER is async."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, default=settings.ASYNC_WORKER_CONCURRENCY
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once no pending songs are left",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Run even though Celery tasks are queued for new songs",
+        )
+
+    def handle(self, *args, **options):
+        if settings.ANALYSIS_WORKER != "async" and not options["force"]:
+            # Songs would be analyzed by both their Celery task and this worker
+            raise CommandError(
+                "ANALYSIS_WORKER is not async, use --force to drain pending songs"
+            )
+        processed = asyncio.run(self.run(options["concurrency"], options["burst"]))
+        self.stdout.write(f"Processed {processed} songs")
+
+    async def run(self, concurrency, burst):
+        worker = AsyncWorker(concurrency=concurrency)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, worker.stop)
+        return await worker.run(burst=burst)
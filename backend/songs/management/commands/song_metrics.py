@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from songs import metrics
+
+
+class Command(BaseCommand):
+    help = "Show the upstream and cache counters aggregated across all processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--prefix", default="", help="Only show counters starting with this"
+        )
+        parser.add_argument(
+            "--reset", action="store_true", help="Clear all counters afterwards"
+        )
+
+    def handle(self, *args, **options):
+        counters = metrics.snapshot()
+        for name in sorted(counters):
+            if name.startswith(options["prefix"]):
+                self.stdout.write(f"{name:<50} {counters[name]:>14.1f}")
+
+        requests_made = counters.get("musixmatch.requests", 0)
+        requests_saved = counters.get("musixmatch.requests_saved", 0)
+        if requests_made or requests_saved:
+            ratio = requests_saved / (requests_made + requests_saved)
+            self.stdout.write(
+                self.style.SUCCESS(f"Musixmatch requests saved by reuse: {ratio:.1%}")
+            )
+
+        if options["reset"]:
+            get_redis_connection("default").delete(metrics.METRICS_KEY)
+            self.stdout.write(self.style.WARNING("Counters reset."))
@@ -0,0 +1,103 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = "lyrintel:metrics"
+
+_lock = threading.Lock()
+_pending: Dict[str, float] = defaultdict(float)
+_in_flight: Dict[str, int] = defaultdict(int)
+_last_flush = time.monotonic()
+
+
+def incr(name: str, amount: float = 1) -> None:
+    """
+    Increment a counter. Counters are buffered in-process and flushed to
+    a Redis hash every METRICS_FLUSH_INTERVAL seconds, so hot paths never
+    pay a network round-trip per increment.
+    """
+    global _last_flush
+    with _lock:
+        _pending[name] += amount
+        due = time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        flush()
+
+
+@contextmanager
+def timer(name: str):
+    """Record the call count and total milliseconds spent in the block"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        incr(f"{name}.count")
+        incr(f"{name}.ms", elapsed_ms)
+        logger.debug("%s took %.1f ms", name, elapsed_ms)
+
+
+@contextmanager
+def concurrency(name: str):
+    """
+    Track the requests in flight in this process. Dividing
+    `<name>.in_flight` by `<name>.requests` gives the mean number of requests
+    a process was already serving when another one arrived.
+    """
+    with _lock:
+        in_flight = _in_flight[name]
+        _in_flight[name] += 1
+    incr(f"{name}.requests")
+    incr(f"{name}.in_flight", in_flight)
+    try:
+        yield
+    finally:
+        with _lock:
+            _in_flight[name] -= 1
+
+
+def flush() -> None:
+    """Push buffered counters to Redis"""
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return
+
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        for name, amount in pending.items():
+            pipe.hincrbyfloat(METRICS_KEY, name, amount)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Failed to flush metrics: %s", str(e))
+
+
+def snapshot() -> Dict[str, float]:
+    """Return the aggregated counters of all processes"""
+    flush()
+    raw = get_redis_connection("default").hgetall(METRICS_KEY)
+    return {key.decode(): float(value) for key, value in raw.items()}
+
+
+def _reset_after_fork() -> None:
+    # Counters buffered by the parent must not be flushed twice.
+    global _lock, _last_flush
+    _lock = threading.Lock()
+    _pending.clear()
+    _in_flight.clear()
+    _last_flush = time.monotonic()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
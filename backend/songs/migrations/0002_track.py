@@ -0,0 +1,300 @@
+import hashlib
+import re
+import unicodedata
+import uuid
+from itertools import islice
+
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+from django.conf import settings
+from django.db import migrations, models
+
+_whitespace_re = re.compile(r"\s+")
+
+# Songs and tracks read and written at a time
+CHUNK_SIZE = 2000
+
+
+def _normalize_text(value):
+    # Frozen copy of cache_keys.normalize_text as of this migration
+    value = unicodedata.normalize("NFKC", value or "").casefold()
+    value = "".join(
+        char for char in value if not unicodedata.category(char).startswith("P")
+    )
+    return _whitespace_re.sub(" ", value).strip()
+
+
+def _song_digest(artist, title):
+    h = hashlib.blake2b(digest_size=16)
+    for part in (_normalize_text(artist), _normalize_text(title)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+def _chunks(iterable):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, CHUNK_SIZE)):
+        yield chunk
+
+
+def link_tracks(apps, schema_editor):
+    """
+    Create one track per normalized artist and title and link its songs.
+    The track takes the latest completed analysis among them, or the
+    latest lyrics when none completed. A user holding spelling variants
+    of one track keeps the latest of them, as a user now has a track at
+    most once; the others are moved, with all they held, to MergedSong.
+
+    Songs are streamed in chunks, so the migration holds one chunk in
+    memory: a first pass creates the tracks and links every song, and a
+    second pass over the tracks fills them from their songs and merges
+    the variants.
+    """
+    Song = apps.get_model("songs", "Song")
+    Track = apps.get_model("songs", "Track")
+    MergedSong = apps.get_model("songs", "MergedSong")
+
+    # Spelling variants mostly sort next to each other, so most of a
+    # chunk's tracks are new
+    songs = (
+        Song.objects.order_by("artist", "title")
+        .only("id", "artist", "title")
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for chunk in _chunks(songs):
+        keys = {song.id: _song_digest(song.artist, song.title) for song in chunk}
+        new_tracks = {}
+        for song in chunk:
+            new_tracks.setdefault(
+                keys[song.id],
+                Track(key=keys[song.id], artist=song.artist, title=song.title),
+            )
+        # Tracks of keys seen in earlier chunks already exist
+        Track.objects.bulk_create(new_tracks.values(), ignore_conflicts=True)
+        track_ids = dict(
+            Track.objects.filter(key__in=new_tracks).values_list("key", "id")
+        )
+        for song in chunk:
+            song.track_id = track_ids[keys[song.id]]
+        Song.objects.bulk_update(chunk, ["track"])
+
+    for tracks in _chunks(
+        Track.objects.order_by("key").iterator(chunk_size=CHUNK_SIZE)
+    ):
+        songs_by_track = {}
+        for song in Song.objects.filter(track__in=tracks).order_by("-modified"):
+            songs_by_track.setdefault(song.track_id, []).append(song)
+
+        merged = []
+        for track in tracks:
+            songs = songs_by_track[track.id]
+            completed = [song for song in songs if song.status == "completed"]
+            with_lyrics = [song for song in songs if song.lyrics]
+            source = (completed or with_lyrics or songs)[0]
+            track.artist = source.artist
+            track.title = source.title
+            track.lyrics = source.lyrics
+            track.summary = source.summary if completed else None
+            track.countries = source.countries if completed else []
+            track.analyzed_at = source.modified if completed else None
+
+            kept = {}
+            for song in songs:
+                kept_id = kept.setdefault(song.created_by_id, song.id)
+                if kept_id != song.id:
+                    merged.append(
+                        MergedSong(
+                            id=song.id,
+                            song_id=kept_id,
+                            artist=song.artist,
+                            title=song.title,
+                            status=song.status,
+                            message=song.message,
+                            lyrics=song.lyrics,
+                            summary=song.summary,
+                            countries=song.countries,
+                            song_created=song.created,
+                        )
+                    )
+        Track.objects.bulk_update(
+            tracks,
+            ["artist", "title", "lyrics", "summary", "countries", "analyzed_at"],
+        )
+        MergedSong.objects.bulk_create(merged)
+        Song.objects.filter(id__in=[song.id for song in merged]).delete()
+
+
+def unlink_tracks(apps, schema_editor):
+    Song = apps.get_model("songs", "Song")
+    MergedSong = apps.get_model("songs", "MergedSong")
+    for song in Song.objects.select_related("track").iterator():
+        song.lyrics = song.track.lyrics
+        song.summary = song.track.summary
+        song.countries = song.track.countries
+        song.save(update_fields=["lyrics", "summary", "countries"])
+    for merged in MergedSong.objects.select_related("song").iterator():
+        Song.objects.create(
+            id=merged.id,
+            created=merged.song_created,
+            artist=merged.artist,
+            title=merged.title,
+            status=merged.status,
+            message=merged.message,
+            lyrics=merged.lyrics,
+            summary=merged.summary,
+            countries=merged.countries,
+            created_by_id=merged.song.created_by_id,
+            track_id=merged.song.track_id,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Track",
+            fields=[
+                (
+                    "created",
+                    model_utils.fields.AutoCreatedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="created",
+                    ),
+                ),
+                (
+                    "modified",
+                    model_utils.fields.AutoLastModifiedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="modified",
+                    ),
+                ),
+                (
+                    "id",
+                    model_utils.fields.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("key", models.CharField(max_length=32, unique=True)),
+                ("artist", models.CharField(max_length=255)),
+                ("title", models.CharField(max_length=255)),
+                ("lyrics", models.TextField(blank=True, null=True)),
+                ("summary", models.TextField(blank=True, null=True)),
+                (
+                    "countries",
+                    models.JSONField(blank=True, default=list, null=True),
+                ),
+                ("analyzed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "verbose_name": "Track",
+                "verbose_name_plural": "Tracks",
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name="song",
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name="song",
+            name="track",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="songs",
+                to="songs.track",
+            ),
+        ),
+        migrations.CreateModel(
+            name="MergedSong",
+            fields=[
+                (
+                    "created",
+                    model_utils.fields.AutoCreatedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="created",
+                    ),
+                ),
+                (
+                    "modified",
+                    model_utils.fields.AutoLastModifiedField(
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        verbose_name="modified",
+                    ),
+                ),
+                (
+                    "id",
+                    model_utils.fields.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("artist", models.CharField(max_length=255)),
+                ("title", models.CharField(max_length=255)),
+                ("status", models.CharField(max_length=20)),
+                ("message", models.TextField(blank=True, null=True)),
+                ("lyrics", models.TextField(blank=True, null=True)),
+                ("summary", models.TextField(blank=True, null=True)),
+                (
+                    "countries",
+                    models.JSONField(blank=True, default=list, null=True),
+                ),
+                ("song_created", models.DateTimeField()),
+                (
+                    "song",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="merged_songs",
+                        to="songs.song",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Merged song",
+                "verbose_name_plural": "Merged songs",
+            },
+        ),
+        migrations.RunPython(link_tracks, unlink_tracks),
+        migrations.AlterField(
+            model_name="song",
+            name="track",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="songs",
+                to="songs.track",
+            ),
+        ),
+        migrations.RemoveField(
+            model_name="song",
+            name="lyrics",
+        ),
+        migrations.RemoveField(
+            model_name="song",
+            name="summary",
+        ),
+        migrations.RemoveField(
+            model_name="song",
+            name="countries",
+        ),
+        migrations.AddConstraint(
+            model_name="song",
+            constraint=models.UniqueConstraint(
+                fields=("created_by", "track"), name="song_unique_track_per_user"
+            ),
+        ),
+    ]
@@ -0,0 +1,93 @@
+import hashlib
+
+import django.db.models.deletion
+import pyzstd
+from django.db import migrations, models
+
+# Level of LYRICS_COMPRESSION_LEVEL's default, as of this migration
+COMPRESSION_LEVEL = 19
+
+
+def _digest(text):
+    # Frozen copy of cache_keys.digest as of this migration
+    h = hashlib.blake2b(digest_size=16)
+    h.update(text.encode("utf-8"))
+    h.update(b"\x1f")
+    return h.hexdigest()
+
+
+def store_lyrics(apps, schema_editor):
+    """Move every track's lyrics text into the content-addressed table"""
+    Lyrics = apps.get_model("songs", "Lyrics")
+    Track = apps.get_model("songs", "Track")
+
+    tracks = Track.objects.exclude(lyrics_text__isnull=True).exclude(lyrics_text="")
+    for track in tracks.only("id", "lyrics_text").iterator():
+        lyrics_digest = _digest(track.lyrics_text)
+        if not Lyrics.objects.filter(digest=lyrics_digest).exists():
+            Lyrics.objects.create(
+                digest=lyrics_digest,
+                data=pyzstd.compress(
+                    track.lyrics_text.encode("utf-8"), COMPRESSION_LEVEL
+                ),
+            )
+        Track.objects.filter(id=track.id).update(
+            lyrics_id=lyrics_digest, lyrics_length=len(track.lyrics_text)
+        )
+
+
+def restore_lyrics(apps, schema_editor):
+    Track = apps.get_model("songs", "Track")
+    for track in Track.objects.select_related("lyrics").exclude(lyrics=None):
+        track.lyrics_text = pyzstd.decompress(track.lyrics.data).decode("utf-8")
+        track.save(update_fields=["lyrics_text"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0002_track"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Lyrics",
+            fields=[
+                (
+                    "digest",
+                    models.CharField(max_length=32, primary_key=True, serialize=False),
+                ),
+                ("data", models.BinaryField()),
+            ],
+            options={
+                "verbose_name": "Lyrics",
+                "verbose_name_plural": "Lyrics",
+            },
+        ),
+        migrations.RenameField(
+            model_name="track",
+            old_name="lyrics",
+            new_name="lyrics_text",
+        ),
+        migrations.AddField(
+            model_name="track",
+            name="lyrics",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="tracks",
+                to="songs.lyrics",
+            ),
+        ),
+        migrations.AddField(
+            model_name="track",
+            name="lyrics_length",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(store_lyrics, restore_lyrics),
+        migrations.RemoveField(
+            model_name="track",
+            name="lyrics_text",
+        ),
+    ]
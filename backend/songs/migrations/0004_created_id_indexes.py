@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0003_lyrics"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="song",
+            index=models.Index(fields=["-created", "id"], name="song_created_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="song",
+            index=models.Index(
+                fields=["created_by", "-created", "id"],
+                name="song_owner_created_id_idx",
+            ),
+        ),
+    ]
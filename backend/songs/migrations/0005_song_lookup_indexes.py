@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:09
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0004_created_id_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="song",
+            index=models.Index(
+                models.F("created_by"),
+                django.db.models.functions.text.Upper("artist"),
+                django.db.models.functions.text.Upper("title"),
+                name="song_owner_artist_title_ci_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="song",
+            index=models.Index(
+                condition=models.Q(("status", "completed"), _negated=True),
+                fields=["status", "created"],
+                name="song_unfinished_status_idx",
+            ),
+        ),
+    ]
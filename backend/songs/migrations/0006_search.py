@@ -0,0 +1,85 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:15
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import pyzstd
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import migrations, models
+from django.db.models.expressions import CombinedExpression
+from django.db.models.functions import Coalesce
+
+
+def index_search(apps, schema_editor):
+    """
+    Fill the search vectors of stored lyrics and of tracks, as
+    LyricsManager.store_many and TrackQuerySet.store did as of this
+    migration
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    Lyrics = apps.get_model("songs", "Lyrics")
+    Track = apps.get_model("songs", "Track")
+    config = settings.SEARCH_CONFIG
+
+    for lyrics in Lyrics.objects.iterator():
+        text = pyzstd.decompress(lyrics.data).decode("utf-8")
+        Lyrics.objects.filter(digest=lyrics.digest).update(
+            search_vector=SearchVector(models.Value(text), weight="B", config=config)
+        )
+    lyrics_vector = Lyrics.objects.filter(digest=models.OuterRef("lyrics_id")).values(
+        "search_vector"
+    )
+    Track.objects.update(
+        search_vector=CombinedExpression(
+            SearchVector("summary", weight="A", config=config),
+            "||",
+            Coalesce(
+                models.Subquery(lyrics_vector),
+                models.Value("", output_field=SearchVectorField()),
+            ),
+            output_field=SearchVectorField(),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0005_song_lookup_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name="lyrics",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                blank=True, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="track",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                blank=True, null=True
+            ),
+        ),
+        migrations.RunPython(index_search, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="song",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["artist", "title"],
+                name="song_artist_title_trgm_idx",
+                opclasses=["gin_trgm_ops", "gin_trgm_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="track",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="track_search_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.7 on 2026-10-18 01:22
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0006_search"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CountryCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("country", models.CharField(max_length=255)),
+                ("songs", models.PositiveIntegerField()),
+                ("refreshed_at", models.DateTimeField()),
+            ],
+            options={
+                "verbose_name": "Country count",
+                "verbose_name_plural": "Country counts",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="track",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["countries"],
+                name="track_countries_idx",
+                opclasses=["jsonb_path_ops"],
+            ),
+        ),
+        migrations.AddField(
+            model_name="countrycount",
+            name="user",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="country_counts",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
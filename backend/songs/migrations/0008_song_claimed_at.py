@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 02:00
+
+from django.db import migrations, models
+
+
+def date_claims(apps, schema_editor):
+    """
+    Date the claims of songs processing now by their last change, which
+    came at or after the claim, so abandoned ones turn stale too
+    """
+    Song = apps.get_model("songs", "Song")
+    Song.objects.filter(status="processing").update(claimed_at=models.F("modified"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("songs", "0007_country_counts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="song",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(date_claims, migrations.RunPython.noop),
+    ]
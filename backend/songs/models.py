@@ -1,6 +1,237 @@
-from django.db import models
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
+
+import pyzstd
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connections, models, transaction
+from django.db.models.expressions import CombinedExpression
+from django.db.models.functions import Coalesce, Upper
+from django.utils import timezone
 from model_utils.models import TimeStampedModel, UUIDModel
 
+from .cache_keys import digest, song_digest
+
+
+class LyricsManager(models.Manager):
+    def store_many(self, texts: Iterable[str]) -> List["Lyrics"]:
+        """
+        Store lyrics texts compressed, each distinct text once, with one
+        INSERT, and return their rows in the order given
+        """
+        indexed = connections[self.db].vendor == "postgresql"
+        lyrics = [
+            Lyrics(
+                digest=digest(text),
+                data=pyzstd.compress(
+                    text.encode("utf-8"), settings.LYRICS_COMPRESSION_LEVEL
+                ),
+                search_vector=Lyrics.vector(text) if indexed else None,
+            )
+            for text in texts
+        ]
+        # Texts stored before, by any track, are skipped
+        self.bulk_create(
+            {row.digest: row for row in lyrics}.values(), ignore_conflicts=True
+        )
+        return lyrics
+
+    def track_fields(self, text: str) -> Dict[str, Any]:
+        """Store a lyrics text and return the track columns pointing at it"""
+        return {"lyrics": self.store_many([text])[0], "lyrics_length": len(text)}
+
+
+class Lyrics(models.Model):
+    """
+    Lyrics texts, zstd compressed and addressed by the digest of their
+    content, so identical lyrics are stored once. Tracks only hold the
+    digest and length: listing songs never reads lyrics.
+    """
+
+    digest = models.CharField(max_length=32, primary_key=True)
+    data = models.BinaryField()
+    # Postgres only, computed on insert as lyrics never change; tracks copy
+    # it into their own search vector
+    search_vector = SearchVectorField(blank=True, null=True)
+
+    objects = LyricsManager()
+
+    class Meta:
+        verbose_name = "Lyrics"
+        verbose_name_plural = "Lyrics"
+
+    def __str__(self):
+        return self.digest
+
+    @staticmethod
+    def decompress(data) -> str:
+        return pyzstd.decompress(data).decode("utf-8")
+
+    @property
+    def text(self) -> str:
+        return self.decompress(self.data)
+
+    @staticmethod
+    def vector(text: str) -> SearchVector:
+        return SearchVector(
+            models.Value(text), weight="B", config=settings.SEARCH_CONFIG
+        )
+
+
+class TrackQuerySet(models.QuerySet):
+    def store(self, **fields) -> int:
+        """
+        Update the given columns of the tracks with one UPDATE, and on
+        Postgres rebuild their search vector from the summary and lyrics
+        being stored, or the current ones. Without fields it only rebuilds
+        the vector, e.g. after a bulk_update of summaries.
+        """
+        return self.update(**self._stored_fields(fields))
+
+    async def astore(self, **fields) -> int:
+        return await self.aupdate(**self._stored_fields(fields))
+
+    def _stored_fields(self, fields: Dict[str, Any]) -> Dict[str, Any]:
+        if connections[self.db].vendor == "postgresql":
+            fields["search_vector"] = self.search_vector(
+                summary=(
+                    models.Value(fields["summary"])
+                    if "summary" in fields
+                    else "summary"
+                ),
+                lyrics=(
+                    getattr(fields["lyrics"], "pk", None)
+                    if "lyrics" in fields
+                    else models.OuterRef("lyrics_id")
+                ),
+            )
+        return {"modified": timezone.now(), **fields}
+
+    @staticmethod
+    def search_vector(summary, lyrics) -> CombinedExpression:
+        """
+        A track's search vector: its summary, weighted above the vector of
+        its lyrics (see Lyrics.vector). Values in an UPDATE's SET clause see
+        the row as it was, hence the expressions for the new values.
+        """
+        lyrics_vector = Lyrics.objects.filter(digest=lyrics).values("search_vector")
+        return CombinedExpression(
+            SearchVector(summary, weight="A", config=settings.SEARCH_CONFIG),
+            "||",
+            Coalesce(
+                models.Subquery(lyrics_vector),
+                models.Value("", output_field=SearchVectorField()),
+            ),
+            output_field=SearchVectorField(),
+        )
+
+
+class TrackManager(models.Manager.from_queryset(TrackQuerySet)):
+    def for_song(self, artist: str, title: str) -> "Track":
+        """The track of an artist and title, created when first seen"""
+        track, _ = self.get_or_create(
+            key=song_digest(artist, title),
+            defaults={"artist": artist, "title": title},
+        )
+        return track
+
+    def for_songs(self, pairs: Iterable[Tuple[str, str]]) -> Dict[str, "Track"]:
+        """
+        Tracks of many artist/title pairs by key, creating the missing ones
+        with one INSERT
+        """
+        tracks = {
+            song_digest(artist, title): Track(
+                key=song_digest(artist, title), artist=artist, title=title
+            )
+            for artist, title in pairs
+        }
+        # Tracks created concurrently are skipped and read back below
+        self.bulk_create(tracks.values(), ignore_conflicts=True)
+        return {track.key: track for track in self.filter(key__in=tracks)}
+
+
+class Track(TimeStampedModel, UUIDModel):
+    """
+    A song as the catalog knows it, shared by the library rows of every
+    user who added it. Lyrics and their analysis are stored once per
+    normalized artist and title, see cache_keys.song_digest.
+    """
+
+    key = models.CharField(max_length=32, unique=True)
+    artist = models.CharField(max_length=255)
+    title = models.CharField(max_length=255)
+    lyrics = models.ForeignKey(
+        Lyrics,
+        on_delete=models.PROTECT,
+        related_name="tracks",
+        blank=True,
+        null=True,
+    )
+    lyrics_length = models.PositiveIntegerField(blank=True, null=True)
+    summary = models.TextField(blank=True, null=True)
+    countries = models.JSONField(default=list, blank=True, null=True)
+    analyzed_at = models.DateTimeField(blank=True, null=True)
+    # Full-text search of summaries and lyrics, kept by TrackQuerySet.store
+    search_vector = SearchVectorField(blank=True, null=True)
+
+    objects = TrackManager()
+
+    class Meta:
+        verbose_name = "Track"
+        verbose_name_plural = "Tracks"
+        indexes = [
+            GinIndex(fields=["search_vector"], name="track_search_idx"),
+            # Containment filters, e.g. the songs mentioning a country
+            GinIndex(
+                fields=["countries"],
+                opclasses=["jsonb_path_ops"],
+                name="track_countries_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.artist} - {self.title}"
+
+    @property
+    def is_analyzed(self) -> bool:
+        return self.analyzed_at is not None
+
+
+def claim_cutoff() -> datetime:
+    """Claims older than this are stale, see SONG_CLAIM_TIMEOUT"""
+    return timezone.now() - timedelta(seconds=settings.SONG_CLAIM_TIMEOUT)
+
+
+class SongQuerySet(models.QuerySet):
+    def transition(self, from_statuses, retake_stale=False, **fields) -> int:
+        """
+        Update the given columns of the songs still in one of
+        `from_statuses` in a single UPDATE, and return how many were. A song
+        another worker completed or failed in the meantime is left alone.
+        With `retake_stale`, processing songs whose claim is older than
+        SONG_CLAIM_TIMEOUT are updated too: their worker is taken to have
+        died.
+        """
+        return self.filter(self.in_statuses(from_statuses, retake_stale)).update(
+            modified=timezone.now(), **fields
+        )
+
+    async def atransition(self, from_statuses, retake_stale=False, **fields) -> int:
+        return await self.filter(self.in_statuses(from_statuses, retake_stale)).aupdate(
+            modified=timezone.now(), **fields
+        )
+
+    @staticmethod
+    def in_statuses(from_statuses, retake_stale=False) -> models.Q:
+        """Condition of transition, for the SELECTs that precede one"""
+        condition = models.Q(status__in=from_statuses)
+        if retake_stale:
+            condition |= models.Q(status="processing", claimed_at__lt=claim_cutoff())
+        return condition
+
 
 class Song(TimeStampedModel, UUIDModel):
     STATUS_CHOICES = (
@@ -12,21 +243,162 @@ class Song(TimeStampedModel, UUIDModel):
 
     artist = models.CharField(max_length=255)
     title = models.CharField(max_length=255)
-    lyrics = models.TextField(blank=True, null=True)
-    summary = models.TextField(blank=True, null=True)
-    countries = models.JSONField(default=list, blank=True, null=True)
+    track = models.ForeignKey(Track, on_delete=models.PROTECT, related_name="songs")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
     message = models.TextField(blank=True, null=True)
     task_id = models.CharField(max_length=255, blank=True, null=True)
+    # When the worker holding a processing song last claimed it or renewed
+    # its claim
+    claimed_at = models.DateTimeField(blank=True, null=True)
     created_by = models.ForeignKey(
         "users.User", on_delete=models.CASCADE, related_name="songs"
     )
 
+    objects = SongQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Song"
         verbose_name_plural = "Songs"
         ordering = ["-created"]
-        unique_together = ["artist", "title"]
+        indexes = [
+            # Keyset pagination of all songs and of a user's songs, see
+            # core.pagination.KeysetPagination
+            models.Index(fields=["-created", "id"], name="song_created_id_idx"),
+            models.Index(
+                fields=["created_by", "-created", "id"],
+                name="song_owner_created_id_idx",
+            ),
+            # Case-insensitive artist and title filters of a user's songs,
+            # which compile to UPPER() comparisons
+            models.Index(
+                "created_by",
+                Upper("artist"),
+                Upper("title"),
+                name="song_owner_artist_title_ci_idx",
+            ),
+            # Workers claiming pending songs oldest first and status filters
+            # on unfinished songs; completed songs, the bulk, are left out
+            models.Index(
+                fields=["status", "created"],
+                condition=~models.Q(status="completed"),
+                name="song_unfinished_status_idx",
+            ),
+            # Fuzzy ?search= of artist and title, see core.search
+            GinIndex(
+                fields=["artist", "title"],
+                opclasses=["gin_trgm_ops", "gin_trgm_ops"],
+                name="song_artist_title_trgm_idx",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["created_by", "track"], name="song_unique_track_per_user"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.artist} - {self.title}"
+
+    @property
+    def is_claimed(self) -> bool:
+        """
+        Whether a worker holds the song, processing it under a claim that is
+        not stale yet, see SongQuerySet.in_statuses
+        """
+        return self.status == "processing" and not (
+            self.claimed_at is not None and self.claimed_at < claim_cutoff()
+        )
+
+
+class MergedSong(TimeStampedModel, UUIDModel):
+    """
+    A spelling variant of a song its owner already had, merged into that
+    song when songs were linked to tracks (see migration 0002_track), as a
+    user has a track at most once. Keeps the variant's ID and everything it
+    held, so the merge can be reviewed or undone.
+    """
+
+    song = models.ForeignKey(
+        Song, on_delete=models.CASCADE, related_name="merged_songs"
+    )
+    artist = models.CharField(max_length=255)
+    title = models.CharField(max_length=255)
+    status = models.CharField(max_length=20)
+    message = models.TextField(blank=True, null=True)
+    lyrics = models.TextField(blank=True, null=True)
+    summary = models.TextField(blank=True, null=True)
+    countries = models.JSONField(default=list, blank=True, null=True)
+    song_created = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Merged song"
+        verbose_name_plural = "Merged songs"
 
     def __str__(self):
         return f"{self.artist} - {self.title}"
+
+
+class CountryCountManager(models.Manager):
+    def refresh(self) -> int:
+        """
+        Recount the completed songs mentioning each country, per owner and
+        across all owners, and replace the stored counts in one transaction.
+        Songs are grouped by owner and country list in the database, so only
+        the distinct lists are unnested here. Returns the number of rows.
+        """
+        per_user, overall = Counter(), Counter()
+        groups = (
+            Song.objects.filter(status="completed")
+            .exclude(track__countries=[])
+            .values_list("created_by_id", "track__countries")
+            .annotate(songs=models.Count("id"))
+            .order_by()
+        )
+        for user_id, countries, songs in groups.iterator():
+            for country in set(countries or []):
+                per_user[user_id, country] += songs
+                overall[country] += songs
+
+        now = timezone.now()
+        rows = [
+            CountryCount(
+                user_id=user_id, country=country, songs=songs, refreshed_at=now
+            )
+            for (user_id, country), songs in per_user.items()
+        ] + [
+            CountryCount(country=country, songs=songs, refreshed_at=now)
+            for country, songs in overall.items()
+        ]
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+
+class CountryCount(models.Model):
+    """
+    How many completed songs mention a country, in one user's library or,
+    without a user, in all of them. Rebuilt periodically by
+    refresh_country_counts_task, so reading a dashboard costs a row per
+    country rather than a pass over songs.
+    """
+
+    user = models.ForeignKey(
+        "users.User",
+        on_delete=models.CASCADE,
+        related_name="country_counts",
+        blank=True,
+        null=True,
+    )
+    country = models.CharField(max_length=255)
+    songs = models.PositiveIntegerField()
+    refreshed_at = models.DateTimeField()
+
+    objects = CountryCountManager()
+
+    class Meta:
+        verbose_name = "Country count"
+        verbose_name_plural = "Country counts"
+
+    def __str__(self):
+        return f"{self.country}: {self.songs}"
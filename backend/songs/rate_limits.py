@@ -0,0 +1,370 @@
+import asyncio
+import logging
+import math
+import random
+import re
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+from openai import RateLimitError
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+MUSIXMATCH = "musixmatch"
+OPENAI = "openai"
+
+# Returned by the acquire script when every concurrency slot is taken
+CONCURRENCY_FULL = -1
+
+# Requeued work is spread over up to this fraction of the wait, so the songs
+# deferred by one 429 do not all come back at the same moment
+REQUEUE_JITTER = 0.2
+
+# Seconds between polls for a free concurrency slot
+SLOT_POLL_INTERVAL = 0.05
+
+# The concurrency limit is halved at most once per window, so the 429s of
+# requests that were already in flight count as one congestion signal.
+DECREASE_COOLDOWN_MS = 2000
+
+# Take a concurrency slot and the cost of the request from every bucket of
+# an upstream, all or nothing. Returns 0 on success, otherwise the
+# milliseconds to wait, or -1 when all concurrency slots are taken. Buckets
+# refill continuously from Redis time, so every worker sees the same clock.
+ACQUIRE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local blocked_until = tonumber(redis.call('GET', KEYS[1]) or '0')
+if blocked_until > now then
+    return blocked_until - now
+end
+
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local limit = tonumber(redis.call('HGET', KEYS[3], 'limit') or ARGV[3])
+if redis.call('ZCARD', KEYS[2]) >= math.floor(limit) then
+    return -1
+end
+
+local wait = 0
+local levels = {}
+for i = 4, #KEYS do
+    local base = 4 + (i - 4) * 3
+    local capacity = tonumber(ARGV[base])
+    local rate = tonumber(ARGV[base + 1])
+    local cost = tonumber(ARGV[base + 2])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate)
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, math.ceil((cost - tokens) / rate))
+    end
+end
+if wait > 0 then
+    return wait
+end
+
+for i = 4, #KEYS do
+    local base = 4 + (i - 4) * 3
+    local capacity = tonumber(ARGV[base])
+    local rate = tonumber(ARGV[base + 1])
+    redis.call('HSET', KEYS[i], 'tokens', levels[i] - tonumber(ARGV[base + 2]),
+        'ts', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil(capacity / rate) + 1000)
+end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ARGV[2])
+return 0
+"""
+
+# Give the slot back and adapt the concurrency limit, AIMD style: a request
+# that went through adds 1/limit, so the limit grows by one per round of
+# requests; congestion halves it. Congestion may also block the upstream
+# for every worker until its limits reset.
+RELEASE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+redis.call('ZREM', KEYS[2], ARGV[1])
+
+local limit = tonumber(redis.call('HGET', KEYS[3], 'limit') or ARGV[6])
+if ARGV[2] == '1' then
+    local decreased_at = tonumber(redis.call('HGET', KEYS[3], 'decreased_at') or '0')
+    if now - decreased_at >= tonumber(ARGV[7]) then
+        limit = math.max(tonumber(ARGV[4]), limit / 2)
+        redis.call('HSET', KEYS[3], 'decreased_at', now)
+    end
+else
+    limit = math.min(tonumber(ARGV[5]), limit + 1 / limit)
+end
+redis.call('HSET', KEYS[3], 'limit', limit)
+
+local block = tonumber(ARGV[3])
+if block > 0 and now + block > tonumber(redis.call('GET', KEYS[1]) or '0') then
+    redis.call('SET', KEYS[1], now + block, 'PX', block)
+end
+return tostring(limit)
+"""
+
+_duration_re = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_duration_units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class UpstreamRateLimited(Exception):
+    """An upstream is rate limiting us; retry after `retry_after` seconds"""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} rate limit reached, retry in {retry_after:.0f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def requeue_delay(retry_after: float) -> float:
+    """Seconds to requeue rate limited work for, with jitter"""
+    return retry_after * (1 + random.uniform(0, REQUEUE_JITTER))
+
+
+def waiting_message(upstream: str, delay: float) -> str:
+    """Song message while its analysis waits for a rate limit"""
+    name = "Musixmatch" if upstream == MUSIXMATCH else "OpenAI"
+    return f"Waiting for the {name} rate limit, retrying in {math.ceil(delay)} seconds"
+
+
+def _key(upstream: str, name: str) -> str:
+    return f"lyrintel:ratelimit:{upstream}:{name}"
+
+
+def buckets(upstream: str) -> List[Tuple[str, int]]:
+    """(name, limit per minute) of the token buckets of an upstream"""
+    if upstream == OPENAI:
+        limits = [
+            ("requests", settings.OPENAI_RATE_LIMIT_RPM),
+            ("tokens", settings.OPENAI_RATE_LIMIT_TPM),
+        ]
+    else:
+        limits = [("requests", settings.MUSIXMATCH_RATE_LIMIT_RPM)]
+    # A limit of 0 disables its bucket
+    return [(name, per_minute) for name, per_minute in limits if per_minute > 0]
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a rate limit reset header such as "1s", "6m0s" or "20ms" """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _duration_re.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _duration_units[unit] for amount, unit in parts)
+
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to wait as told by the Retry-After headers of a response"""
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get("retry-after"))
+
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """
+    Tokens an OpenAI chat request counts against the tokens-per-minute
+    limit: the prompt, at roughly four characters per token, plus
+    max_tokens, which OpenAI reserves up front
+    """
+    prompt = sum(len(message["content"]) for message in request["messages"])
+    return prompt // 4 + request.get("max_tokens", 0)
+
+
+def try_acquire(upstream: str, tokens: int = 0) -> Tuple[Optional[str], float]:
+    """
+    Try to take a request slot of an upstream without waiting
+
+    Returns:
+        Tuple[Optional[str], float]: (slot, seconds to wait). The slot is
+        None when the request may go ahead without one, which is the case
+        when the limiter is unavailable.
+    """
+    keys = [_key(upstream, "blocked"), _key(upstream, "slots"), _key(upstream, "state")]
+    args = [
+        slot := uuid.uuid4().hex,
+        int(settings.RATE_LIMIT_SLOT_TTL * 1000),
+        settings.UPSTREAM_CONCURRENCY_INITIAL,
+    ]
+    for name, per_minute in buckets(upstream):
+        cost = tokens if name == "tokens" else 1
+        keys.append(_key(upstream, name))
+        # A request costing more than a bucket holds would never go through
+        args.extend([per_minute, per_minute / 60000, min(cost, per_minute)])
+
+    try:
+        wait_ms = get_redis_connection("default").eval(
+            ACQUIRE_SCRIPT, len(keys), *keys, *args
+        )
+    except Exception as e:
+        logger.warning("Rate limiter unavailable for %s: %s", upstream, e)
+        return None, 0.0
+    if wait_ms == 0:
+        return slot, 0.0
+    if wait_ms == CONCURRENCY_FULL:
+        return None, SLOT_POLL_INTERVAL
+    return None, wait_ms / 1000
+
+
+def acquire(upstream: str, tokens: int = 0) -> Optional[str]:
+    """
+    Take a request slot of an upstream, waiting up to RATE_LIMIT_MAX_WAIT
+    seconds for one
+
+    Raises:
+        UpstreamRateLimited: When the wait would be longer
+    """
+    deadline = time.monotonic() + settings.RATE_LIMIT_MAX_WAIT
+    while True:
+        slot, wait = try_acquire(upstream, tokens)
+        if not wait:
+            return slot
+        if time.monotonic() + wait > deadline:
+            metrics.incr(f"ratelimit.{upstream}.deferred")
+            raise UpstreamRateLimited(upstream, max(wait, SLOT_POLL_INTERVAL))
+        metrics.incr(f"ratelimit.{upstream}.waits")
+        metrics.incr(f"ratelimit.{upstream}.wait_ms", wait * 1000)
+        time.sleep(wait)
+
+
+async def aacquire(upstream: str, tokens: int = 0) -> Optional[str]:
+    """Async counterpart of acquire, which waits on the event loop"""
+    deadline = time.monotonic() + settings.RATE_LIMIT_MAX_WAIT
+    while True:
+        slot, wait = await sync_to_async(try_acquire, thread_sensitive=False)(
+            upstream, tokens
+        )
+        if not wait:
+            return slot
+        if time.monotonic() + wait > deadline:
+            metrics.incr(f"ratelimit.{upstream}.deferred")
+            raise UpstreamRateLimited(upstream, max(wait, SLOT_POLL_INTERVAL))
+        metrics.incr(f"ratelimit.{upstream}.waits")
+        metrics.incr(f"ratelimit.{upstream}.wait_ms", wait * 1000)
+        await asyncio.sleep(wait)
+
+
+def release(
+    upstream: str, slot: Optional[str], congested: bool, block_for: float
+) -> None:
+    """
+    Give a request slot back, reporting whether the upstream signalled
+    congestion, and for how long it should not be called at all
+    """
+    if slot is None:
+        return
+    keys = [_key(upstream, "blocked"), _key(upstream, "slots"), _key(upstream, "state")]
+    try:
+        limit = get_redis_connection("default").eval(
+            RELEASE_SCRIPT,
+            len(keys),
+            *keys,
+            slot,
+            int(congested),
+            int(block_for * 1000),
+            settings.UPSTREAM_CONCURRENCY_MIN,
+            settings.UPSTREAM_CONCURRENCY_MAX,
+            settings.UPSTREAM_CONCURRENCY_INITIAL,
+            DECREASE_COOLDOWN_MS,
+        )
+    except Exception as e:
+        logger.warning("Failed to release rate limit slot of %s: %s", upstream, e)
+        return
+    if congested:
+        metrics.incr(f"ratelimit.{upstream}.congested")
+        logger.warning(
+            "%s congested, concurrency limit now %.1f",
+            upstream,
+            float(limit),
+        )
+
+
+class UpstreamCall:
+    """
+    Holds a rate limit slot of an upstream for one request and reports how
+    the request went when the block exits. Works with `with` and
+    `async with`.
+    """
+
+    def __init__(self, upstream: str, tokens: int = 0):
+        self.upstream = upstream
+        self.tokens = tokens
+        self.slot: Optional[str] = None
+        self.congested = False
+        self.block_for = 0.0
+
+    def __enter__(self) -> "UpstreamCall":
+        self.slot = acquire(self.upstream, self.tokens)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        release(self.upstream, self.slot, self.congested, self.block_for)
+
+    async def __aenter__(self) -> "UpstreamCall":
+        self.slot = await aacquire(self.upstream, self.tokens)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await sync_to_async(release, thread_sensitive=False)(
+            self.upstream, self.slot, self.congested, self.block_for
+        )
+
+    def rate_limited(self, retry_after: Optional[float]) -> UpstreamRateLimited:
+        """Record a rate limited response and return the exception to raise"""
+        retry_after = retry_after or settings.RATE_LIMIT_DEFAULT_BACKOFF
+        self.congested = True
+        self.block_for = max(self.block_for, retry_after)
+        metrics.incr(f"ratelimit.{self.upstream}.limited")
+        return UpstreamRateLimited(self.upstream, retry_after)
+
+    def observe_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        Adapt to the x-ratelimit-* headers of a response: once a limit is
+        used up, back off and hold every worker until it resets
+        """
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None or not remaining.isdigit() or int(remaining) > 0:
+                continue
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            self.congested = True
+            self.block_for = max(
+                self.block_for, reset or settings.RATE_LIMIT_DEFAULT_BACKOFF
+            )
+
+    def call_openai(self, create: Callable[..., Any], request: Dict[str, Any]) -> Any:
+        """Send a request with a `with_raw_response` method of the OpenAI client"""
+        try:
+            raw = create(**request)
+        except RateLimitError as e:
+            raise self.rate_limited(retry_after(e.response.headers)) from e
+        self.observe_headers(raw.headers)
+        return raw.parse()
+
+    async def acall_openai(
+        self, create: Callable[..., Any], request: Dict[str, Any]
+    ) -> Any:
+        """Async counterpart of call_openai for the AsyncOpenAI client"""
+        try:
+            raw = await create(**request)
+        except RateLimitError as e:
+            raise self.rate_limited(retry_after(e.response.headers)) from e
+        self.observe_headers(raw.headers)
+        return raw.parse()
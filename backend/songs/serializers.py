@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
-from .models import Song
+from .cache_keys import song_digest
+from .models import CountryCount, Song, Track
 
 User = get_user_model()
 
@@ -16,9 +18,58 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class SongSerializer(serializers.ModelSerializer):
-    """Serializer for Song model"""
+    """
+    Serializer for Song model. A `sparse_fields` set in the context, see
+    SongViewSet.sparse_fields, keeps only those fields.
+    """
 
     created_by = UserSerializer(read_only=True)
+    summary = serializers.CharField(source="track.summary", read_only=True)
+    countries = serializers.JSONField(source="track.countries", read_only=True)
+
+    # Columns each field reads, for select_columns
+    COLUMNS = {
+        "id": ["id"],
+        "artist": ["artist"],
+        "title": ["title"],
+        "status": ["status"],
+        "message": ["message"],
+        "summary": ["track__summary"],
+        "countries": ["track__countries"],
+        "created": ["created"],
+        "modified": ["modified"],
+        "created_by": [
+            "created_by__id",
+            "created_by__email",
+            "created_by__first_name",
+            "created_by__last_name",
+        ],
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        sparse_fields = self.context.get("sparse_fields")
+        if sparse_fields:
+            for name in set(self.fields) - sparse_fields:
+                self.fields.pop(name)
+
+    @classmethod
+    def select_columns(cls, queryset, fields=None):
+        """
+        Join the relations and load only the columns that the given fields,
+        or all fields, read: one query however many owners a page has
+        """
+        columns = [
+            column
+            for name, field_columns in cls.COLUMNS.items()
+            if not fields or name in fields
+            for column in field_columns
+        ]
+        relations = {column.split("__")[0] for column in columns if "__" in column}
+        # The keyset pagination reads the id and created columns too
+        return queryset.select_related(*relations).only(
+            "id", "created", *relations, *columns
+        )
 
     class Meta:
         model = Song
@@ -37,8 +88,6 @@ class SongSerializer(serializers.ModelSerializer):
         read_only_fields = [
             "status",
             "message",
-            "summary",
-            "countries",
             "created",
             "modified",
             "created_by",
@@ -46,9 +95,18 @@ class SongSerializer(serializers.ModelSerializer):
 
 
 class SongDetailSerializer(serializers.ModelSerializer):
-    """Serializer for detailed Song information"""
+    """
+    Serializer for detailed Song information. Lyrics and analysis belong to
+    the shared track, so they are read-only; renaming a song moves it to the
+    track of its new name.
+    """
 
     created_by = UserSerializer(read_only=True)
+    lyrics = serializers.CharField(
+        source="track.lyrics.text", read_only=True, allow_null=True
+    )
+    summary = serializers.CharField(source="track.summary", read_only=True)
+    countries = serializers.JSONField(source="track.countries", read_only=True)
 
     class Meta:
         model = Song
@@ -66,3 +124,48 @@ class SongDetailSerializer(serializers.ModelSerializer):
             "created_by",
         ]
         read_only_fields = ["created", "modified", "created_by"]
+
+    def validate(self, attrs):
+        key = song_digest(
+            attrs.get("artist", self.instance.artist),
+            attrs.get("title", self.instance.title),
+        )
+        if (
+            Song.objects.filter(
+                created_by_id=self.instance.created_by_id, track__key=key
+            )
+            .exclude(id=self.instance.id)
+            .exists()
+        ):
+            raise serializers.ValidationError("Song already exists")
+        return attrs
+
+    def update(self, instance, validated_data):
+        artist = validated_data.get("artist", instance.artist)
+        title = validated_data.get("title", instance.title)
+        if song_digest(artist, title) != instance.track.key:
+            validated_data["track"] = Track.objects.for_song(artist, title)
+        return super().update(instance, validated_data)
+
+
+class SongBatchItemSerializer(serializers.Serializer):
+    """Serializer for one artist/title pair of a batch create"""
+
+    artist = serializers.CharField(max_length=255)
+    title = serializers.CharField(max_length=255)
+
+
+class SongBatchSerializer(serializers.Serializer):
+    """Serializer for batch song creation"""
+
+    songs = SongBatchItemSerializer(
+        many=True, allow_empty=False, max_length=settings.SONG_BATCH_MAX_SIZE
+    )
+
+
+class CountryCountSerializer(serializers.ModelSerializer):
+    """Serializer for the songs mentioning a country"""
+
+    class Meta:
+        model = CountryCount
+        fields = ["country", "songs"]
@@ -1,88 +1,352 @@
 import json
 import logging
-from typing import Any, Dict, Optional, Tuple
+import math
+import re
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
 
-import requests
 from django.conf import settings
 from django.core.cache import cache
+from django_redis import get_redis_connection
 from openai import OpenAI
 
+from . import cache_keys, metrics
+from .cache import song_cache
+from .clients import get_musixmatch_client
+from .gazetteer import extract_countries
+from .rate_limits import OPENAI, UpstreamCall, UpstreamRateLimited, estimate_tokens
+
 logger = logging.getLogger(__name__)
 
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+# No SDK retries: a 429 must reach UpstreamCall at once, so it can back off
+# and requeue the work instead of the SDK sleeping and retrying in place
+client = OpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    base_url=settings.OPENAI_BASE_URL,
+    max_retries=0,
+)
+
+T = TypeVar("T")
+
+SINGLE_FLIGHT_LOCK_PREFIX = "lyrintel:singleflight:lock:"
+
+# Delete the lock only if we still own it, so a holder that overran its TTL
+# never releases a lock that another caller has since taken.
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+UNKNOWN_SUMMARY = "Unable to generate summary for this song."
+
+# Prompt tokens per song in a batch on top of its lyrics
+BATCH_ITEM_OVERHEAD_TOKENS = 20
+
+_summary_start_re = re.compile(r'"summary"\s*:\s*"')
+
+
+class SummaryStream:
+    """
+    Pulls the summary out of a JSON reply while it is being streamed, so
+    that its text can be shown before the reply is complete
+    """
+
+    def __init__(self):
+        self.content = ""
+        self._start = None
+        self._sent = 0
+        self._done = False
+
+    def feed(self, chunk: str) -> str:
+        """Add a streamed chunk and return the summary text it completed"""
+        self.content += chunk
+        if self._done:
+            return ""
+        if self._start is None:
+            match = _summary_start_re.search(self.content)
+            if not match:
+                return ""
+            self._start = match.end()
+
+        raw = self.content[self._start :]
+        end = len(raw)
+        index = 0
+        while index < len(raw):
+            if raw[index] == "\\":
+                width = 6 if raw[index + 1 : index + 2] == "u" else 2
+                if index + width > len(raw):
+                    # Wait for the rest of the escape sequence
+                    end = index
+                    break
+                index += width
+            elif raw[index] == '"':
+                end = index
+                self._done = True
+                break
+            else:
+                index += 1
+
+        try:
+            text = json.loads(f'"{raw[:end]}"')
+        except json.JSONDecodeError:
+            return ""
+        delta = text[self._sent :]
+        self._sent = len(text)
+        return delta
+
+
+class SingleFlight:
+    """
+    Bookkeeping of one single-flight call: its keys, lock token and
+    deadline, and what each step of the wait means. Shared by the sync and
+    async loops so that they differ only in how they reach Redis.
+    """
+
+    # Default passed when reading the shared result, so None can be shared
+    MISSING = object()
+
+    def __init__(self, key: str, lock_ttl: float):
+        self.key = key
+        self.result_key = f"singleflight_result_{key}"
+        self.lock_key = f"{SINGLE_FLIGHT_LOCK_PREFIX}{key}"
+        self.token = uuid.uuid4().hex
+        self.lock_ms = int(lock_ttl * 1000)
+        self.deadline = time.monotonic() + lock_ttl
+        self.waited = False
+        # Whether we hold the lock, and so compute and share the result
+        self.locked = False
+
+    def shared(self, result: Any) -> bool:
+        """Whether the result read before an attempt at the lock is shared"""
+        # A result published by a holder that already finished is shared,
+        # whether we just arrived or just saw its lock go
+        if result is not self.MISSING:
+            metrics.incr("singleflight.coalesced")
+            return True
+        if self.waited:
+            # The holder released the lock without publishing a result
+            metrics.incr("singleflight.takeovers")
+        return False
+
+    def waiting(self) -> bool:
+        """Whether to keep polling the holder's lock"""
+        return time.monotonic() < self.deadline
+
+    def timed_out(self) -> bool:
+        """Whether to give up after the holder's lock was waited out"""
+        self.waited = True
+        if self.waiting():
+            return False
+        logger.warning("Timed out waiting on single-flight key %s", self.key)
+        metrics.incr("singleflight.timeouts")
+        return True
+
+    def unavailable(self, error: Exception) -> None:
+        logger.warning("Single-flight unavailable for %s: %s", self.key, str(error))
+
+    def release_failed(self, error: Exception) -> None:
+        logger.warning(
+            "Failed to release single-flight lock %s: %s", self.key, str(error)
+        )
+
+
+def single_flight(key: str, compute: Callable[[], T], lock_ttl: float) -> T:
+    """
+    Run compute() once across all processes for concurrent callers of the
+    same key. The first caller takes a short Redis lock and shares its result;
+    the others wait for it instead of calling upstream themselves.
+
+    The shared result is read before every attempt at the lock, so a caller
+    arriving just after the holder finished gets its result too. If the
+    lock holder dies, its lock expires after lock_ttl and a waiter takes
+    over. A waiter that gives up after lock_ttl computes on its own.
+
+    Args:
+        key: Normalized key identifying the upstream request
+        compute: Callable doing the upstream request
+        lock_ttl: Seconds the lock is held at most
+    """
+    flight = SingleFlight(key, lock_ttl)
+    try:
+        redis = get_redis_connection("default")
+        while True:
+            result = cache.get(flight.result_key, SingleFlight.MISSING)
+            if flight.shared(result):
+                return result
+            if redis.set(flight.lock_key, flight.token, nx=True, px=flight.lock_ms):
+                flight.locked = True
+                break
+            while redis.exists(flight.lock_key) and flight.waiting():
+                time.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+            if flight.timed_out():
+                break
+    except Exception as e:
+        flight.unavailable(e)
+    # Outside the try: an upstream error is raised once, not taken for a
+    # Redis failure and computed again
+    if not flight.locked:
+        return compute()
+
+    try:
+        result = compute()
+        cache.set(flight.result_key, result, settings.SINGLE_FLIGHT_RESULT_TTL)
+        return result
+    finally:
+        try:
+            redis.eval(RELEASE_LOCK_SCRIPT, 1, flight.lock_key, flight.token)
+        except Exception as e:
+            flight.release_failed(e)
 
 
 class LyricsService:
     @staticmethod
-    def check_song_exists(artist: str, title: str) -> Tuple[bool, str]:
+    def _get_matcher_lyrics(artist: str, title: str) -> Dict[str, Any]:
+        """
+        Request matcher.lyrics.get, coalescing concurrent identical requests.
+        Both the existence check and the lyrics fetch go through here.
         """
-        Check if a song exists in Musixmatch API without fetching full lyrics
+        return single_flight(
+            cache_keys.matcher_key(artist, title),
+            lambda: get_musixmatch_client().get(
+                "matcher.lyrics.get", q_artist=artist, q_track=title
+            ),
+            lock_ttl=settings.SINGLE_FLIGHT_LYRICS_LOCK_TTL,
+        )
 
-        Args:
-            artist: The artist name
-            title: The song title
+    @staticmethod
+    def read_matcher_reply(
+        artist: str, title: str, data: Dict[str, Any]
+    ) -> Tuple[Optional[str], str]:
+        """
+        Interpret a matcher.lyrics.get reply
 
         Returns:
-            Tuple[bool, str]: (exists, message)
+            Tuple[Optional[str], str]: (lyrics, error message if there are none)
         """
-        cache_key = f"song_exists_{artist.lower()}_{title.lower()}"
-        cached_result = cache.get(cache_key)
+        header = data.get("message", {}).get("header", {})
+        if header.get("status_code") != 200:
+            logger.warning(
+                "Musixmatch API error for %s - %s: status_code=%s",
+                artist,
+                title,
+                header.get("status_code"),
+            )
+            return None, header.get("status_message", "Song not found or API error")
+
+        lyrics_data = data.get("message", {}).get("body", {}).get("lyrics") or {}
+        if not lyrics_data.get("lyrics_body"):
+            logger.warning("No lyrics found for %s - %s", artist, title)
+            return None, "No lyrics found for this song"
+        return lyrics_data["lyrics_body"], ""
 
+    @staticmethod
+    def cached_existence(
+        artist: str, title: str, cached_result: Any, lyrics_cached: bool
+    ) -> Optional[Tuple[bool, str]]:
+        """
+        Existence check result from the cached check or cached lyrics, or
+        None when neither is cached
+        """
         if cached_result is not None:
             logger.info(
                 "Song existence check for %s - %s fetched from cache", artist, title
             )
-            return cached_result
+            # The songs cache serializer may return tuples as lists
+            return tuple(cached_result)
+        if lyrics_cached:
+            logger.info("Song %s - %s exists, lyrics already cached", artist, title)
+            metrics.incr("musixmatch.requests_saved")
+            return True, "Song exists"
+        return None
 
-        try:
-            search_url = f"{settings.MUSIXMATCH_API_BASE_URL}/matcher.lyrics.get"
-            params = {
-                "apikey": settings.MUSIXMATCH_API_KEY,
-                "q_artist": artist,
-                "q_track": title,
-                "format": "json",
-            }
-
-            response = requests.get(search_url, params=params, timeout=10)
-            data = response.json()
-
-            status_code = data.get("message", {}).get("header", {}).get("status_code")
-
-            if status_code != 200:
-                logger.warning(
-                    "Musixmatch API error for %s - %s: status_code=%s",
-                    artist,
-                    title,
-                    status_code,
-                )
-                error_message = (
-                    data.get("message", {})
-                    .get("header", {})
-                    .get("status_message", "Song not found or API error")
-                )
-                result = (False, error_message)
-                cache.set(cache_key, result, settings.LYRICS_CACHE_TTL)
-                return result
+    @staticmethod
+    def existence_from_reply(
+        artist: str, title: str, data: Dict[str, Any]
+    ) -> Tuple[Tuple[bool, str], Optional[str]]:
+        """
+        Existence check result of a matcher.lyrics.get reply, which is
+        cached, and the lyrics it returned, if any
 
-            lyrics_data = data.get("message", {}).get("body", {}).get("lyrics", {})
-            if not lyrics_data or not lyrics_data.get("lyrics_body"):
-                result = (False, "No lyrics found for this song")
-                cache.set(cache_key, result, settings.LYRICS_CACHE_TTL)
-                return result
+        Returns:
+            Tuple[Tuple[bool, str], Optional[str]]: ((exists, message), lyrics)
+        """
+        lyrics, error_message = LyricsService.read_matcher_reply(artist, title, data)
+        if lyrics is None:
+            return (False, error_message), None
+        return (True, "Song exists"), lyrics
 
-            result = (True, "Song exists")
-            cache.set(cache_key, result, settings.LYRICS_CACHE_TTL)
+    @staticmethod
+    def existence_error(artist: str, title: str, error: Exception) -> Tuple[bool, str]:
+        """Existence check result of a failed check, which is not cached"""
+        if isinstance(error, UpstreamRateLimited):
+            # The song may well exist once the limit resets
+            logger.warning("Musixmatch rate limited checking %s - %s", artist, title)
+            return (
+                False,
+                "Musixmatch rate limit reached, try again in "
+                f"{math.ceil(error.retry_after)} seconds",
+            )
+        logger.error(
+            "Error checking if song exists for %s - %s: %s",
+            artist,
+            title,
+            str(error),
+            exc_info=error,
+        )
+        return False, f"Error checking song: {str(error)}"
+
+    @staticmethod
+    def cached_lyrics(artist: str, title: str, lyrics: str) -> Tuple[bool, str, str]:
+        """Lyrics fetch result of lyrics found in the cache"""
+        logger.info("Lyrics for %s - %s fetched from cache", artist, title)
+        metrics.incr("musixmatch.requests_saved")
+        return True, "Lyrics fetched from cache", lyrics
+
+    @staticmethod
+    def fetch_error(
+        artist: str, title: str, error: Exception
+    ) -> Tuple[bool, str, Optional[str]]:
+        """Lyrics fetch result of a failed fetch other than a rate limit"""
+        logger.error("Error fetching lyrics for %s - %s: %s", artist, title, str(error))
+        return False, f"Error fetching lyrics: {str(error)}", None
+
+    @staticmethod
+    def check_song_exists(artist: str, title: str) -> Tuple[bool, str]:
+        """
+        Check if a song exists in Musixmatch API. The lyrics returned by the
+        check are cached so the analysis task does not fetch them again.
+
+        Args:
+            artist: The artist name
+            title: The song title
+
+        Returns:
+            Tuple[bool, str]: (exists, message)
+        """
+        cache_key = cache_keys.exists_key(artist, title)
+        lyrics_cache_key = cache_keys.lyrics_key(artist, title)
+        cached_result = song_cache.get(cache_key)
+        result = LyricsService.cached_existence(
+            artist,
+            title,
+            cached_result,
+            cached_result is None and bool(song_cache.get(lyrics_cache_key)),
+        )
+        if result is not None:
             return result
 
+        try:
+            data = LyricsService._get_matcher_lyrics(artist, title)
+            result, lyrics = LyricsService.existence_from_reply(artist, title, data)
+            song_cache.set(cache_key, result, settings.LYRICS_CACHE_TTL)
+            if lyrics:
+                song_cache.set(lyrics_cache_key, lyrics, settings.LYRICS_CACHE_TTL)
+            return result
         except Exception as e:
-            logger.error(
-                "Error checking if song exists for %s - %s: %s",
-                artist,
-                title,
-                str(e),
-                exc_info=True,
-            )
-            return False, f"Error checking song: {str(e)}"
+            return LyricsService.existence_error(artist, title, e)
 
     @staticmethod
     def fetch_lyrics(artist: str, title: str) -> Tuple[bool, str, Optional[str]]:
@@ -91,64 +355,39 @@ class LyricsService:
 
         Returns:
             Tuple[bool, str, Optional[str]]: (success, message, lyrics)
+
+        Raises:
+            UpstreamRateLimited: When Musixmatch is rate limiting us
         """
-        cache_key = f"lyrics_{artist.lower()}_{title.lower()}"
-        cached_lyrics = cache.get(cache_key)
+        cache_key = cache_keys.lyrics_key(artist, title)
+        cached_lyrics = song_cache.get(cache_key)
         if cached_lyrics:
-            logger.info("Lyrics for %s - %s fetched from cache", artist, title)
-            return True, "Lyrics fetched from cache", cached_lyrics
+            return LyricsService.cached_lyrics(artist, title, cached_lyrics)
 
         try:
-            search_url = f"{settings.MUSIXMATCH_API_BASE_URL}/matcher.lyrics.get"
-            params = {
-                "apikey": settings.MUSIXMATCH_API_KEY,
-                "q_artist": artist,
-                "q_track": title,
-                "format": "json",
-            }
-
-            response = requests.get(search_url, params=params, timeout=10)
-            data = response.json()
-            if data.get("message", {}).get("header", {}).get("status_code") != 200:
-                logger.warning("Musixmatch API error for %s - %s", artist, title)
-                return False, "Song not found or API error", None
-            lyrics_data = data.get("message", {}).get("body", {}).get("lyrics", {})
-            lyrics = lyrics_data.get("lyrics_body", "")
-
-            if not lyrics:
-                logger.warning("No lyrics found for %s - %s", artist, title)
-                return False, "No lyrics found for this song", None
+            data = LyricsService._get_matcher_lyrics(artist, title)
+            lyrics, error_message = LyricsService.read_matcher_reply(
+                artist, title, data
+            )
+            if lyrics is None:
+                return False, error_message, None
 
-            cache.set(cache_key, lyrics, settings.LYRICS_CACHE_TTL)
+            song_cache.set(cache_key, lyrics, settings.LYRICS_CACHE_TTL)
             logger.info("Lyrics for %s - %s fetched from API and cached", artist, title)
 
             return True, "Lyrics fetched successfully", lyrics
 
+        except UpstreamRateLimited:
+            raise
         except Exception as e:
-            logger.error("Error fetching lyrics for %s - %s: %s", artist, title, str(e))
-            return False, f"Error fetching lyrics: {str(e)}", None
+            return LyricsService.fetch_error(artist, title, e)
 
 
 class AnalysisService:
     @staticmethod
-    def analyze_lyrics(lyrics: str) -> Tuple[bool, str, Dict[str, Any]]:
-        """
-        Analyze lyrics using OpenAI API to get summary and countries mentioned
-
-        Returns:
-            Tuple[bool, str, Dict[str, Any]]: (success, message, analysis_data)
-        """
-        if not lyrics:
-            logger.warning("No lyrics provided for analysis")
-            return False, "No lyrics to analyze", {}
-
-        cache_key = f"analysis_{hash(lyrics)}"
-        cached_analysis = cache.get(cache_key)
-        if cached_analysis:
-            logger.info("Analysis fetched from cache")
-            return True, "Analysis fetched from cache", cached_analysis
-
-        try:
+    def build_request(lyrics: str) -> Dict[str, Any]:
+        """Chat completion parameters for analyzing the given lyrics"""
+        if settings.COUNTRY_EXTRACTION == "llm":
             prompt = f"""
             Analyze the following song lyrics and provide:
             1. A one-sentence summary of what the song is about
@@ -163,71 +402,350 @@ class AnalysisService:
                 "countries": ["Country1", "Country2", ...]
             }}
             """
+        else:
+            # Countries are extracted locally by the gazetteer
+            prompt = f"""
+            Summarize what the following song is about in one sentence.
+            
+            Lyrics:
+            {lyrics}
+            
+            Respond in JSON format:
+            {{
+                "summary": "One sentence that summarizes what the song is about"
+            }}
+            """
+        return {
+            "model": settings.OPENAI_MODEL,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are a helpful assistant that analyzes song lyrics.",
+                },
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": settings.OPENAI_TEMPERATURE,
+            "max_tokens": settings.OPENAI_MAX_TOKENS,
+        }
+
+    @staticmethod
+    def _complete(
+        lyrics: str, on_summary: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """
+        Send the analysis request to OpenAI and return the raw reply. With
+        on_summary, the reply is streamed and each new piece of the summary
+        is passed to on_summary as soon as it arrives.
+
+        Raises:
+            UpstreamRateLimited: When OpenAI is rate limiting us
+        """
+        request = AnalysisService.build_request(lyrics)
+        create = client.chat.completions.with_raw_response.create
+        with UpstreamCall(OPENAI, estimate_tokens(request)) as call:
+            if on_summary is None:
+                response = call.call_openai(create, request)
+                return response.choices[0].message.content
+
+            start = time.perf_counter()
+            summary_stream = SummaryStream()
+            stream = call.call_openai(create, {**request, "stream": True})
+            for chunk in stream:
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if not summary_stream.content:
+                    metrics.incr("openai.first_token.count")
+                    metrics.incr(
+                        "openai.first_token.ms", (time.perf_counter() - start) * 1000
+                    )
+                summary = summary_stream.feed(chunk.choices[0].delta.content)
+                if summary:
+                    on_summary(summary)
+            return summary_stream.content
 
-            response = client.chat.completions.create(
-                model=settings.OPENAI_MODEL,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that analyzes song lyrics.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=settings.OPENAI_TEMPERATURE,
-                max_tokens=settings.OPENAI_MAX_TOKENS,
+    @staticmethod
+    def parse_analysis(content: str) -> Tuple[bool, str, Dict[str, Any]]:
+        """
+        Parse the reply to an analysis request, salvaging what we can when
+        it is not valid JSON
+
+        Returns:
+            Tuple[bool, str, Dict[str, Any]]: (success, message, analysis_data)
+        """
+        try:
+            analysis_data = json.loads(content)
+            if not isinstance(analysis_data, dict):
+                logger.warning("OpenAI returned non-dictionary response")
+                return False, "Invalid response format from OpenAI", {}
+            if "summary" not in analysis_data:
+                analysis_data["summary"] = UNKNOWN_SUMMARY
+
+            if "countries" not in analysis_data or not isinstance(
+                analysis_data["countries"], list
+            ):
+                analysis_data["countries"] = []
+
+            return True, "Lyrics analyzed successfully", analysis_data
+
+        except json.JSONDecodeError:
+            logger.warning("Failed to parse JSON from OpenAI response")
+            summary = UNKNOWN_SUMMARY
+            countries = []
+
+            if "summary" in content.lower():
+                summary_parts = content.split("summary")
+                if len(summary_parts) > 1:
+                    summary_text = summary_parts[1].split("\n")[0]
+                    summary = summary_text.strip('": ,')
+
+            if "countries" in content.lower():
+                countries_parts = content.split("countries")
+                if len(countries_parts) > 1:
+                    countries_text = countries_parts[1].strip()
+                    if "[" in countries_text and "]" in countries_text:
+                        countries_list = countries_text[
+                            countries_text.find("[") + 1 : countries_text.find("]")
+                        ]
+                        countries = [
+                            c.strip(" \"'")
+                            for c in countries_list.split(",")
+                            if c.strip()
+                        ]
+            analysis_data = {"summary": summary, "countries": countries}
+            return True, "Lyrics analyzed with partial results", analysis_data
+
+    @staticmethod
+    def add_countries(lyrics: str, analysis_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Fill in the countries mentioned in the lyrics with the local gazetteer,
+        unless COUNTRY_EXTRACTION leaves them to the model
+        """
+        if settings.COUNTRY_EXTRACTION == "gazetteer":
+            analysis_data["countries"] = extract_countries(lyrics)
+        return analysis_data
+
+    @staticmethod
+    def _complete_batch(lyrics_by_id: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Analyze several songs in one OpenAI request and return the reply
+        decoded as a dict keyed by song ID
+        """
+        songs = "\n\n".join(
+            f"### Song {item_id}\n{lyrics}" for item_id, lyrics in lyrics_by_id.items()
+        )
+        if settings.COUNTRY_EXTRACTION == "llm":
+            prompt = f"""
+        Analyze the lyrics of each of the following songs and provide for each:
+        1. A one-sentence summary of what the song is about
+        2. A list of all countries mentioned in the lyrics
+
+        {songs}
+
+        Respond with a JSON object that has one entry per song ID:
+        {{
+            "<song ID>": {{
+                "summary": "One sentence that summarizes what the song is about",
+                "countries": ["Country1", "Country2", ...]
+            }}
+        }}
+        """
+        else:
+            prompt = f"""
+        Summarize what each of the following songs is about in one sentence.
+
+        {songs}
+
+        Respond with a JSON object that has one entry per song ID:
+        {{
+            "<song ID>": {{
+                "summary": "One sentence that summarizes what the song is about"
+            }}
+        }}
+        """
+
+        request = {
+            "model": settings.OPENAI_MODEL,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are a helpful assistant that analyzes song lyrics.",
+                },
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": settings.OPENAI_TEMPERATURE,
+            # Within the model's output limit, which _split_batches sizes
+            # batches to
+            "max_tokens": min(
+                settings.OPENAI_MAX_TOKENS * len(lyrics_by_id),
+                settings.OPENAI_MAX_OUTPUT_TOKENS,
+            ),
+            "response_format": {"type": "json_object"},
+        }
+        with UpstreamCall(OPENAI, estimate_tokens(request)) as call:
+            response = call.call_openai(
+                client.chat.completions.with_raw_response.create, request
             )
-            content = response.choices[0].message.content
-            try:
-                analysis_data = json.loads(content)
-                if not isinstance(analysis_data, dict):
-                    logger.warning("OpenAI returned non-dictionary response")
-                    return False, "Invalid response format from OpenAI", {}
-                if "summary" not in analysis_data:
-                    analysis_data["summary"] = (
-                        "Unable to generate summary for this song."
+        metrics.incr("openai.batch_requests")
+        metrics.incr("openai.batch_items", len(lyrics_by_id))
+        analyses = json.loads(response.choices[0].message.content)
+        return analyses if isinstance(analyses, dict) else {}
+
+    @staticmethod
+    def _split_batches(lyrics_by_id: Dict[str, str]) -> List[Dict[str, str]]:
+        """
+        Pack lyrics into batches that fit OPENAI_BATCH_TOKEN_BUDGET, using the
+        rough estimate of four characters per token, and whose replies, of
+        up to OPENAI_MAX_TOKENS per song, fit OPENAI_MAX_OUTPUT_TOKENS
+        """
+        max_items = max(
+            1,
+            min(
+                settings.OPENAI_BATCH_MAX_ITEMS,
+                settings.OPENAI_MAX_OUTPUT_TOKENS // settings.OPENAI_MAX_TOKENS,
+            ),
+        )
+        batches = []
+        batch, batch_tokens = {}, 0
+        for item_id, lyrics in lyrics_by_id.items():
+            tokens = len(lyrics) // 4 + BATCH_ITEM_OVERHEAD_TOKENS
+            if batch and (
+                batch_tokens + tokens > settings.OPENAI_BATCH_TOKEN_BUDGET
+                or len(batch) >= max_items
+            ):
+                batches.append(batch)
+                batch, batch_tokens = {}, 0
+            batch[item_id] = lyrics
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @staticmethod
+    def analyze_lyrics_batch(
+        lyrics_by_id: Dict[str, str],
+    ) -> Dict[str, Tuple[bool, str, Dict[str, Any]]]:
+        """
+        Analyze the lyrics of many songs, packing several songs into each
+        OpenAI request. Songs missing or malformed in a reply are retried,
+        without the ones that already succeeded.
+
+        Args:
+            lyrics_by_id: Lyrics keyed by an ID unique within the batch
+
+        Returns:
+            Dict[str, Tuple[bool, str, Dict[str, Any]]]: Result of
+            analyze_lyrics for each ID
+
+        Raises:
+            UpstreamRateLimited: When OpenAI is rate limiting us; analyses
+            finished so far are cached
+        """
+        results = {}
+        pending = {}
+        for item_id, lyrics in lyrics_by_id.items():
+            if not lyrics:
+                results[item_id] = (False, "No lyrics to analyze", {})
+                continue
+            cached_analysis = song_cache.get(cache_keys.analysis_key(lyrics))
+            if cached_analysis:
+                results[item_id] = (
+                    True,
+                    "Analysis fetched from cache",
+                    cached_analysis,
+                )
+                continue
+            pending[item_id] = lyrics
+
+        for attempt in range(1 + settings.OPENAI_BATCH_MAX_RETRIES):
+            if not pending:
+                break
+            if attempt:
+                logger.warning("Retrying analysis of %s songs", len(pending))
+                metrics.incr("openai.batch_retried_items", len(pending))
+
+            for batch in AnalysisService._split_batches(pending):
+                # Short positional IDs keep the prompt small
+                short_ids = {str(n): item_id for n, item_id in enumerate(batch, 1)}
+                try:
+                    analyses = AnalysisService._complete_batch(
+                        {n: batch[item_id] for n, item_id in short_ids.items()}
+                    )
+                except UpstreamRateLimited:
+                    raise
+                except Exception as e:
+                    logger.error("Error analyzing batch: %s", str(e), exc_info=True)
+                    analyses = {}
+
+                for n, item_id in short_ids.items():
+                    analysis_data = analyses.get(n)
+                    if not isinstance(analysis_data, dict) or not isinstance(
+                        analysis_data.get("summary"), str
+                    ):
+                        continue
+                    if not isinstance(analysis_data.get("countries"), list):
+                        analysis_data["countries"] = []
+
+                    lyrics = pending.pop(item_id)
+                    AnalysisService.add_countries(lyrics, analysis_data)
+                    song_cache.set(
+                        cache_keys.analysis_key(lyrics),
+                        analysis_data,
+                        settings.ANALYSIS_CACHE_TTL,
                     )
+                    results[item_id] = (
+                        True,
+                        "Lyrics analyzed successfully",
+                        analysis_data,
+                    )
+
+        for item_id in pending:
+            results[item_id] = (False, "Error analyzing lyrics in batch", {})
+        return results
+
+    @staticmethod
+    def analyze_lyrics(
+        lyrics: str, on_summary: Optional[Callable[[str], None]] = None
+    ) -> Tuple[bool, str, Dict[str, Any]]:
+        """
+        Analyze lyrics using OpenAI API to get summary and countries mentioned
+
+        Args:
+            lyrics: Lyrics to analyze
+            on_summary: Called with each streamed piece of the summary
+
+        Returns:
+            Tuple[bool, str, Dict[str, Any]]: (success, message, analysis_data)
+
+        Raises:
+            UpstreamRateLimited: When OpenAI is rate limiting us
+        """
+        if not lyrics:
+            logger.warning("No lyrics provided for analysis")
+            return False, "No lyrics to analyze", {}
+
+        cache_key = cache_keys.analysis_key(lyrics)
+        cached_analysis = song_cache.get(cache_key)
+        if cached_analysis:
+            logger.info("Analysis fetched from cache")
+            return True, "Analysis fetched from cache", cached_analysis
+
+        try:
+            content = single_flight(
+                cache_key,
+                lambda: AnalysisService._complete(lyrics, on_summary),
+                lock_ttl=settings.SINGLE_FLIGHT_ANALYSIS_LOCK_TTL,
+            )
+            success, message, analysis_data = AnalysisService.parse_analysis(content)
+            if success:
+                AnalysisService.add_countries(lyrics, analysis_data)
+            if success and analysis_data["summary"] != UNKNOWN_SUMMARY:
+                song_cache.set(cache_key, analysis_data, settings.ANALYSIS_CACHE_TTL)
+                logger.info("Lyrics analysis cached")
 
-                if "countries" not in analysis_data or not isinstance(
-                    analysis_data["countries"], list
-                ):
-                    analysis_data["countries"] = []
-
-                cache.set(cache_key, analysis_data, settings.ANALYSIS_CACHE_TTL)
-                logger.info("Lyrics successfully analyzed and cached")
-
-                return True, "Lyrics analyzed successfully", analysis_data
-
-            except json.JSONDecodeError:
-                logger.warning("Failed to parse JSON from OpenAI response")
-                summary = "Unable to generate summary for this song."
-                countries = []
-
-                if "summary" in content.lower():
-                    summary_parts = content.split("summary")
-                    if len(summary_parts) > 1:
-                        summary_text = summary_parts[1].split("\n")[0]
-                        summary = summary_text.strip('": ,')
-
-                if "countries" in content.lower():
-                    countries_parts = content.split("countries")
-                    if len(countries_parts) > 1:
-                        countries_text = countries_parts[1].strip()
-                        if "[" in countries_text and "]" in countries_text:
-                            countries_list = countries_text[
-                                countries_text.find("[") + 1 : countries_text.find("]")
-                            ]
-                            countries = [
-                                c.strip(" \"'")
-                                for c in countries_list.split(",")
-                                if c.strip()
-                            ]
-                analysis_data = {"summary": summary, "countries": countries}
-                if summary != "Unable to generate summary for this song.":
-                    cache.set(cache_key, analysis_data, settings.ANALYSIS_CACHE_TTL)
-                    logger.info("Partial analysis results cached")
-
-                return True, "Lyrics analyzed with partial results", analysis_data
+            return success, message, analysis_data
 
+        except UpstreamRateLimited:
+            raise
         except Exception as e:
             logger.error("Error analyzing lyrics: %s", str(e), exc_info=True)
             return False, f"Error analyzing lyrics: {str(e)}", {}
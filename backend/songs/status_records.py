@@ -0,0 +1,134 @@
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from .events import status_stream_key
+
+logger = logging.getLogger(__name__)
+
+RECORD_FIELDS = ("status", "message", "owner", "version")
+
+# Write the status record of a song and append the change, with its new
+# version, to the owner's status stream in one step.
+PUBLISH_SCRIPT = """
+local version = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('HSET', KEYS[1], 'status', ARGV[1], 'message', ARGV[2], 'owner', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[5], '*',
+    'song_id', ARGV[6], 'status', ARGV[1], 'message', ARGV[2],
+    'version', version)
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return version
+"""
+
+# Fill a missing record from the database without clobbering one that a
+# concurrent status change wrote in the meantime.
+BACKFILL_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'status', ARGV[1], 'message', ARGV[2],
+    'owner', ARGV[3], 'version', 0)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+def record_key(song_id) -> str:
+    return f"lyrintel:song:{song_id}:status"
+
+
+def publish(*songs) -> None:
+    """
+    Record the current status of songs in Redis, where the status endpoints
+    read it without touching the database, and publish the change to the
+    status streams of their owners. Best effort: a failure only costs the
+    readers a database fallback.
+    """
+    try:
+        connection = get_redis_connection("default")
+        script = connection.register_script(PUBLISH_SCRIPT)
+        pipe = connection.pipeline(transaction=False)
+        for song in songs:
+            script(
+                keys=[record_key(song.id), status_stream_key(song.created_by_id)],
+                args=[
+                    song.status,
+                    song.message or "",
+                    str(song.created_by_id),
+                    settings.SONG_STATUS_RECORD_TTL,
+                    settings.SONG_STATUS_STREAM_MAXLEN,
+                    str(song.id),
+                ],
+                client=pipe,
+            )
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Failed to publish status of %s songs: %s", len(songs), e)
+
+
+def delete(*song_ids) -> None:
+    """Drop the records of deleted songs, which must no longer be served"""
+    try:
+        get_redis_connection("default").delete(
+            *(record_key(song_id) for song_id in song_ids)
+        )
+    except Exception as e:
+        logger.warning("Failed to delete status records: %s", e)
+
+
+def backfill(songs: Iterable[Dict[str, Any]]) -> None:
+    """Store records for songs read from the database after a miss"""
+    try:
+        connection = get_redis_connection("default")
+        script = connection.register_script(BACKFILL_SCRIPT)
+        pipe = connection.pipeline(transaction=False)
+        for song in songs:
+            script(
+                keys=[record_key(song["id"])],
+                args=[
+                    song["status"],
+                    song["message"] or "",
+                    str(song["created_by_id"]),
+                    settings.SONG_STATUS_RECORD_TTL,
+                ],
+                client=pipe,
+            )
+        pipe.execute()
+    except Exception as e:
+        logger.warning("Failed to backfill status records: %s", e)
+
+
+def read_many(song_ids: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Status records keyed by song ID, None for misses. Redis errors count as
+    misses so callers fall back to the database.
+    """
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        for song_id in song_ids:
+            pipe.hmget(record_key(song_id), RECORD_FIELDS)
+        rows = pipe.execute()
+    except Exception as e:
+        logger.warning("Failed to read status records: %s", e)
+        return {song_id: None for song_id in song_ids}
+
+    records = {}
+    for song_id, values in zip(song_ids, rows):
+        if values[0] is None:
+            records[song_id] = None
+            continue
+        status, message, owner, version = (value.decode() for value in values)
+        records[song_id] = {
+            "status": status,
+            "message": message,
+            "owner": owner,
+            "version": int(version),
+        }
+    return records
+
+
+def read(song_id: str) -> Optional[Dict[str, Any]]:
+    return read_many([song_id])[song_id]
@@ -0,0 +1,265 @@
+import json
+import logging
+import math
+import re
+import time
+from typing import Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from djangorestframework_camel_case.util import camelize
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from . import events
+from .models import Song
+from .serializers import SongSerializer
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+IN_FLIGHT_STATUSES = ("pending", "processing")
+
+_cursor_re = re.compile(r"^\d+-\d+$")
+
+# Tickets are only valid as stream tickets, not wherever else this
+# SECRET_KEY signs
+TICKET_SALT = "songs.streams.ticket"
+
+
+def format_event(event_type: str, data, event_id: Optional[str] = None) -> bytes:
+    """Encode one server-sent event"""
+    payload = json.dumps(camelize(data), cls=DjangoJSONEncoder)
+    event = f"event: {event_type}\ndata: {payload}\n\n"
+    if event_id:
+        event = f"id: {event_id}\n{event}"
+    return event.encode()
+
+
+def issue_ticket(user_id) -> str:
+    """
+    A signed ticket opening the event streams of a user for the next
+    SONG_STREAM_TICKET_TTL seconds. EventSource cannot set headers, so the
+    ticket goes in the URL instead of the access token, and what proxy logs
+    or browser history keep of it is worthless by the time it is read.
+    """
+    return signing.dumps({"u": str(user_id)}, salt=TICKET_SALT)
+
+
+def ticket_user_id(request) -> Optional[str]:
+    """User ID of the valid ticket in the `ticket` query parameter, if any"""
+    ticket = request.GET.get("ticket")
+    if not ticket:
+        return None
+    try:
+        return signing.loads(
+            ticket, salt=TICKET_SALT, max_age=settings.SONG_STREAM_TICKET_TTL
+        )["u"]
+    except (signing.BadSignature, KeyError, TypeError):
+        return None
+
+
+async def authenticate(request):
+    """
+    Authenticate with the JWT access token from the Authorization header or
+    a stream ticket from the `ticket` query parameter
+    """
+    user_id = ticket_user_id(request)
+    if user_id is not None:
+        return await User.objects.filter(id=user_id, is_active=True).afirst()
+    authenticator = JWTAuthentication()
+    try:
+        result = await sync_to_async(authenticator.authenticate)(request)
+        return result[0] if result else None
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+
+
+def token_user_id(request) -> Optional[str]:
+    """
+    User ID claimed by a valid JWT access token from the Authorization header
+    or by a stream ticket. Unlike authenticate, this skips the user lookup,
+    which matters for the busy status endpoints.
+    """
+    user_id = ticket_user_id(request)
+    if user_id is not None:
+        return user_id
+    authenticator = JWTAuthentication()
+    header = authenticator.get_header(request)
+    raw_token = header and authenticator.get_raw_token(header)
+    if not raw_token:
+        return None
+    try:
+        validated_token = authenticator.get_validated_token(raw_token)
+    except (InvalidToken, TokenError):
+        return None
+    return validated_token.get(jwt_settings.USER_ID_CLAIM)
+
+
+def unauthorized() -> JsonResponse:
+    return JsonResponse(
+        {"detail": "Authentication credentials were not provided."}, status=401
+    )
+
+
+async def in_flight_songs(user_id) -> List[Dict]:
+    """Current status of the songs of a user that are still being analyzed"""
+    songs = Song.objects.filter(
+        created_by_id=user_id, status__in=IN_FLIGHT_STATUSES
+    ).values("id", "status", "message")
+    return [song async for song in songs]
+
+
+async def get_song(user, song_id):
+    songs = Song.objects.select_related("created_by", "track")
+    if not user.is_staff:
+        songs = songs.filter(created_by=user)
+    return await songs.filter(id=song_id).afirst()
+
+
+@require_GET
+async def song_events(request, song_id):
+    """
+    Stream the analysis progress of a song as server-sent events: a
+    `snapshot` of the progress so far, `stage` changes, `delta` pieces of the
+    summary as the model writes it, and finally the `song` itself.
+    """
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+    song = await get_song(user, song_id)
+    if song is None:
+        return JsonResponse({"detail": "No Song matches the given query."}, status=404)
+
+    async def stream():
+        # Flush the headers right away so the client sees the stream open
+        yield b": connected\n\n"
+
+        if song.status not in ("completed", "error"):
+            deadline = time.monotonic() + settings.SONG_EVENTS_MAX_DURATION
+            subscription = events.subscribe(song.id, settings.SONG_EVENTS_HEARTBEAT)
+            try:
+                async for event in subscription:
+                    if event is None:
+                        yield b": keepalive\n\n"
+                    else:
+                        data = {k: v for k, v in event.items() if k != "type"}
+                        yield format_event(event["type"], data)
+                    if time.monotonic() > deadline:
+                        # The client reconnects and resumes from the snapshot
+                        return
+            except Exception as e:
+                logger.warning("Event stream for song %s failed: %s", song.id, e)
+                yield format_event("stream_error", {"detail": "Events unavailable"})
+                return
+            finally:
+                await subscription.aclose()
+
+        final_song = await get_song(user, song.id)
+        if final_song is not None:
+            yield format_event("song", SongSerializer(final_song).data)
+
+    return event_stream_response(stream())
+
+
+def event_stream_response(stream) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@require_GET
+async def song_status_events(request):
+    """
+    Stream the status changes of all songs of the user on one connection. A
+    `snapshot` of the songs still in flight comes first, then one `status`
+    event per change. Event IDs are stream cursors, so a reconnecting
+    EventSource resumes after the last change it saw via Last-Event-ID.
+    """
+    user_id = token_user_id(request)
+    if user_id is None:
+        return unauthorized()
+    cursor = request.headers.get("Last-Event-ID", "")
+    if cursor and not _cursor_re.match(cursor):
+        return JsonResponse({"detail": "Invalid Last-Event-ID."}, status=400)
+
+    async def stream():
+        nonlocal cursor
+        connection = events.async_connection()
+        try:
+            if cursor:
+                yield b": connected\n\n"
+            else:
+                # Take the cursor before the snapshot so no change is missed
+                cursor = await events.last_status_id(connection, user_id)
+                songs = await in_flight_songs(user_id)
+                yield format_event("snapshot", {"songs": songs}, event_id=cursor)
+
+            deadline = time.monotonic() + settings.SONG_EVENTS_MAX_DURATION
+            while time.monotonic() < deadline:
+                cursor, changes = await events.read_status_changes(
+                    connection, user_id, cursor, settings.SONG_EVENTS_HEARTBEAT
+                )
+                if not changes:
+                    yield b": keepalive\n\n"
+                for change in changes:
+                    yield format_event("status", change, event_id=change.pop("id"))
+        except Exception as e:
+            logger.warning("Status stream for user %s failed: %s", user_id, e)
+            yield format_event("stream_error", {"detail": "Events unavailable"})
+        finally:
+            await connection.aclose()
+
+    return event_stream_response(stream())
+
+
+@require_GET
+async def song_status_changes(request):
+    """
+    Long-poll fallback of song_status_events. Without a cursor it answers at
+    once with the songs in flight and a cursor; with one it waits until a
+    status changes after the cursor, or until the timeout passes, and
+    answers with the changes and the cursor to pass next.
+    """
+    user_id = token_user_id(request)
+    if user_id is None:
+        return unauthorized()
+    cursor = request.GET.get("cursor", "")
+    if cursor and not _cursor_re.match(cursor):
+        return JsonResponse({"detail": "Invalid cursor."}, status=400)
+    try:
+        timeout = float(
+            request.GET.get("timeout", settings.SONG_STATUS_LONG_POLL_TIMEOUT)
+        )
+    except ValueError:
+        timeout = math.nan
+    # float() also accepts "nan", "inf" and negative numbers
+    if not math.isfinite(timeout) or timeout < 0:
+        return JsonResponse({"detail": "Invalid timeout."}, status=400)
+    timeout = min(timeout, settings.SONG_STATUS_LONG_POLL_TIMEOUT)
+
+    connection = events.async_connection()
+    try:
+        if not cursor:
+            cursor = await events.last_status_id(connection, user_id)
+            data = {"cursor": cursor, "songs": await in_flight_songs(user_id)}
+        else:
+            cursor, changes = await events.read_status_changes(
+                connection, user_id, cursor, timeout
+            )
+            for change in changes:
+                del change["id"]
+            data = {"cursor": cursor, "changes": changes}
+    finally:
+        await connection.aclose()
+    return JsonResponse(camelize(data))
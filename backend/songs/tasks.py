@@ -1,28 +1,240 @@
 import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
 
-from celery import shared_task
+from celery import chain, shared_task
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
 
-from .models import Song
+from . import async_worker, events, metrics, status_records
+from .models import CountryCount, Lyrics, Song, Track
+from .rate_limits import UpstreamRateLimited, requeue_delay, waiting_message
 from .services import AnalysisService, LyricsService
 
 logger = logging.getLogger(__name__)
 
+# Stages of the analysis chain, named after the queues they are routed to
+# by CELERY_TASK_ROUTES
+STAGE_LYRICS = "lyrics"
+STAGE_ANALYSIS = "analysis"
+STAGE_PERSIST = "persist"
+
+
+def new_task_id() -> Optional[str]:
+    """
+    ID to store on a song before it is saved, for the Celery chain that
+    queue_analysis sends afterwards; None when the async worker analyzes it
+    """
+    if settings.ANALYSIS_WORKER == "async":
+        return None
+    return str(uuid.uuid4())
+
+
+def analysis_chain(song: Song):
+    """
+    The fetch -> analyze -> persist chain analyzing a song. Stages pass the
+    song and track IDs on and read what they need from the database, so
+    lyrics never travel through the broker. The chain's task ID is that of
+    its last task.
+    """
+    return chain(
+        fetch_lyrics_task.si(
+            str(song.id),
+            song.artist,
+            song.title,
+            str(song.created_by_id),
+            track_id=str(song.track_id),
+            queued_at=time.time(),
+        ),
+        analyze_lyrics_task.s(),
+        persist_analysis_task.s(),
+    )
+
+
+def queue_analysis(song: Song) -> None:
+    """
+    Hand a saved pending song to the worker selected by ANALYSIS_WORKER:
+    the Celery analysis chain, under the task ID given by new_task_id
+    before the song was saved, or the async workers claiming pending songs
+    """
+    if settings.ANALYSIS_WORKER == "async":
+        async_worker.notify()
+        return
+    analysis_chain(song).apply_async(task_id=song.task_id)
+
+
+def _song_ref(song_id, owner_id, **fields) -> Song:
+    """Unsaved stand-in for a song, enough to update and publish its status"""
+    return Song(id=song_id, created_by_id=owner_id, **fields)
+
+
+def _transition(
+    song: Song, from_statuses, held_by=None, retake_stale=False, **fields
+) -> bool:
+    """
+    Write changed columns of a song still in one of `from_statuses`, and
+    held by the task `held_by` if given, with a single conditional UPDATE,
+    then apply them to `song` and publish its status. Returns False,
+    changing nothing, when the song moved on. See SongQuerySet.transition
+    for `retake_stale`.
+    """
+    songs = Song.objects.filter(id=song.id)
+    if held_by is not None:
+        songs = songs.filter(task_id=held_by)
+    if not songs.transition(from_statuses, retake_stale, **fields):
+        logger.warning("Song %s is no longer %s", song.id, " or ".join(from_statuses))
+        return False
+    for name, value in fields.items():
+        setattr(song, name, value)
+    if "status" in fields or "message" in fields:
+        status_records.publish(song)
+    return True
+
+
+def _claim(task, song: Song) -> bool:
+    """
+    Take a pending song for `task` and mark it processing, recording the
+    task as its holder. Only a retry of that task, after a rate limit, may
+    take the song again while it is processing: a duplicate message, the
+    drain or the async worker find it taken and leave it alone, until the
+    claim is SONG_CLAIM_TIMEOUT old and its holder taken for dead, e.g.
+    killed mid-analysis.
+    """
+    if task.request.retries:
+        return _transition(
+            song,
+            ("processing",),
+            held_by=task.request.id,
+            status="processing",
+            message="",
+            claimed_at=timezone.now(),
+        )
+    return _transition(
+        song,
+        ("pending",),
+        retake_stale=True,
+        status="processing",
+        message="",
+        task_id=task.request.id,
+        claimed_at=timezone.now(),
+    )
+
+
+def _update_track(track_id, **fields) -> None:
+    Track.objects.filter(id=track_id).store(**fields)
+
+
+def _complete_song(song: Song) -> bool:
+    """Complete a processing song, once its track holds an analysis"""
+    if not _transition(song, ("processing",), status="completed", message=""):
+        return False
+    events.publish_stage(song.id, events.STAGE_COMPLETED)
+    logger.info("Successfully analyzed song %s", song.id)
+    return True
+
+
+def _save_analysis(
+    song: Song, track_id, analysis_data: Dict[str, Any], **fields
+) -> bool:
+    """
+    Store an analysis, and any other `fields`, on the shared track, where it
+    serves every user's song of that track, then complete the song
+    """
+    _update_track(
+        track_id,
+        summary=analysis_data.get("summary", ""),
+        countries=analysis_data.get("countries", []),
+        analyzed_at=timezone.now(),
+        **fields,
+    )
+    return _complete_song(song)
+
+
+def _fail_song(song: Song, message: str, **fields) -> None:
+    if _transition(song, ("processing",), status="error", message=message, **fields):
+        events.publish_stage(song.id, events.STAGE_ERROR)
+
+
+def _fail_unexpected(song: Optional[Song], song_id, e: Exception) -> None:
+    message = str(e)
+    logger.exception("Error analyzing song %s: %s", song_id, message)
+    try:
+        if song is None:
+            song = Song.objects.only("id", "created_by_id").get(id=song_id)
+        _fail_song(song, f"Unexpected error during analysis: {message}")
+    except Exception as inner_e:
+        logger.exception("Failed to update song error status: %s", str(inner_e))
+
+
+def _retry_rate_limited(task, song: Song, e: UpstreamRateLimited) -> None:
+    """
+    Retry a task with its arguments once the rate limit resets, or fail the
+    song after RATE_LIMIT_MAX_REQUEUES retries. Retries keep the rest of a
+    chain.
+    """
+    if task.request.retries >= settings.RATE_LIMIT_MAX_REQUEUES:
+        logger.error("Giving up on song %s: %s", song.id, str(e))
+        _fail_song(song, f"Failed to analyze song: {e}")
+        return
+
+    countdown = requeue_delay(e.retry_after)
+    logger.warning("Requeuing song %s in %.0fs: %s", song.id, countdown, str(e))
+    # The song stays processing: this task still owns it, and renews its
+    # claim for the wait
+    if _transition(
+        song,
+        ("processing",),
+        message=waiting_message(e.upstream, countdown),
+        claimed_at=timezone.now(),
+    ):
+        raise task.retry(
+            countdown=countdown, max_retries=settings.RATE_LIMIT_MAX_REQUEUES
+        )
+
+
+def _record_queue_wait(task, stage: str, queued_at: Optional[float]) -> None:
+    """Count the time a stage waited in its queue, see pipeline_status"""
+    # Retries wait for a rate limit, not for a worker
+    if queued_at is None or task.request.retries:
+        return
+    metrics.incr(f"pipeline.{stage}.wait.count")
+    metrics.incr(f"pipeline.{stage}.wait.ms", max(0, time.time() - queued_at) * 1000)
+
 
 @shared_task(bind=True, name="analyze_song_task")
 def analyze_song_task(self, song_id):
     """
-    Celery task to analyze a song's lyrics asynchronously
+    Celery task to analyze a song's lyrics asynchronously, in one task.
+    Songs are now queued through analysis_chain; this task still serves
+    messages queued before and the bench_async_worker command. When an
+    upstream is rate limiting us, the task is retried once the limit
+    resets, up to RATE_LIMIT_MAX_REQUEUES times, instead of failing the song.
+
+    A successful song costs one SELECT, the lyrics INSERT and three UPDATEs:
+    claiming it, storing the lyrics and analysis on its track, and
+    completing it. A song whose track another user already had analyzed is
+    completed right after the claim, without upstream calls.
 
     Args:
         song_id: UUID of the song to analyze
     """
     logger.info("Starting analysis for song %s", song_id)
+    song = None
 
     try:
-        song = Song.objects.get(id=song_id)
-        song.status = "processing"
-        song.save(update_fields=["status"])
+        song = (
+            Song.objects.select_related("track")
+            .only("id", "artist", "title", "created_by_id", "track__analyzed_at")
+            .get(id=song_id)
+        )
+        if not _claim(self, song):
+            return False
+        if song.track.is_analyzed:
+            return _complete_song(song)
+        events.publish_stage(song_id, events.STAGE_FETCHING_LYRICS)
 
         lyrics_success, lyrics_message, lyrics = LyricsService.fetch_lyrics(
             song.artist, song.title
@@ -32,48 +244,370 @@ def analyze_song_task(self, song_id):
             logger.error(
                 "Failed to fetch lyrics for song %s: %s", song_id, lyrics_message
             )
-            song.status = "error"
-            song.message = f"Failed to fetch lyrics: {lyrics_message}"
-            song.save(update_fields=["status", "message"])
+            _fail_song(song, f"Failed to fetch lyrics: {lyrics_message}")
             return False
 
-        song.lyrics = lyrics
-        song.save(update_fields=["lyrics"])
+        events.publish_stage(song_id, events.STAGE_ANALYZING)
 
         analysis_success, analysis_message, analysis_data = (
-            AnalysisService.analyze_lyrics(lyrics)
+            AnalysisService.analyze_lyrics(
+                lyrics, on_summary=lambda text: events.publish_delta(song_id, text)
+            )
         )
 
         if not analysis_success:
             logger.error(
                 "Failed to analyze lyrics for song %s: %s", song_id, analysis_message
             )
-            song.status = "error"
-            song.message = f"Failed to analyze lyrics: {analysis_message}"
-            song.save(update_fields=["status", "message"])
+            _update_track(song.track_id, **Lyrics.objects.track_fields(lyrics))
+            _fail_song(song, f"Failed to analyze lyrics: {analysis_message}")
             return False
 
-        with transaction.atomic():
-            song.summary = analysis_data.get("summary", "")
-            song.countries = analysis_data.get("countries", [])
-            song.status = "completed"
-            song.message = ""
-            song.save()
-
-        logger.info("Successfully analyzed song %s", song_id)
-        return True
+        return _save_analysis(
+            song, song.track_id, analysis_data, **Lyrics.objects.track_fields(lyrics)
+        )
 
     except Song.DoesNotExist:
         logger.error("Song with ID %s does not exist", song_id)
         return False
+    except UpstreamRateLimited as e:
+        _retry_rate_limited(self, song, e)
+        return False
     except Exception as e:
-        message = str(e)
-        logger.exception("Error analyzing song %s: %s", song_id, message)
+        _fail_unexpected(song, song_id, e)
+        return False
+
+
+@shared_task(bind=True, name="fetch_lyrics_task")
+def fetch_lyrics_task(
+    self, song_id, artist, title, owner_id, track_id=None, queued_at=None
+) -> Optional[Dict[str, Any]]:
+    """
+    First stage of the analysis chain: claim the song, fetch its lyrics
+    from Musixmatch and store them on its track. One SELECT, checking that
+    the track still needs an analysis, the lyrics INSERT and two UPDATEs.
+    Only a pending song is claimed, see _claim. A song whose track was
+    analyzed meanwhile is completed here and the chain stops.
+
+    Returns:
+        Optional[Dict[str, Any]]: Input of analyze_lyrics_task, or None
+        when the song failed or is no longer pending
+    """
+    _record_queue_wait(self, STAGE_LYRICS, queued_at)
+    logger.info("Fetching lyrics for song %s", song_id)
+    song = _song_ref(song_id, owner_id)
+    try:
+        with metrics.timer(f"pipeline.{STAGE_LYRICS}"):
+            if not _claim(self, song):
+                return None
+            track = (
+                (
+                    Track.objects.filter(songs__id=song_id)
+                    if track_id is None  # Queued before songs had tracks
+                    else Track.objects.filter(id=track_id)
+                )
+                .values("id", "analyzed_at")
+                .first()
+            )
+            if track["analyzed_at"] is not None:
+                _complete_song(song)
+                return None
+            track_id = str(track["id"])
+            events.publish_stage(song_id, events.STAGE_FETCHING_LYRICS)
+
+            lyrics_success, lyrics_message, lyrics = LyricsService.fetch_lyrics(
+                artist, title
+            )
+            if not lyrics_success:
+                logger.error(
+                    "Failed to fetch lyrics for song %s: %s", song_id, lyrics_message
+                )
+                _fail_song(song, f"Failed to fetch lyrics: {lyrics_message}")
+                return None
+
+            _update_track(track_id, **Lyrics.objects.track_fields(lyrics))
+        return {
+            "song_id": song_id,
+            "owner_id": owner_id,
+            "track_id": track_id,
+            "queued_at": time.time(),
+        }
+
+    except UpstreamRateLimited as e:
+        _retry_rate_limited(self, song, e)
+        return None
+    except Exception as e:
+        _fail_unexpected(song, song_id, e)
+        return None
+
+
+@shared_task(bind=True, name="analyze_lyrics_task")
+def analyze_lyrics_task(
+    self, fetched: Optional[Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    """
+    Second stage of the analysis chain: analyze the stored lyrics with
+    OpenAI, streaming the summary to the song's progress events. Reads the
+    track's lyrics with one SELECT and writes nothing.
+
+    Returns:
+        Optional[Dict[str, Any]]: Input of persist_analysis_task, or None
+        when the song failed or is no longer processing
+    """
+    if fetched is None:
+        return None
+    song_id = fetched["song_id"]
+    _record_queue_wait(self, STAGE_ANALYSIS, fetched["queued_at"])
+    logger.info("Analyzing lyrics for song %s", song_id)
+    song = _song_ref(song_id, fetched["owner_id"], status="processing")
+    try:
+        with metrics.timer(f"pipeline.{STAGE_ANALYSIS}"):
+            data = (
+                Song.objects.filter(id=song_id, status="processing")
+                .values_list("track__lyrics__data", flat=True)
+                .first()
+            )
+            if data is None:
+                logger.warning("Song %s is no longer processing", song_id)
+                return None
+            lyrics = Lyrics.decompress(data)
+            events.publish_stage(song_id, events.STAGE_ANALYZING)
+
+            analysis_success, analysis_message, analysis_data = (
+                AnalysisService.analyze_lyrics(
+                    lyrics,
+                    on_summary=lambda text: events.publish_delta(song_id, text),
+                )
+            )
+            if not analysis_success:
+                logger.error(
+                    "Failed to analyze lyrics for song %s: %s",
+                    song_id,
+                    analysis_message,
+                )
+                _fail_song(song, f"Failed to analyze lyrics: {analysis_message}")
+                return None
+        return {
+            **fetched,
+            "queued_at": time.time(),
+            "summary": analysis_data.get("summary", ""),
+            "countries": analysis_data.get("countries", []),
+        }
+
+    except UpstreamRateLimited as e:
+        _retry_rate_limited(self, song, e)
+        return None
+    except Exception as e:
+        _fail_unexpected(song, song_id, e)
+        return None
+
+
+@shared_task(bind=True, name="persist_analysis_task")
+def persist_analysis_task(self, analyzed: Optional[Dict[str, Any]]) -> bool:
+    """
+    Last stage of the analysis chain: store the analysis on the track and
+    complete the song, one UPDATE each
+    """
+    if analyzed is None:
+        return False
+    song_id = analyzed["song_id"]
+    _record_queue_wait(self, STAGE_PERSIST, analyzed["queued_at"])
+    song = _song_ref(song_id, analyzed["owner_id"])
+    try:
+        with metrics.timer(f"pipeline.{STAGE_PERSIST}"):
+            return _save_analysis(song, analyzed["track_id"], analyzed)
+
+    except Exception as e:
+        _fail_unexpected(song, song_id, e)
+        return False
+
+
+def _finish_songs(task, songs) -> None:
+    """
+    Write the statuses the drain gave its songs, one conditional UPDATE per
+    status and message, and publish them. Songs that are no longer held by
+    the drain, e.g. deleted meanwhile, are left alone.
+    """
+    groups = {}
+    for song in songs:
+        groups.setdefault((song.status, song.message), []).append(song)
+    for (song_status, message), group in groups.items():
+        updated = Song.objects.filter(
+            id__in=[song.id for song in group], task_id=task.request.id
+        ).transition(("processing",), status=song_status, message=message)
+        if updated < len(group):
+            logger.warning(
+                "%s of %s songs moved on during batch analysis",
+                len(group) - updated,
+                len(group),
+            )
+            group = list(
+                Song.objects.filter(
+                    id__in=[song.id for song in group],
+                    status=song_status,
+                    message=message,
+                ).only("id", "status", "message", "created_by_id")
+            )
+        status_records.publish(*group)
+
+
+@shared_task(bind=True, name="analyze_pending_songs_task")
+def analyze_pending_songs_task(self, batch_size=None):
+    """
+    Celery task draining pending songs in groups: lyrics are fetched
+    concurrently and analyzed with batched OpenAI requests. Re-queues itself
+    until no pending songs are left. Songs held up by an upstream rate limit
+    go back to pending, and the drain resumes once the limit resets.
+
+    Args:
+        batch_size: Number of songs claimed per run
+    """
+    batch_size = batch_size or settings.SONG_DRAIN_BATCH_SIZE
+
+    # Songs abandoned processing by a dead worker are drained again too
+    with transaction.atomic():
+        song_ids = list(
+            Song.objects.select_for_update(skip_locked=True)
+            .filter(Song.objects.in_statuses(("pending",), retake_stale=True))
+            .order_by("created")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        Song.objects.filter(id__in=song_ids).transition(
+            ("pending",),
+            retake_stale=True,
+            status="processing",
+            task_id=self.request.id,
+            claimed_at=timezone.now(),
+        )
+
+    if not song_ids:
+        logger.info("No pending songs to analyze")
+        return 0
+
+    try:
+        return _drain(self, song_ids, batch_size)
+    except Exception as e:
+        logger.exception("Error analyzing pending songs: %s", str(e))
+        # Fail the songs the drain still holds, rather than leave them
+        # processing until their claims go stale
+        songs = list(
+            Song.objects.filter(
+                id__in=song_ids, task_id=self.request.id, status="processing"
+            ).only("id", "created_by_id")
+        )
+        for song in songs:
+            song.status = "error"
+            song.message = f"Unexpected error during analysis: {e}"
+        _finish_songs(self, songs)
+        return 0
+
+
+def _drain(task, song_ids, batch_size) -> int:
+    """
+    Analyze the songs analyze_pending_songs_task claimed, and re-queue the
+    task. Returns how many songs were finished.
+    """
+    songs = list(Song.objects.select_related("track").filter(id__in=song_ids))
+    status_records.publish(*songs)
+    logger.info("Analyzing %s pending songs in batch", len(songs))
+
+    # Each track is analyzed once however many of the songs share it
+    tracks = {song.track_id: song.track for song in songs if not song.track.is_analyzed}
+
+    def fetch(track):
         try:
-            song = Song.objects.get(id=song_id)
+            return LyricsService.fetch_lyrics(track.artist, track.title)
+        except UpstreamRateLimited as e:
+            return e
+
+    with ThreadPoolExecutor(
+        max_workers=settings.SONG_BATCH_CHECK_CONCURRENCY
+    ) as executor:
+        fetched = list(executor.map(fetch, tracks.values()))
+
+    rate_limited = None
+    deferred = set()
+    failures = {}
+    lyrics_by_id = {}
+    for track, result in zip(tracks.values(), fetched):
+        if isinstance(result, UpstreamRateLimited):
+            rate_limited = result
+            deferred.add(track.id)
+            continue
+        lyrics_success, lyrics_message, lyrics = result
+        if lyrics_success:
+            lyrics_by_id[str(track.id)] = lyrics
+        else:
+            failures[track.id] = f"Failed to fetch lyrics: {lyrics_message}"
+
+    try:
+        analyses = AnalysisService.analyze_lyrics_batch(lyrics_by_id)
+    except UpstreamRateLimited as e:
+        rate_limited = e
+        analyses = {}
+        deferred.update(
+            track.id for track in tracks.values() if str(track.id) in lyrics_by_id
+        )
+
+    now = timezone.now()
+    for track in tracks.values():
+        if str(track.id) not in analyses:
+            continue
+        analysis_success, analysis_message, analysis_data = analyses[str(track.id)]
+        if analysis_success:
+            track.summary = analysis_data.get("summary", "")
+            track.countries = analysis_data.get("countries", [])
+            track.analyzed_at = now
+        else:
+            failures[track.id] = f"Failed to analyze lyrics: {analysis_message}"
+
+    if rate_limited is not None:
+        countdown = requeue_delay(rate_limited.retry_after)
+    for song in songs:
+        if song.track_id in deferred:
+            song.status = "pending"
+            song.message = waiting_message(rate_limited.upstream, countdown)
+        elif song.track_id in failures:
             song.status = "error"
-            song.message = f"Unexpected error during analysis: {message}"
-            song.save(update_fields=["status", "message"])
-        except Exception as inner_e:
-            logger.exception("Failed to update song error status: %s", str(inner_e))
-        return False
+            song.message = failures[song.track_id]
+        else:
+            song.status = "completed"
+            song.message = ""
+
+    fetched_tracks = [
+        track for track in tracks.values() if str(track.id) in lyrics_by_id
+    ]
+    stored = Lyrics.objects.store_many(
+        lyrics_by_id[str(track.id)] for track in fetched_tracks
+    )
+    for track, lyrics in zip(fetched_tracks, stored):
+        track.lyrics = lyrics
+        track.lyrics_length = len(lyrics_by_id[str(track.id)])
+    Track.objects.bulk_update(
+        fetched_tracks,
+        ["lyrics", "lyrics_length", "summary", "countries", "analyzed_at"],
+    )
+    Track.objects.filter(id__in=[track.id for track in fetched_tracks]).store()
+    _finish_songs(task, songs)
+    logger.info("Finished batch analysis of %s songs", len(songs))
+    deferred_songs = sum(song.status == "pending" for song in songs)
+
+    if rate_limited is not None:
+        logger.warning(
+            "Deferred %s songs for %.0fs: %s", deferred_songs, countdown, rate_limited
+        )
+        analyze_pending_songs_task.apply_async((batch_size,), countdown=countdown)
+    elif len(song_ids) == batch_size:
+        analyze_pending_songs_task.delay(batch_size)
+    return len(songs) - deferred_songs
+
+
+@shared_task(bind=True, name="refresh_country_counts_task")
+def refresh_country_counts_task(self):
+    """
+    Celery beat task recounting the countries mentioned by completed songs,
+    per user and overall, for the songs/countries/ endpoint
+    """
+    rows = CountryCount.objects.refresh()
+    logger.info("Refreshed %s country counts", rows)
+    return rows
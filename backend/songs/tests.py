@@ -1,3 +1,955 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import resolve
+from django.utils import timezone
+from django_redis import get_redis_connection
+from openai import RateLimitError
+from rest_framework.test import APIClient
+from rest_framework.throttling import BaseThrottle
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.pagination import KeysetPagination
+
+from . import async_services, rate_limits, services
+from .async_views import song_collection
+from .management.commands.reanalyze_songs import Command
+from .models import CountryCount, Lyrics, Song, Track
+from .rate_limits import UpstreamRateLimited
+from .tasks import (
+    analyze_lyrics_task,
+    analyze_pending_songs_task,
+    analyze_song_task,
+    fetch_lyrics_task,
+    persist_analysis_task,
+)
+from .views import SongViewSet
+
+User = get_user_model()
+
+LYRICS = "We are the champions of Norway"
+ANALYSIS = {"summary": "A victory song.", "countries": ["Norway"]}
+
+
+def create_user(email, **fields):
+    # No password: hashing one would dominate the tests' run time
+    return User.objects.create_user(
+        email, first_name="Test", last_name="User", **fields
+    )
+
+
+def create_song(user, artist="Queen", title="We Are the Champions", **fields):
+    return Song.objects.create(
+        artist=artist,
+        title=title,
+        created_by=user,
+        track=Track.objects.for_song(artist, title),
+        **fields,
+    )
+
+
+def kill_claim(song):
+    # The worker processing the song was killed, leaving its claim to go stale
+    Song.objects.filter(id=song.id).update(
+        status="processing",
+        task_id="dead-task",
+        claimed_at=timezone.now() - timedelta(seconds=settings.SONG_CLAIM_TIMEOUT + 1),
+    )
+
+
+@mock.patch(
+    "songs.tasks.AnalysisService.analyze_lyrics",
+    return_value=(True, "Lyrics analyzed successfully", ANALYSIS),
+)
+@mock.patch(
+    "songs.tasks.LyricsService.fetch_lyrics",
+    return_value=(True, "Lyrics fetched successfully", LYRICS),
+)
+class AnalysisTaskTests(TestCase):
+    def setUp(self):
+        self.user = create_user("owner@example.com")
+        self.song = create_song(self.user)
+
+    def assertSongStatus(self, status, **fields):
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.status, status)
+        for name, value in fields.items():
+            self.assertEqual(getattr(self.song, name), value)
+
+    def fetch(self, **options):
+        return fetch_lyrics_task.apply(
+            (
+                str(self.song.id),
+                self.song.artist,
+                self.song.title,
+                str(self.user.id),
+            ),
+            {"track_id": str(self.song.track_id)},
+            **options,
+        ).get()
+
+    def test_analyze_song_task_queries(self, fetch_lyrics, analyze_lyrics):
+        # Song SELECT, claim, lyrics INSERT, track UPDATE, completion
+        with self.assertNumQueries(5):
+            self.assertTrue(analyze_song_task.apply((self.song.id,)).get())
+        self.assertSongStatus("completed", message="")
+        track = Track.objects.get(id=self.song.track_id)
+        self.assertEqual(track.summary, ANALYSIS["summary"])
+        self.assertEqual(track.lyrics.text, LYRICS)
+
+    def test_analyze_song_task_reuses_analyzed_track(
+        self, fetch_lyrics, analyze_lyrics
+    ):
+        Track.objects.filter(id=self.song.track_id).update(analyzed_at=timezone.now())
+        with self.assertNumQueries(3):
+            self.assertTrue(analyze_song_task.apply((self.song.id,)).get())
+        self.assertSongStatus("completed")
+        fetch_lyrics.assert_not_called()
+
+    def test_chain_stage_queries(self, fetch_lyrics, analyze_lyrics):
+        # Claim, track SELECT, lyrics INSERT, track UPDATE
+        with self.assertNumQueries(4):
+            fetched = self.fetch()
+        self.assertSongStatus("processing")
+
+        with self.assertNumQueries(1):
+            analyzed = analyze_lyrics_task.apply((fetched,)).get()
+        analyze_lyrics.assert_called_once()
+        self.assertEqual(analyze_lyrics.call_args.args[0], LYRICS)
+
+        with self.assertNumQueries(2):
+            self.assertTrue(persist_analysis_task.apply((analyzed,)).get())
+        self.assertSongStatus("completed")
+
+    def test_chain_stops_on_analyzed_track(self, fetch_lyrics, analyze_lyrics):
+        Track.objects.filter(id=self.song.track_id).update(analyzed_at=timezone.now())
+        with self.assertNumQueries(3):
+            self.assertIsNone(self.fetch())
+        self.assertSongStatus("completed")
+
+    def test_processing_song_is_not_claimed_again(self, fetch_lyrics, analyze_lyrics):
+        Song.objects.filter(id=self.song.id).update(
+            status="processing", task_id="other-task", claimed_at=timezone.now()
+        )
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.fetch())
+        self.assertFalse(analyze_song_task.apply((self.song.id,)).get())
+        self.assertSongStatus("processing", task_id="other-task")
+        fetch_lyrics.assert_not_called()
+
+    def test_stale_claim_is_taken_again(self, fetch_lyrics, analyze_lyrics):
+        kill_claim(self.song)
+        self.assertIsNotNone(self.fetch(task_id="this-task"))
+        self.assertSongStatus("processing", task_id="this-task")
+        fetch_lyrics.assert_called_once()
+
+    def test_retry_keeps_its_claim(self, fetch_lyrics, analyze_lyrics):
+        Song.objects.filter(id=self.song.id).update(
+            status="processing", message="Waiting", task_id="this-task"
+        )
+        self.assertIsNotNone(self.fetch(task_id="this-task", retries=1))
+        self.assertSongStatus("processing", message="", task_id="this-task")
+
+    def test_rate_limited_stage_keeps_song(self, fetch_lyrics, analyze_lyrics):
+        fetch_lyrics.side_effect = UpstreamRateLimited("musixmatch", 30)
+        with mock.patch.object(fetch_lyrics_task, "retry") as retry:
+            retry.side_effect = RuntimeError("retried")
+            fetch_lyrics_task.apply(
+                (str(self.song.id), self.song.artist, self.song.title, self.user.id),
+                task_id="this-task",
+            )
+        retry.assert_called_once()
+        self.assertSongStatus("processing", task_id="this-task")
+
+    def test_drain_completes_songs_it_holds(self, fetch_lyrics, analyze_lyrics):
+        other = create_song(self.user, title="Bohemian Rhapsody")
+        with mock.patch(
+            "songs.tasks.AnalysisService.analyze_lyrics_batch",
+            side_effect=lambda lyrics_by_id: {
+                track_id: (True, "", ANALYSIS) for track_id in lyrics_by_id
+            },
+        ):
+            self.assertEqual(analyze_pending_songs_task.apply((5,)).get(), 2)
+        self.assertSongStatus("completed")
+        other.refresh_from_db()
+        self.assertEqual(other.status, "completed")
+        self.assertEqual(fetch_lyrics.call_count, 2)
+
+    def test_drain_takes_stale_claims(self, fetch_lyrics, analyze_lyrics):
+        kill_claim(self.song)
+        with mock.patch(
+            "songs.tasks.AnalysisService.analyze_lyrics_batch",
+            side_effect=lambda lyrics_by_id: {
+                track_id: (True, "", ANALYSIS) for track_id in lyrics_by_id
+            },
+        ):
+            self.assertEqual(analyze_pending_songs_task.apply((5,)).get(), 1)
+        self.assertSongStatus("completed")
+
+    def test_drain_error_fails_songs_it_holds(self, fetch_lyrics, analyze_lyrics):
+        with mock.patch(
+            "songs.tasks.AnalysisService.analyze_lyrics_batch",
+            side_effect=RuntimeError("OpenAI is down"),
+        ):
+            self.assertEqual(analyze_pending_songs_task.apply((5,)).get(), 0)
+        self.assertSongStatus(
+            "error", message="Unexpected error during analysis: OpenAI is down"
+        )
+
+
+@mock.patch("songs.views.queue_analysis")
+@mock.patch(
+    "songs.views.LyricsService.check_song_exists", return_value=(True, "Song exists")
+)
+class SongReanalyzeTests(TestCase):
+    def setUp(self):
+        self.user = create_user("owner@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.song = create_song(
+            self.user,
+            status="processing",
+            task_id="dead-task",
+            claimed_at=timezone.now(),
+        )
+
+    def reanalyze(self):
+        return self.client.post(f"/api/v1/songs/{self.song.id}/reanalyze/")
+
+    def test_claimed_song_conflicts(self, check_song_exists, queue_analysis):
+        self.assertEqual(self.reanalyze().status_code, 409)
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.task_id, "dead-task")
+        queue_analysis.assert_not_called()
+
+    def test_killed_claim_is_reanalyzed(self, check_song_exists, queue_analysis):
+        kill_claim(self.song)
+        response = self.reanalyze()
+        self.assertEqual(response.status_code, 202)
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.status, "pending")
+        self.assertNotEqual(self.song.task_id, "dead-task")
+        queue_analysis.assert_called_once()
+
+
+@mock.patch("songs.creation.queue_analysis")
+@mock.patch(
+    "songs.views.LyricsService.check_song_exists", return_value=(True, "Song exists")
+)
+class SongCreateTests(TestCase):
+    def setUp(self):
+        self.user = create_user("owner@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, artist="Queen", title="We Are the Champions"):
+        return self.client.post(
+            "/api/v1/songs/", {"artist": artist, "title": title}, format="json"
+        )
+
+    def test_create_queries(self, check_song_exists, queue_analysis):
+        # Song and track lookups, track get_or_create in a savepoint, song
+        # INSERT
+        with self.assertNumQueries(7):
+            response = self.post()
+        self.assertEqual(response.status_code, 201)
+        song = Song.objects.get()
+        self.assertEqual(song.status, "pending")
+        queue_analysis.assert_called_once_with(song)
+
+    def test_create_from_analyzed_track(self, check_song_exists, queue_analysis):
+        create_song(create_user("other@example.com"))
+        Track.objects.update(analyzed_at=timezone.now())
+        with self.assertNumQueries(3):
+            response = self.post(artist="queen ", title="we are the champions")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["data"]["status"], "completed")
+        check_song_exists.assert_not_called()
+        queue_analysis.assert_not_called()
+
+    def test_create_existing_song(self, check_song_exists, queue_analysis):
+        create_song(self.user)
+        with self.assertNumQueries(1):
+            response = self.post(artist="QUEEN", title="We are the Champions")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["message"], "Song already exists")
+
+    def test_create_unknown_song(self, check_song_exists, queue_analysis):
+        check_song_exists.return_value = (False, "No lyrics found for this song")
+        response = self.post()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Song.objects.exists())
+
+    def test_reanalyze_processing_song(self, check_song_exists, queue_analysis):
+        song = create_song(self.user, status="processing")
+        response = self.client.post(f"/api/v1/songs/{song.id}/reanalyze/")
+        self.assertEqual(response.status_code, 409)
+        check_song_exists.assert_not_called()
+        queue_analysis.assert_not_called()
+
+    def test_reanalyze_completed_song(self, check_song_exists, queue_analysis):
+        song = create_song(self.user, status="completed")
+        Track.objects.filter(id=song.track_id).update(
+            analyzed_at=timezone.now(), **Lyrics.objects.track_fields(LYRICS)
+        )
+        with mock.patch("songs.views.queue_analysis") as view_queue_analysis:
+            response = self.client.post(f"/api/v1/songs/{song.id}/reanalyze/")
+        self.assertEqual(response.status_code, 202)
+        song.refresh_from_db()
+        self.assertEqual(song.status, "pending")
+        view_queue_analysis.assert_called_once()
+
+
+@mock.patch(
+    "songs.views.LyricsService.check_song_exists", return_value=(True, "Song exists")
+)
+class SongBatchTests(TestCase):
+    def setUp(self):
+        self.user = create_user("owner@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, *songs):
+        return self.client.post(
+            "/api/v1/songs/batch/",
+            {"songs": [{"artist": artist, "title": title} for artist, title in songs]},
+            format="json",
+        )
+
+    def test_duplicate_digests_share_one_track(self, check_song_exists):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post(
+                ("Queen", "We Are the Champions"),
+                ("queen", "we are the champions!"),
+                ("Queen", "Bohemian Rhapsody"),
+            )
+        self.assertEqual(response.status_code, 201)
+        results = response.data["results"]
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["created", "duplicate", "created"],
+        )
+        self.assertEqual(results[1]["message"], "Duplicate of item 0")
+        self.assertEqual(Track.objects.count(), 2)
+        self.assertEqual(Song.objects.filter(created_by=self.user).count(), 2)
+        # One existence check per distinct song, and one task group
+        self.assertEqual(check_song_exists.call_count, 2)
+        self.assertEqual(len(callbacks), 2)
+
+    def test_concurrent_create_conflicts(self, check_song_exists):
+        for_songs = Track.objects.for_songs
+
+        def concurrent_create(pairs):
+            # Another request adds the song after the batch looked it up
+            create_song(self.user)
+            return for_songs(pairs)
+
+        with mock.patch.object(
+            Track.objects, "for_songs", side_effect=concurrent_create
+        ):
+            response = self.post(("Queen", "We Are the Champions"))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Song.objects.count(), 1)
+
+
+class SongListTests(TestCase):
+    def setUp(self):
+        self.staff = create_user("staff@example.com", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def add_songs(self, owners, songs_per_owner):
+        for index in range(owners):
+            owner = create_user(f"owner{User.objects.count()}@example.com")
+            for number in range(songs_per_owner):
+                create_song(owner, title=f"Song {index}-{number}")
+
+    def assertListQueries(self, path, fields):
+        # One query for the page, joining owners and tracks, however many
+        # owners and songs it shows
+        for owners, songs_per_owner in ((1, 1), (4, 3), (12, 2)):
+            self.add_songs(owners, songs_per_owner)
+            with self.assertNumQueries(1):
+                response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.data["results"])
+            self.assertEqual(set(response.data["results"][0]), fields)
+
+    def test_staff_list_queries(self):
+        self.assertListQueries(
+            "/api/v1/songs/",
+            {
+                "id",
+                "artist",
+                "title",
+                "status",
+                "message",
+                "summary",
+                "countries",
+                "created",
+                "modified",
+                "created_by",
+            },
+        )
+
+    def test_sparse_list_queries(self):
+        self.assertListQueries(
+            "/api/v1/songs/?fields=id,title,createdBy", {"id", "title", "created_by"}
+        )
+        self.assertListQueries("/api/v1/songs/?fields=id,summary", {"id", "summary"})
+
+
+class SongStatusChangesTests(SimpleTestCase):
+    def test_invalid_timeouts(self):
+        token = AccessToken()
+        token["user_id"] = "1"
+        for timeout in ("soon", "nan", "inf", "-inf", "-1"):
+            with self.subTest(timeout=timeout):
+                response = self.client.get(
+                    "/api/v1/songs/status-changes/",
+                    {"cursor": "1-0", "timeout": timeout},
+                    headers={"Authorization": f"Bearer {token}"},
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"detail": "Invalid timeout."})
+
+
+@skipUnless(connection.vendor == "postgresql", "Indexes are planned on Postgres")
+class SongIndexTests(TestCase):
+    def explain(self, queryset):
+        # Any index the planner can use beats a scan once scans are off
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("ANALYZE songs_song")
+        return queryset.explain()
+
+    def test_owner_lookup_uses_case_insensitive_index(self):
+        user = create_user("owner@example.com")
+        for number in range(50):
+            create_song(user, title=f"Song {number}")
+        plan = self.explain(
+            Song.objects.filter(
+                created_by=user, artist__iexact="QUEEN", title__iexact="song 7"
+            )
+        )
+        self.assertIn("song_owner_artist_title_ci_idx", plan)
+
+    def test_pending_claim_uses_unfinished_index(self):
+        user = create_user("owner@example.com")
+        for number in range(50):
+            create_song(user, title=f"Song {number}", status="completed")
+        create_song(user, title="Pending")
+        plan = self.explain(
+            Song.objects.filter(status="pending").order_by("created").values("id")[:10]
+        )
+        self.assertIn("song_unfinished_status_idx", plan)
+
+    def test_deep_cursor_seeks_created_index(self):
+        user = create_user("owner@example.com")
+        for number in range(200):
+            create_song(user, title=f"Song {number}")
+        position = Song.objects.order_by("-created", "id").values("created", "id")[150]
+        pagination = KeysetPagination()
+        pagination.ordering = ["-created", "id"]
+        # A page is a few rows of a big table, which the planner reads in
+        # index order; with this test's few rows it would rather sort them
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_sort = off")
+        plan = self.explain(
+            Song.objects.order_by(*pagination.ordering).filter(
+                pagination.seek(position, reverse=False)
+            )[:11]
+        )
+        self.assertRegex(
+            plan,
+            r"Index Scan using song_created_id_idx[^\n]*\n\s+Index Cond: \(created <=",
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "Search ranks on Postgres")
+class SongSearchTests(TestCase):
+    def setUp(self):
+        self.user = create_user("owner@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_song(self, artist, title, summary):
+        song = create_song(self.user, artist=artist, title=title, status="completed")
+        Track.objects.filter(id=song.track_id).store(summary=summary)
+        return song
+
+    def search(self, terms):
+        response = self.client.get("/api/v1/songs/", {"search": terms})
+        self.assertEqual(response.status_code, 200)
+        return [Song.objects.get(id=song["id"]) for song in response.data["results"]]
+
+    def test_search_ranks_matches(self):
+        title_match = self.add_song(
+            "Queen", "We Are the Champions", "Champions celebrate a victory."
+        )
+        summary_match = self.add_song("Freddie", "Anthem", "A song for champions.")
+        self.add_song("Abba", "Waterloo", "A battle lost at Waterloo.")
+        # Trigram similarity on the title ranks above the summary's rank alone
+        self.assertEqual(self.search("champions"), [title_match, summary_match])
+
+    def test_search_matches_typos(self):
+        song = self.add_song("Queen", "Bohemian Rhapsody", "A mock opera.")
+        self.add_song("Abba", "Waterloo", "A battle lost at Waterloo.")
+        self.assertEqual(self.search("Quen"), [song])
+        self.assertEqual(self.search("rhapsodie"), [song])
+
+    def test_search_web_query_on_summary(self):
+        victory = self.add_song("Queen", "Anthem", "A victory at the stadium.")
+        defeat = self.add_song("Abba", "Waterloo", "A victory and a defeat.")
+        self.assertEqual(set(self.search("victory")), {victory, defeat})
+        self.assertEqual(self.search("victory -defeat"), [victory])
+        self.assertEqual(self.search('"victory at the stadium"'), [victory])
+
+
+class CountryCountTests(TestCase):
+    def add_song(self, user, title, countries, status="completed"):
+        song = create_song(user, title=title, status=status)
+        Track.objects.filter(id=song.track_id).update(countries=countries)
+        return song
+
+    def test_refresh_counts_completed_songs(self):
+        first = create_user("first@example.com")
+        second = create_user("second@example.com")
+        self.add_song(first, "Nordic", ["Norway", "Sweden", "Norway"])
+        self.add_song(first, "Fjord", ["Norway"])
+        self.add_song(first, "Unfinished", ["Norway"], status="pending")
+        self.add_song(first, "Nowhere", [])
+        self.add_song(second, "Fjord", ["Norway"])
+        CountryCount.objects.create(
+            country="Atlantis", songs=1, refreshed_at=timezone.now()
+        )
+
+        self.assertEqual(CountryCount.objects.refresh(), 5)
+        self.assertEqual(
+            set(CountryCount.objects.values_list("user", "country", "songs")),
+            {
+                (first.id, "Norway", 2),
+                (first.id, "Sweden", 1),
+                (second.id, "Norway", 1),
+                (None, "Norway", 3),
+                (None, "Sweden", 1),
+            },
+        )
+
+    @skipUnless(connection.vendor == "postgresql", "Containment is on Postgres")
+    def test_country_filter(self):
+        user = create_user("owner@example.com")
+        nordic = self.add_song(user, "Nordic", ["Norway", "Sweden"])
+        self.add_song(user, "Alpine", ["Switzerland"])
+        self.add_song(user, "Nowhere", [])
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get("/api/v1/songs/", {"country": "Norway"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [song["id"] for song in response.data["results"]], [str(nordic.id)]
+        )
+
+
+class DenyThrottle(BaseThrottle):
+    def allow_request(self, request, view):
+        return False
+
+    def wait(self):
+        return 30
+
+
+@override_settings(SONG_CREATE_MODE="async", ROOT_URLCONF="core.asgi_urls")
+class AsyncSongCreateTests(TestCase):
+    body = {"artist": "Queen", "title": "We Are the Champions"}
+
+    def test_routes(self):
+        # Only requests served under ASGI resolve to the async view
+        self.assertIs(resolve("/api/v1/songs/").func, song_collection)
+        self.assertIs(
+            resolve("/api/v1/songs/", urlconf="core.urls").func.cls, SongViewSet
+        )
+
+    async def test_unauthenticated(self):
+        response = await self.async_client.post(
+            "/api/v1/songs/", self.body, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(
+            response.json(), {"detail": "Authentication credentials were not provided."}
+        )
+        self.assertEqual(await Song.objects.acount(), 0)
+
+    @mock.patch.object(SongViewSet, "throttle_classes", [DenyThrottle])
+    async def test_throttled(self):
+        user = await sync_to_async(create_user)("owner@example.com")
+        token = await sync_to_async(AccessToken.for_user)(user)
+        response = await self.async_client.post(
+            "/api/v1/songs/",
+            self.body,
+            content_type="application/json",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertEqual(await Song.objects.acount(), 0)
+
+
+class SongCreateRaceTests(TransactionTestCase):
+    """
+    A create that loses the race to insert the same song is answered as a
+    duplicate. Transactional, as the losing INSERT aborts the transaction
+    it runs in.
+    """
+
+    def setUp(self):
+        self.user = create_user("owner@example.com")
+        self.body = {"artist": "Queen", "title": "We Are the Champions"}
+
+    def concurrent_create(self, *args):
+        # Another request adds the song while this one checks Musixmatch
+        create_song(self.user, artist="queen", title="we are the champions")
+        return True, "Song exists"
+
+    @mock.patch("songs.creation.queue_analysis")
+    def test_sync_create_retries_integrity_error(self, queue_analysis):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch(
+            "songs.views.LyricsService.check_song_exists",
+            side_effect=self.concurrent_create,
+        ) as check_song_exists:
+            response = client.post("/api/v1/songs/", self.body, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["message"], "Song already exists")
+        self.assertEqual(Song.objects.count(), 1)
+        check_song_exists.assert_called_once()
+        queue_analysis.assert_not_called()
+
+    @override_settings(SONG_CREATE_MODE="async", ROOT_URLCONF="core.asgi_urls")
+    @mock.patch("songs.creation.queue_analysis")
+    async def test_async_create_retries_integrity_error(self, queue_analysis):
+        async def concurrent_create(*args):
+            return await sync_to_async(self.concurrent_create)(*args)
+
+        token = await sync_to_async(AccessToken.for_user)(self.user)
+        with mock.patch(
+            "songs.async_views.AsyncLyricsService.check_song_exists",
+            side_effect=concurrent_create,
+        ):
+            response = await self.async_client.post(
+                "/api/v1/songs/",
+                self.body,
+                content_type="application/json",
+                headers={"Authorization": f"Bearer {token}"},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["message"], "Song already exists")
+        self.assertEqual(await Song.objects.acount(), 1)
+        queue_analysis.assert_not_called()
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        self.redis = get_redis_connection("default")
+        self.clear()
+        self.addCleanup(self.clear)
+
+    def clear(self):
+        self.redis.delete(
+            *(
+                rate_limits._key(rate_limits.OPENAI, name)
+                for name in ("blocked", "slots", "state", "requests", "tokens")
+            )
+        )
+
+    def take(self):
+        slot, wait = rate_limits.try_acquire(rate_limits.OPENAI)
+        self.assertIsNotNone(slot)
+        self.assertEqual(wait, 0)
+        return slot
+
+    def limit(self):
+        return float(
+            self.redis.hget(rate_limits._key(rate_limits.OPENAI, "state"), "limit")
+        )
+
+    @override_settings(OPENAI_RATE_LIMIT_RPM=2, OPENAI_RATE_LIMIT_TPM=0)
+    def test_bucket_take_and_refill(self):
+        for _ in range(2):
+            rate_limits.release(rate_limits.OPENAI, self.take(), False, 0)
+        slot, wait = rate_limits.try_acquire(rate_limits.OPENAI)
+        self.assertIsNone(slot)
+        # The bucket refills one request every 30 seconds
+        self.assertGreater(wait, 29)
+        self.assertLessEqual(wait, 30)
+
+        self.redis.hincrby(
+            rate_limits._key(rate_limits.OPENAI, "requests"), "ts", -30000
+        )
+        self.take()
+
+    @override_settings(UPSTREAM_CONCURRENCY_INITIAL=4)
+    def test_concurrency_decrease_and_recovery(self):
+        first, second = self.take(), self.take()
+        rate_limits.release(rate_limits.OPENAI, first, True, 0)
+        self.assertEqual(self.limit(), 2)
+        # The 429s of requests already in flight halve the limit once
+        rate_limits.release(rate_limits.OPENAI, second, True, 0)
+        self.assertEqual(self.limit(), 2)
+
+        slots = [self.take(), self.take()]
+        self.assertEqual(
+            rate_limits.try_acquire(rate_limits.OPENAI),
+            (None, rate_limits.SLOT_POLL_INTERVAL),
+        )
+        # Each request that goes through adds 1/limit
+        for slot in slots:
+            rate_limits.release(rate_limits.OPENAI, slot, False, 0)
+        self.assertAlmostEqual(self.limit(), 2 + 1 / 2 + 1 / 2.5)
+
+    @mock.patch(
+        "songs.tasks.LyricsService.fetch_lyrics",
+        return_value=(True, "Lyrics fetched successfully", "Rate limited lyrics"),
+    )
+    def test_429_requeues_song(self, fetch_lyrics):
+        song = create_song(create_user("owner@example.com"))
+        response = httpx.Response(
+            429,
+            headers={"retry-after": "30"},
+            request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"),
+        )
+        with mock.patch("songs.services.client") as client, mock.patch.object(
+            analyze_song_task, "retry", side_effect=RuntimeError("retried")
+        ) as retry:
+            client.chat.completions.with_raw_response.create.side_effect = (
+                RateLimitError("Rate limit reached", response=response, body=None)
+            )
+            analyze_song_task.apply((song.id,), task_id="this-task")
+
+        retry.assert_called_once()
+        countdown = retry.call_args.kwargs["countdown"]
+        self.assertGreaterEqual(countdown, 30)
+        self.assertLessEqual(countdown, 30 * (1 + rate_limits.REQUEUE_JITTER))
+        song.refresh_from_db()
+        self.assertEqual(song.status, "processing")
+        self.assertEqual(
+            song.message, rate_limits.waiting_message(rate_limits.OPENAI, countdown)
+        )
+        # Every worker holds off OpenAI until the limit resets
+        blocked_ms = self.redis.pttl(rate_limits._key(rate_limits.OPENAI, "blocked"))
+        self.assertGreater(blocked_ms, 29000)
+        self.assertEqual(self.limit(), settings.UPSTREAM_CONCURRENCY_INITIAL / 2)
+
+
+class ReanalyzeSongsCommandTests(TestCase):
+    def setUp(self):
+        self.user = create_user("owner@example.com")
+        self.songs = [
+            create_song(self.user, title=title, status="completed")
+            for title in ("One Vision", "Radio Ga Ga", "Under Pressure")
+        ]
+        for n, song in enumerate(self.songs):
+            Track.objects.filter(id=song.track_id).update(
+                **Lyrics.objects.track_fields(f"{LYRICS} {n}")
+            )
+        batch_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(batch_dir.cleanup)
+        self.batch_dir = Path(batch_dir.name)
+        self.enterContext(override_settings(ANALYSIS_BATCH_DIR=batch_dir.name))
+
+    def reanalyze(self, *args):
+        call_command(
+            "reanalyze_songs",
+            "--backend=songs.batch_backends.LocalBatchBackend",
+            "--chunk-size=1",
+            *args,
+            stdout=io.StringIO(),
+        )
+
+    def test_skips_unfinished_songs(self):
+        processing = create_song(
+            create_user("other@example.com"),
+            title="One Vision",
+            status="processing",
+        )
+        self.reanalyze()
+        processing.refresh_from_db()
+        self.assertEqual(processing.status, "processing")
+        for song in self.songs:
+            song.refresh_from_db()
+            self.assertEqual(song.status, "completed")
+            self.assertEqual(song.track.summary, "Locally analyzed song.")
+
+    def test_resume_skips_applied_lines(self):
+        save_tracks = Command.save_tracks
+        saved = []
+
+        def fail_second_chunk(command, tracks):
+            if len(saved) == 1:
+                raise RuntimeError("Interrupted")
+            saved.append([str(track.id) for track in tracks])
+            save_tracks(command, tracks)
+
+        with mock.patch.object(
+            Command, "save_tracks", autospec=True, side_effect=fail_second_chunk
+        ):
+            with self.assertRaises(RuntimeError):
+                self.reanalyze()
+            (job_dir,) = (
+                path for path in self.batch_dir.iterdir() if path.name != "local"
+            )
+            (part,) = json.loads((job_dir / "checkpoint.json").read_text())["parts"]
+            self.assertEqual(part["applied_lines"], 1)
+
+            saved.append("resumed")
+            self.reanalyze(f"--job={job_dir.name}")
+
+        track_ids = sorted(str(song.track_id) for song in self.songs)
+        self.assertEqual(
+            saved, [track_ids[:1], "resumed", track_ids[1:2], track_ids[2:]]
+        )
+        self.assertEqual(
+            Track.objects.filter(summary="Locally analyzed song.").count(), 3
+        )
+
+
+class AnalysisBatchTests(SimpleTestCase):
+    def setUp(self):
+        for target, value in (
+            ("songs.services.song_cache", mock.Mock(**{"get.return_value": None})),
+            ("songs.services.UpstreamCall", mock.MagicMock()),
+            ("songs.services.client", mock.Mock()),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.create = services.client.chat.completions.with_raw_response.create
+        self.create.side_effect = self.reply
+
+    def reply(self, **request):
+        # The first line of each song section holds its ID
+        ids = [
+            section.split("\n", 1)[0]
+            for section in request["messages"][1]["content"].split("### Song ")[1:]
+        ]
+        raw = mock.MagicMock()
+        raw.parse.return_value.choices[0].message.content = json.dumps(
+            {item_id: {"summary": ANALYSIS["summary"]} for item_id in ids}
+        )
+        return raw
+
+    def test_full_batch_fits_output_limit(self):
+        lyrics_by_id = {
+            str(n): f"{LYRICS} {n}" for n in range(settings.OPENAI_BATCH_MAX_ITEMS)
+        }
+        call = services.UpstreamCall.return_value.__enter__.return_value
+        call.call_openai.side_effect = lambda create, request: create(**request).parse()
+
+        results = services.AnalysisService.analyze_lyrics_batch(lyrics_by_id)
+
+        self.assertTrue(all(success for success, _, _ in results.values()))
+        self.assertEqual(len(results), settings.OPENAI_BATCH_MAX_ITEMS)
+        per_batch = settings.OPENAI_MAX_OUTPUT_TOKENS // settings.OPENAI_MAX_TOKENS
+        self.assertEqual(
+            self.create.call_count, -(-settings.OPENAI_BATCH_MAX_ITEMS // per_batch)
+        )
+        for request in self.create.call_args_list:
+            self.assertLessEqual(
+                request.kwargs["max_tokens"], settings.OPENAI_MAX_OUTPUT_TOKENS
+            )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    SINGLE_FLIGHT_POLL_INTERVAL=0,
+)
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.redis = mock.Mock()
+        patcher = mock.patch(
+            "songs.services.get_redis_connection", return_value=self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_leader_computes_once(self):
+        self.redis.set.return_value = True
+        compute = mock.Mock(return_value={"lyrics": LYRICS})
+        for _ in range(2):
+            self.assertEqual(
+                services.single_flight("key", compute, lock_ttl=5), {"lyrics": LYRICS}
+            )
+        # The second call shares the result the first one published
+        compute.assert_called_once()
+        self.redis.set.assert_called_once()
+        self.redis.eval.assert_called_once()
+
+    def test_follower_reuses_result(self):
+        # Another caller holds the lock and publishes its result meanwhile
+        self.redis.set.return_value = False
+
+        def exists(lock_key):
+            cache.set("singleflight_result_key", {"lyrics": LYRICS})
+            return False
+
+        self.redis.exists.side_effect = exists
+        compute = mock.Mock()
+        self.assertEqual(
+            services.single_flight("key", compute, lock_ttl=5), {"lyrics": LYRICS}
+        )
+        compute.assert_not_called()
+
+    def test_leader_error_is_raised_once(self):
+        self.redis.set.return_value = True
+        compute = mock.Mock(side_effect=UpstreamRateLimited("openai", 30))
+        with self.assertRaises(UpstreamRateLimited):
+            services.single_flight("key", compute, lock_ttl=5)
+        compute.assert_called_once()
+        self.redis.eval.assert_called_once()
+
+    def test_timed_out_error_is_raised_once(self):
+        self.redis.set.return_value = False
+        self.redis.exists.return_value = True
+        compute = mock.Mock(side_effect=UpstreamRateLimited("openai", 30))
+        with self.assertRaises(UpstreamRateLimited):
+            services.single_flight("key", compute, lock_ttl=0)
+        compute.assert_called_once()
+
+    def test_redis_failure_computes_once(self):
+        self.redis.set.side_effect = ConnectionError("Redis is down")
+        compute = mock.Mock(return_value={"lyrics": LYRICS})
+        self.assertEqual(
+            services.single_flight("key", compute, lock_ttl=5), {"lyrics": LYRICS}
+        )
+        compute.assert_called_once()
+
+    def test_async_timed_out_error_is_raised_once(self):
+        redis = mock.Mock(
+            set=mock.AsyncMock(return_value=False),
+            exists=mock.AsyncMock(return_value=True),
+        )
+        compute = mock.AsyncMock(side_effect=UpstreamRateLimited("openai", 30))
+        with mock.patch("songs.async_services.get_async_redis", return_value=redis):
+            with self.assertRaises(UpstreamRateLimited):
+                asyncio.run(async_services.single_flight("key", compute, lock_ttl=0))
+        compute.assert_awaited_once()
@@ -1,14 +1,43 @@
-from django.core.cache import cache
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from celery import group
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
+from djangorestframework_camel_case.util import camel_to_underscore
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.filters import SearchFilter
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+
+from core.search import SearchBackend
 
-from .models import Song
-from .serializers import SongDetailSerializer, SongSerializer
+from . import (
+    async_worker,
+    cache_keys,
+    creation,
+    events,
+    metrics,
+    status_records,
+    streams,
+)
+from .cache import song_cache
+from .filters import SongFilter
+from .models import CountryCount, Song, Track
+from .serializers import (
+    CountryCountSerializer,
+    SongBatchSerializer,
+    SongDetailSerializer,
+    SongSerializer,
+)
 from .services import LyricsService
-from .tasks import analyze_song_task
+from .tasks import analysis_chain, new_task_id, queue_analysis
+
+User = get_user_model()
 
 
 class IsCreatorOrAdmin(permissions.BasePermission):
@@ -27,9 +56,11 @@ class SongViewSet(viewsets.ModelViewSet):
 
     queryset = Song.objects.all()
     serializer_class = SongSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter]
+    filter_backends = [DjangoFilterBackend, SearchBackend]
     search_fields = ["artist", "title"]
-    filterset_fields = ["artist", "title", "status"]
+    # Summaries and lyrics, shared through the track
+    search_vector = "track__search_vector"
+    filterset_class = SongFilter
     permission_classes = [permissions.IsAuthenticated, IsCreatorOrAdmin]
 
     def get_queryset(self):
@@ -38,48 +69,215 @@ class SongViewSet(viewsets.ModelViewSet):
         or only user's songs for regular users
         """
         user = self.request.user
+        if self.action == "list":
+            songs = SongSerializer.select_columns(Song.objects, self.sparse_fields())
+        else:
+            # Lyrics are only read one song at a time
+            songs = Song.objects.select_related("created_by", "track__lyrics")
         if user.is_staff:
-            return Song.objects.all()
-        return Song.objects.filter(created_by=user)
+            return songs
+        return songs.filter(created_by=user)
+
+    def sparse_fields(self):
+        """
+        Field names of the comma separated `fields` query parameter of a
+        list, e.g. `?fields=id,title,createdBy`; None for all fields
+        """
+        fields = self.request.query_params.get("fields")
+        if self.action != "list" or not fields:
+            return None
+        return {camel_to_underscore(name.strip()) for name in fields.split(",")}
+
+    def get_serializer_context(self):
+        return {
+            **super().get_serializer_context(),
+            "sparse_fields": self.sparse_fields(),
+        }
 
     def get_serializer_class(self):
         if self.action in ["retrieve", "update", "partial_update"]:
             return SongDetailSerializer
         return SongSerializer
 
+    def perform_destroy(self, instance):
+        song_id = instance.id
+        instance.delete()
+        # The status endpoints would otherwise keep answering for it
+        status_records.delete(song_id)
+
     def create(self, request, *args, **kwargs):
-        """Create a new song and queue it for analysis"""
+        """
+        Create a new song and queue it for analysis. With SONG_CREATE_MODE
+        "async", songs.async_views.song_create serves this instead.
+        """
+        with metrics.concurrency("songs.create"):
+            try:
+                return self.create_song(request)
+            except IntegrityError:
+                # A concurrent request added the same song; this time it is
+                # found by the duplicate check
+                return self.create_song(request)
+
+    def create_song(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        artist = serializer.validated_data["artist"]
-        title = serializer.validated_data["title"]
-        existing_song = Song.objects.filter(
-            artist__iexact=artist, title__iexact=title, created_by=request.user
-        ).first()
+        outcome, track = creation.find_song(serializer, request.user)
+        if outcome is None and settings.SONG_CREATE_MODE != "optimistic":
+            outcome = creation.check_failed(
+                *LyricsService.check_song_exists(
+                    serializer.validated_data["artist"],
+                    serializer.validated_data["title"],
+                )
+            )
+        if outcome is None:
+            outcome = creation.queue_song(serializer, request.user, track)
+        data, status_code = outcome
+        return Response(data, status=status_code)
 
-        if existing_song:
-            return Response(
-                {
+    @action(detail=False, methods=["post"])
+    def batch(self, request):
+        """
+        Create many songs at once and queue them for analysis.
+
+        Each phase runs once for the whole batch: one query each for the
+        user's songs and the analyzed tracks, concurrent existence checks,
+        one bulk insert and one group of tasks. Songs whose track is already
+        analyzed are created completed, without an existence check or a task.
+        """
+        serializer = SongBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data["songs"]
+
+        results = [None] * len(items)
+        first_index = {}
+        for index, item in enumerate(items):
+            key = cache_keys.song_digest(item["artist"], item["title"])
+            if key in first_index:
+                results[index] = {
+                    **item,
+                    "status": "duplicate",
+                    "message": f"Duplicate of item {first_index[key]}",
+                }
+            else:
+                first_index[key] = index
+
+        own_songs = {
+            song.track.key: song
+            for song in Song.objects.select_related("created_by", "track").filter(
+                created_by=request.user, track__key__in=first_index
+            )
+        }
+        analyzed = set(
+            Track.objects.filter(
+                key__in=first_index, analyzed_at__isnull=False
+            ).values_list("key", flat=True)
+        )
+
+        to_check = []
+        to_create = []
+        for key, index in first_index.items():
+            if key in own_songs:
+                results[index] = {
+                    **items[index],
+                    "status": "exists",
                     "message": "Song already exists",
-                    "data": SongDetailSerializer(existing_song).data,
-                },
-                status=status.HTTP_200_OK,
+                    "data": SongSerializer(own_songs[key]).data,
+                }
+            elif key in analyzed:
+                to_create.append(index)
+            else:
+                to_check.append(index)
+
+        with ThreadPoolExecutor(
+            max_workers=settings.SONG_BATCH_CHECK_CONCURRENCY
+        ) as executor:
+            checks = executor.map(
+                lambda index: LyricsService.check_song_exists(
+                    items[index]["artist"], items[index]["title"]
+                ),
+                to_check,
             )
-        song_exists, error_message = LyricsService.check_song_exists(artist, title)
-        if not song_exists:
+            for index, (song_exists, error_message) in zip(to_check, checks):
+                if song_exists:
+                    to_create.append(index)
+                else:
+                    results[index] = {
+                        **items[index],
+                        "status": "error",
+                        "message": f"Cannot analyze song: {error_message}",
+                    }
+
+        tracks = Track.objects.for_songs(
+            (items[index]["artist"], items[index]["title"]) for index in to_create
+        )
+        songs = []
+        for index in to_create:
+            track = tracks[
+                cache_keys.song_digest(items[index]["artist"], items[index]["title"])
+            ]
+            songs.append(
+                Song(
+                    artist=items[index]["artist"],
+                    title=items[index]["title"],
+                    track=track,
+                    status="completed" if track.is_analyzed else "pending",
+                    created_by=request.user,
+                )
+            )
+        pending = [song for song in songs if song.status == "pending"]
+        chains = []
+        if settings.ANALYSIS_WORKER == "celery":
+            for song in pending:
+                # Freezing assigns the task IDs before the chains are sent
+                chains.append(analysis_chain(song))
+                song.task_id = chains[-1].freeze().id
+        try:
+            with transaction.atomic():
+                Song.objects.bulk_create(songs)
+                transaction.on_commit(lambda: status_records.publish(*songs))
+                if settings.ANALYSIS_WORKER == "async":
+                    transaction.on_commit(async_worker.notify)
+                elif chains:
+                    transaction.on_commit(group(chains).apply_async)
+        except IntegrityError:
             return Response(
-                {"message": f"Cannot analyze song: {error_message}", "success": False},
-                status=status.HTTP_400_BAD_REQUEST,
+                {
+                    "message": "Some songs were created concurrently, please retry",
+                    "success": False,
+                },
+                status=status.HTTP_409_CONFLICT,
             )
-        song = serializer.save(status="pending", created_by=request.user)
-        task = analyze_song_task.delay(str(song.id))
-        song.task_id = task.id
-        song.save(update_fields=["task_id"])
+
+        for index, song in zip(to_create, songs):
+            results[index] = {
+                **items[index],
+                "status": "created",
+                "message": (
+                    "Song created and queued for analysis"
+                    if song.status == "pending"
+                    else "Song created from an existing analysis"
+                ),
+                "data": SongSerializer(song).data,
+            }
 
         return Response(
             {
-                "message": "Song created and queued for analysis",
-                "data": SongDetailSerializer(song).data,
+                "message": f"{len(pending)} of {len(items)} songs queued for analysis",
+                "results": results,
+            },
+            status=status.HTTP_201_CREATED if songs else status.HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=["post"], url_path="stream-ticket")
+    def stream_ticket(self, request):
+        """
+        Issue a short-lived ticket for the `ticket` query parameter of the
+        event stream endpoints, which EventSource cannot send headers to
+        """
+        return Response(
+            {
+                "ticket": streams.issue_ticket(request.user.id),
+                "expires_in": settings.SONG_STREAM_TICKET_TTL,
             },
             status=status.HTTP_201_CREATED,
         )
@@ -88,6 +286,19 @@ class SongViewSet(viewsets.ModelViewSet):
     def reanalyze(self, request, pk=None):
         """Re-analyze an existing song"""
         song = self.get_object()
+        if song.is_claimed:
+            return self.analysis_conflict()
+        song_cache.delete_many(
+            [
+                cache_keys.exists_key(song.artist, song.title),
+                cache_keys.lyrics_key(song.artist, song.title),
+                cache_keys.analysis_key(
+                    song.track.lyrics.text if song.track.lyrics else None
+                ),
+            ]
+        )
+
+        # The check refreshes the lyrics cache, so the task reuses its payload.
         song_exists, error_message = LyricsService.check_song_exists(
             song.artist, song.title
         )
@@ -100,16 +311,28 @@ class SongViewSet(viewsets.ModelViewSet):
                 },
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        cache_key_lyrics = f"lyrics_{song.artist.lower()}_{song.title.lower()}"
-        cache_key_analysis = f"analysis_{hash(song.lyrics if song.lyrics else '')}"
-        cache.delete(cache_key_lyrics)
-        cache.delete(cache_key_analysis)
+        # A song being analyzed is held by its worker until it finishes, or
+        # until its claim goes stale
+        task_id = new_task_id()
+        if not Song.objects.filter(id=song.id).transition(
+            ("pending", "completed", "error"),
+            retake_stale=True,
+            status="pending",
+            message="",
+            task_id=task_id,
+        ):
+            return self.analysis_conflict()
         song.status = "pending"
         song.message = ""
-        song.save(update_fields=["status", "message"])
-        task = analyze_song_task.delay(str(song.id))
-        song.task_id = task.id
-        song.save(update_fields=["task_id"])
+        song.task_id = task_id
+        # The track keeps serving its analysis to other users until the new
+        # one replaces it, but songs added meanwhile are analyzed afresh
+        Track.objects.filter(id=song.track_id).update(
+            analyzed_at=None, modified=timezone.now()
+        )
+        events.reset(song.id)
+        status_records.publish(song)
+        queue_analysis(song)
 
         return Response(
             {
@@ -119,26 +342,151 @@ class SongViewSet(viewsets.ModelViewSet):
             status=status.HTTP_202_ACCEPTED,
         )
 
-    @action(detail=True, methods=["get"])
-    def status(self, request, pk=None):
-        """Get the current analysis status of a song"""
-        song = self.get_object()
+    @staticmethod
+    def analysis_conflict():
+        return Response(
+            {"message": "Song is already being analyzed", "success": False},
+            status=status.HTTP_409_CONFLICT,
+        )
+
+    @staticmethod
+    def status_payload(record):
+        """Body and HTTP status of the status endpoint for a status record"""
         response_data = {
-            "status": song.status,
+            "status": record["status"],
+            "version": record["version"],
         }
 
-        if song.status == "completed":
+        if record["status"] == "completed":
             response_data["message"] = "Analysis completed successfully"
-            return Response(response_data, status=status.HTTP_200_OK)
-        elif song.status == "processing":
+            return response_data, status.HTTP_200_OK
+        elif record["status"] == "processing":
             response_data["message"] = "Song is being processed"
-            return Response(response_data, status=status.HTTP_202_ACCEPTED)
-        elif song.status == "pending":
+            return response_data, status.HTTP_202_ACCEPTED
+        elif record["status"] == "pending":
             response_data["message"] = "Song is queued for analysis"
-            return Response(response_data, status=status.HTTP_202_ACCEPTED)
-        elif song.status == "error":
-            response_data["message"] = song.message
-            return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
+            return response_data, status.HTTP_202_ACCEPTED
+        elif record["status"] == "error":
+            response_data["message"] = record["message"]
+            return response_data, status.HTTP_400_BAD_REQUEST
         else:
             response_data["message"] = "Unknown status"
-            return Response(response_data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return response_data, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    def read_status_records(self, song_ids):
+        """
+        Status records of the given songs that the user may see. Records are
+        read from Redis; only misses and songs of other users, which only
+        admins may see, reach the database.
+        """
+        user = self.request.user
+        records = status_records.read_many(song_ids)
+
+        misses = [song_id for song_id, record in records.items() if record is None]
+        if misses:
+            songs = list(
+                Song.objects.filter(id__in=misses).values(
+                    "id", "status", "message", "created_by_id"
+                )
+            )
+            status_records.backfill(songs)
+            for song in songs:
+                records[str(song["id"])] = {
+                    "status": song["status"],
+                    "message": song["message"] or "",
+                    "owner": str(song["created_by_id"]),
+                    "version": 0,
+                }
+
+        visible = {
+            song_id: record
+            for song_id, record in records.items()
+            if record is not None and record["owner"] == str(user.id)
+        }
+        if len(visible) < len(records) and self.is_admin(user):
+            visible = {
+                song_id: record
+                for song_id, record in records.items()
+                if record is not None
+            }
+        return visible
+
+    @staticmethod
+    def is_admin(user):
+        # Status actions authenticate from token claims only, so the staff
+        # flag is looked up when it matters
+        return User.objects.filter(pk=user.id, is_staff=True).exists()
+
+    @action(detail=False, methods=["get"])
+    def countries(self, request):
+        """
+        Countries mentioned by the user's completed songs, most mentioned
+        first, or by everyone's with `scope=global`. Counts are refreshed
+        every COUNTRY_COUNTS_REFRESH_INTERVAL seconds, see `refreshed`.
+        Filter songs with `?country=` for the songs behind a count.
+        """
+        scope = request.query_params.get("scope", "mine")
+        if scope not in ("mine", "global"):
+            raise ValidationError({"scope": "Expected mine or global."})
+        counts = list(
+            CountryCount.objects.filter(
+                user=request.user if scope == "mine" else None
+            ).order_by("-songs", "country")
+        )
+        return Response(
+            {
+                "scope": scope,
+                "refreshed": counts[0].refreshed_at if counts else None,
+                "results": CountryCountSerializer(counts, many=True).data,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @action(
+        detail=True,
+        methods=["get"],
+        authentication_classes=[JWTStatelessUserAuthentication],
+    )
+    def status(self, request, pk=None):
+        """Get the current analysis status of a song"""
+        try:
+            song_id = str(uuid.UUID(pk))
+        except ValueError:
+            raise NotFound()
+        record = self.read_status_records([song_id]).get(song_id)
+        if record is None:
+            raise NotFound()
+        response_data, response_status = self.status_payload(record)
+        return Response(response_data, status=response_status)
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="status",
+        authentication_classes=[JWTStatelessUserAuthentication],
+    )
+    def bulk_status(self, request):
+        """
+        Get the current analysis status of many songs, given as comma
+        separated IDs in the `ids` query parameter. Unknown IDs are left out.
+        """
+        try:
+            song_ids = list(
+                dict.fromkeys(
+                    str(uuid.UUID(song_id))
+                    for song_id in request.query_params.get("ids", "").split(",")
+                    if song_id
+                )
+            )
+        except ValueError:
+            raise ValidationError({"ids": "Expected comma separated song IDs."})
+        if len(song_ids) > settings.SONG_STATUS_BULK_MAX_IDS:
+            raise ValidationError(
+                {"ids": f"At most {settings.SONG_STATUS_BULK_MAX_IDS} IDs at once."}
+            )
+
+        results = []
+        for song_id, record in self.read_status_records(song_ids).items():
+            response_data, _ = self.status_payload(record)
+            results.append({"id": song_id, **response_data})
+        return Response({"results": results}, status=status.HTTP_200_OK)
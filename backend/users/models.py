@@ -1,5 +1,6 @@
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from model_utils.models import TimeStampedModel, UUIDModel
 
@@ -44,6 +45,16 @@ class User(AbstractUser, TimeStampedModel, UUIDModel):
     class Meta:
         verbose_name = "User"
         verbose_name_plural = "Users"
+        indexes = [
+            # Keyset pagination, see core.pagination.KeysetPagination
+            models.Index(fields=["-created", "id"], name="user_created_id_idx"),
+            # Fuzzy ?search=, see core.search
+            GinIndex(
+                fields=["email", "first_name", "last_name"],
+                opclasses=["gin_trgm_ops"] * 3,
+                name="user_name_trgm_idx",
+            ),
+        ]
 
     def get_short_name(self):
         return self.first_name
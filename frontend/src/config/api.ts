@@ -16,6 +16,10 @@ export const API_ROUTES = {
     base: `${BASE_PATH}/songs/`,
     byId: (id: string) => `${BASE_PATH}/songs/${id}/`,
     status: (id: string) => `${BASE_PATH}/songs/${id}/status/`,
+    events: (id: string) => `${BASE_PATH}/songs/${id}/events/`,
+    statusEvents: `${BASE_PATH}/songs/status-events/`,
+    statusChanges: `${BASE_PATH}/songs/status-changes/`,
+    streamTicket: `${BASE_PATH}/songs/stream-ticket/`,
     reanalyze: (id: string) => `${BASE_PATH}/songs/${id}/reanalyze/`,
   },
 };
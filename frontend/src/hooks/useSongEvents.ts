@@ -0,0 +1,105 @@
+import { API_ROUTES } from "@/config/api";
+import { SongResponse, songService } from "@/services/song";
+import { useEffect, useRef, useState } from "react";
+
+export type AnalysisStage =
+  | "fetching_lyrics"
+  | "analyzing"
+  | "completed"
+  | "error";
+
+interface UseSongEventsProps {
+  songId: string | null;
+  enabled?: boolean;
+  onSong?: (song: SongResponse) => void;
+}
+
+/**
+ * Follows the analysis of a song through its server-sent event stream:
+ * stage changes, the summary as it is written, then the finished song.
+ * `failed` turns true when the stream is unavailable so callers can fall
+ * back to polling the status endpoint.
+ */
+export function useSongEvents({
+  songId,
+  enabled = true,
+  onSong,
+}: UseSongEventsProps) {
+  const [stage, setStage] = useState<AnalysisStage | null>(null);
+  const [summary, setSummary] = useState("");
+  const [song, setSong] = useState<SongResponse | null>(null);
+  const [failed, setFailed] = useState(false);
+
+  const onSongRef = useRef(onSong);
+  onSongRef.current = onSong;
+
+  useEffect(() => {
+    if (!enabled || !songId) return;
+
+    setStage(null);
+    setSummary("");
+    setSong(null);
+    setFailed(false);
+
+    if (typeof EventSource === "undefined") {
+      setFailed(true);
+      return;
+    }
+
+    let stopped = false;
+    let source: EventSource | null = null;
+
+    const open = async () => {
+      let url: string;
+      try {
+        url = await songService.getStreamUrl(API_ROUTES.songs.events(songId));
+      } catch (error) {
+        console.error("Failed to get a song events ticket:", error);
+        setFailed(true);
+        return;
+      }
+      if (stopped) return;
+      const stream = new EventSource(url);
+      source = stream;
+      stream.addEventListener("snapshot", (event) => {
+        const data = JSON.parse(event.data);
+        setStage(data.stage || null);
+        setSummary(data.summary || "");
+      });
+      stream.addEventListener("stage", (event) => {
+        const data = JSON.parse(event.data);
+        setStage(data.data);
+        if (data.data === "fetching_lyrics" || data.data === "analyzing") {
+          setSummary("");
+        }
+      });
+      stream.addEventListener("delta", (event) => {
+        const data = JSON.parse(event.data);
+        setSummary((previous) => previous + data.data);
+      });
+      stream.addEventListener("song", (event) => {
+        const data: SongResponse = JSON.parse(event.data);
+        stream.close();
+        setSong(data);
+        if (onSongRef.current) onSongRef.current(data);
+      });
+      stream.addEventListener("stream_error", () => {
+        stream.close();
+        setFailed(true);
+      });
+      stream.onerror = () => {
+        // Network errors reconnect on their own, while the ticket is valid;
+        // HTTP errors close the stream
+        if (stream.readyState === EventSource.CLOSED) setFailed(true);
+      };
+    };
+    open();
+
+    return () => {
+      stopped = true;
+      source?.close();
+    };
+  }, [songId, enabled]);
+
+  return { stage, summary, song, failed };
+}
@@ -0,0 +1,111 @@
+import { API_ROUTES } from "@/config/api";
+import axiosInstance from "@/lib/axios";
+import { SongStatusResponse, songService } from "@/services/song";
+import { useEffect, useRef, useState } from "react";
+
+export interface SongStatusChange extends SongStatusResponse {
+  songId: string;
+}
+
+interface UseSongStatusEventsProps {
+  onChange: (change: SongStatusChange) => void;
+  enabled?: boolean;
+}
+
+/**
+ * Subscribes to the status changes of all the user's songs over a single
+ * server-sent event stream, falling back to long polling when the stream
+ * cannot be opened. `connected` tells whether changes are being received.
+ */
+export function useSongStatusEvents({
+  onChange,
+  enabled = true,
+}: UseSongStatusEventsProps) {
+  const [connected, setConnected] = useState(false);
+
+  const onChangeRef = useRef(onChange);
+  onChangeRef.current = onChange;
+
+  useEffect(() => {
+    if (!enabled) return;
+
+    let stopped = false;
+    let source: EventSource | null = null;
+
+    const longPoll = async () => {
+      let cursor = "";
+      while (!stopped) {
+        try {
+          const response = await axiosInstance.get(
+            API_ROUTES.songs.statusChanges,
+            { params: cursor ? { cursor } : {} }
+          );
+          setConnected(true);
+          cursor = response.data.cursor;
+          (response.data.changes || []).forEach((change: SongStatusChange) =>
+            onChangeRef.current(change)
+          );
+        } catch (error) {
+          console.error("Song status long poll failed:", error);
+          setConnected(false);
+          await new Promise((resolve) => setTimeout(resolve, 5000));
+        }
+      }
+    };
+
+    const fallBack = () => {
+      source?.close();
+      setConnected(false);
+      longPoll();
+    };
+
+    const open = async () => {
+      let url: string;
+      try {
+        url = await songService.getStreamUrl(API_ROUTES.songs.statusEvents);
+      } catch (error) {
+        console.error("Failed to get a song status events ticket:", error);
+        fallBack();
+        return;
+      }
+      if (stopped) return;
+      let received = false;
+      const stream = new EventSource(url);
+      source = stream;
+      stream.addEventListener("snapshot", () => {
+        received = true;
+        setConnected(true);
+      });
+      stream.addEventListener("status", (event) => {
+        onChangeRef.current(JSON.parse(event.data));
+      });
+      stream.addEventListener("stream_error", fallBack);
+      stream.onerror = () => {
+        // Network errors reconnect on their own, while the ticket is valid;
+        // HTTP errors close the stream. A stream that worked was most likely
+        // refused for its expired ticket, so it reopens with a new one.
+        if (stream.readyState !== EventSource.CLOSED) return;
+        if (received) {
+          stream.close();
+          setConnected(false);
+          open();
+        } else {
+          fallBack();
+        }
+      };
+    };
+
+    if (typeof EventSource === "undefined") {
+      longPoll();
+    } else {
+      open();
+    }
+
+    return () => {
+      stopped = true;
+      source?.close();
+    };
+  }, [enabled]);
+
+  return { connected };
+}
@@ -1,4 +1,4 @@
-import { API_ROUTES } from "@/config/api";
+import { API_ROUTES, constructUrl } from "@/config/api";
 import { axiosInstance } from "@/lib/axios";
 import { SongAnalysisResult } from "@/lib/schema";
 import { PaginatedResponse } from "@/types/common";
@@ -122,6 +122,19 @@ class SongService {
     }
   }
 
+  /**
+   * URL of an event stream endpoint carrying a fresh stream ticket.
+   * EventSource cannot send the Authorization header, and the ticket
+   * expires within seconds, unlike the access token, so it is only good for
+   * opening this connection.
+   */
+  async getStreamUrl(path: string): Promise<string> {
+    const response = await axiosInstance.post(API_ROUTES.songs.streamTicket);
+    return constructUrl(`${import.meta.env.VITE_API_BASE_URL}${path}`, {
+      ticket: response.data.ticket,
+    });
+  }
+
   toAnalysisResult(
     song: SongResponse | SongDetailResponse
   ): SongAnalysisResult {
@@ -1,5 +1,5 @@
 export interface PaginatedResponse<T> {
-  count: number;
+  count?: number;
   next: string | null;
   previous: string | null;
   results: T[];
@@ -12,6 +12,7 @@ import { Input } from "@/components/ui/input";
 import { toast } from "sonner";
 
 import { API_ROUTES } from "@/config/api";
+import { useSongEvents } from "@/hooks/useSongEvents";
 import axiosInstance from "@/lib/axios";
 import { SongFormValues, songFormSchema } from "@/lib/schema";
 import { songService } from "@/services/song";
@@ -73,28 +74,44 @@ const HomePage = () => {
     }
   };
 
+  const handleStatus = (data: { status: string; message?: string | null }) => {
+    if (data.status === "pending") {
+      setStatusMessage("Waiting to begin analysis...");
+    } else if (data.status === "processing") {
+      setStatusMessage("Analyzing lyrics...");
+    } else if (data.status === "completed") {
+      setStatusMessage("Analysis complete!");
+      setTimeout(() => {
+        navigate(`/songs/${songId}`);
+      }, 1500);
+    } else if (data.status === "error") {
+      setStatusMessage(data.message || "Analysis failed");
+    }
+  };
+
+  const {
+    stage,
+    summary: streamedSummary,
+    song: streamedSong,
+    failed: eventsFailed,
+  } = useSongEvents({
+    songId,
+    enabled: showProcessingModal,
+    onSong: handleStatus,
+  });
+
+  // Polling is only the fallback for when the event stream is unavailable
   const { data: songStatus } = useSWR(
-    startPolling && songId ? `${API_ROUTES.songs.status(songId)}` : null,
+    startPolling && songId && eventsFailed
+      ? `${API_ROUTES.songs.status(songId)}`
+      : null,
     statusFetcher,
     {
       refreshInterval: 2000,
       revalidateOnFocus: false,
       dedupingInterval: 1000,
       errorRetryCount: 5,
-      onSuccess: (data) => {
-        if (data.status === "pending") {
-          setStatusMessage("Waiting to begin analysis...");
-        } else if (data.status === "processing") {
-          setStatusMessage("Analyzing lyrics...");
-        } else if (data.status === "completed") {
-          setStatusMessage("Analysis complete!");
-          setTimeout(() => {
-            navigate(`/songs/${songId}`);
-          }, 1500);
-        } else if (data.status === "error") {
-          setStatusMessage(data.message || "Analysis failed");
-        }
-      },
+      onSuccess: handleStatus,
       onError: (err) => {
         console.error("Error polling song status:", err);
 
@@ -160,7 +177,14 @@ const HomePage = () => {
   const ProcessingModal = () => {
     const artist = form.getValues().artist;
     const title = form.getValues().title;
-    const status = songStatus?.status || "pending";
+    const status = streamedSong?.status || songStatus?.status || "pending";
+    const errorMessage = streamedSong?.message || songStatus?.message;
+    const progressMessage =
+      stage === "fetching_lyrics"
+        ? "Fetching lyrics..."
+        : stage === "analyzing"
+        ? "Analyzing lyrics..."
+        : statusMessage;
 
     return (
       <div className="fixed inset-0 bg-background/80 backdrop-blur-sm z-50 flex items-center justify-center">
@@ -195,10 +219,15 @@ const HomePage = () => {
                 </p>
               ) : status === "error" ? (
                 <p className="text-destructive">
-                  {songStatus?.message || "Unable to analyze this song"}
+                  {errorMessage || "Unable to analyze this song"}
                 </p>
               ) : (
-                <p className="text-muted-foreground">{statusMessage}</p>
+                <>
+                  <p className="text-muted-foreground">{progressMessage}</p>
+                  {streamedSummary && (
+                    <p className="mt-3 italic">{streamedSummary}</p>
+                  )}
+                </>
               )}
             </div>
 
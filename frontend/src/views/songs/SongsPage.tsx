@@ -31,19 +31,59 @@ import {
   TableRow,
 } from "@/components/ui/table";
 import { API_ROUTES } from "@/config/api";
+import {
+  SongStatusChange,
+  useSongStatusEvents,
+} from "@/hooks/useSongStatusEvents";
 import { formatDate } from "@/lib/utils";
 import { SongResponse, songService, SongStatusResponse } from "@/services/song";
+import { PaginatedResponse } from "@/types/common";
 
 const SongsPage = () => {
   const [pollingSongs, setPollingSongs] = useState<Record<string, boolean>>({});
 
+  const handleStatusChange = (change: SongStatusChange) => {
+    const finished = change.status === "completed" || change.status === "error";
+    if (finished && pollingSongs[change.songId]) {
+      if (change.status === "completed") {
+        toast.success("Song analysis completed");
+      } else {
+        toast.error("Song analysis failed", {
+          description: change.message || "Please try again",
+        });
+      }
+      setPollingSongs((prev) => ({
+        ...prev,
+        [change.songId]: false,
+      }));
+    }
+    // Patch the row in place; finished songs are refetched for their results
+    refreshSongs(
+      (current: PaginatedResponse<SongResponse> | undefined) =>
+        current && {
+          ...current,
+          results: current.results.map((song) =>
+            song.id === change.songId
+              ? { ...song, status: change.status, message: change.message }
+              : song
+          ),
+        },
+      { revalidate: finished }
+    );
+  };
+
+  const { connected: statusEventsConnected } = useSongStatusEvents({
+    onChange: handleStatusChange,
+  });
+
   const {
     data: songsResponse,
     mutate: refreshSongs,
     isLoading,
   } = useSWR(API_ROUTES.songs.base, {
     revalidateOnFocus: false,
-    refreshInterval: 10000,
+    // Status changes are pushed while the event stream is connected
+    refreshInterval: statusEventsConnected ? 0 : 10000,
     dedupingInterval: 3000,
     errorRetryCount: 3,
     onError: (err) => {
@@ -92,6 +132,9 @@ const SongsPage = () => {
 
       await songService.reanalyzeSong(songId);
       toast.success("Song queued for reanalysis");
+      refreshSongs();
+      if (statusEventsConnected) return;
+
       const { pollingFn, stopCondition, onSuccess, interval } =
         setupSongPolling(songId);
       const checkStatus = async () => {
@@ -119,7 +162,6 @@ const SongsPage = () => {
         }
       };
       checkStatus();
-      refreshSongs();
     } catch (err) {
       if (err instanceof Error) {
         let errorMessage = err.message;